@@ -1,38 +1,52 @@
+"""rules.json の申請の結論を出すルールに visa_type を追加し、ルールバンドル（app/data/rules.bundle）を作成
+
+中間結論のルールの visa_type は変更しない（ビザタイプごとのルールは申請の結論から
+依存関係をさかのぼって求められ、複数のビザタイプで共有されることがある。
+中間結論のルールに明示した visa_type は、そのビザタイプの起点として扱われる）。
+--bundle-only を指定した場合は rules.json を変更せず、ルールバンドルのみを作成する。
+"""
 import json
 import os
+import sys
+import tempfile
+import time
+
+from app.models.visa_index import is_application_conclusion, root_visa_type
+from app.services.rule_repository import DEFAULT_RULE_BUNDLE_FILE, RuleRepository, read_rules
 
 # ルールファイルのパス
 script_dir = os.path.dirname(os.path.abspath(__file__))
 rules_file = os.path.join(script_dir, 'app', 'data', 'rules.json')
+bundle_only = '--bundle-only' in sys.argv[1:]
 
 # ルールを読み込み
 with open(rules_file, 'r', encoding='utf-8') as f:
     data = json.load(f)
 
-# 各ルールにvisa_typeを追加
-for rule in data['rules']:
-    rule_id = rule['id']
-    conclusion = rule['conclusion']
-    conditions_text = ' '.join([c['fact_name'] for c in rule['conditions']])
-
-    # ルールIDと結論からビザタイプを判定
-    if 'Eビザ' in conclusion or 'Eビザ' in conditions_text:
-        rule['visa_type'] = 'E'
-    elif 'Lビザ' in conclusion or 'Blanket L' in conclusion or 'Lビザ' in conditions_text or 'Blanket L' in conditions_text:
-        rule['visa_type'] = 'L'
-    elif 'H-1B' in conclusion:
-        rule['visa_type'] = 'H-1B'
-    elif 'Bビザ' in conclusion or 'B-1' in conclusion:
-        rule['visa_type'] = 'B'
-    elif 'J-1' in conclusion:
-        rule['visa_type'] = 'J-1'
-    else:
-        # 中間結論の場合、Noneのまま（後で依存関係から推定される）
-        rule['visa_type'] = None
-
-# 保存
-with open(rules_file, 'w', encoding='utf-8') as f:
-    json.dump(data, f, ensure_ascii=False, indent=2)
-
-print('Updated rules.json with visa_type information')
-print(f'Total rules: {len(data["rules"])}')
+if not bundle_only:
+    # 申請の結論を出すルールにvisa_typeを追加（指定済みの値はそのまま）
+    for rule_data, rule in zip(data['rules'], read_rules(rules_file)):
+        # 中間結論のルールは依存関係から求められるため、明示した値があればそのまま残す
+        if is_application_conclusion(rule.conclusion):
+            rule_data['visa_type'] = root_visa_type(rule)
+
+    # 保存（稼働中のサーバーが書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える）
+    with tempfile.NamedTemporaryFile(
+        'w', encoding='utf-8', dir=os.path.dirname(rules_file), suffix='.tmp', delete=False
+    ) as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    # 一時ファイルは所有者のみ読み書きできるため、元のファイルの権限に合わせる
+    os.chmod(f.name, os.stat(rules_file).st_mode & 0o777)
+    os.replace(f.name, rules_file)
+
+    print('Updated rules.json with visa_type information')
+    print(f'Total rules: {len(data["rules"])}')
+
+# ルールバンドルを作成（サーバーは rules.json と内容が一致する場合のみ使う）
+started = time.perf_counter()
+rule_set = RuleRepository(rules_file, decision_trees_file=None, bundle_file=None).current
+rule_set.save_bundle(DEFAULT_RULE_BUNDLE_FILE)
+print(f'Saved rule bundle to {DEFAULT_RULE_BUNDLE_FILE} ({time.perf_counter() - started:.2f}s)')
+print(f'Rules version: {rule_set.rules_version}')
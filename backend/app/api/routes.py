@@ -1,211 +1,555 @@
 """API routes for the visa expert system"""
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Dict, List, Optional
+from fastapi import APIRouter, Cookie, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, StrictInt
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+import anyio
+import asyncio
 import json
 import os
+import tempfile
+from itertools import islice
 
-from ..models.knowledge_base import KnowledgeBase
-from ..models.rule import Rule
+from ..models.fact_table import FactKey, FactTable
+from ..services import metrics
+from ..services.batch import evaluate_batch
 from ..services.consultation import Consultation
+from ..services.encoded_response import EncodedResponse
+from ..services.event_stream import EventBuffer
+from ..services.outcome_cache import OutcomeCache
+from ..services.rule_repository import RuleRepository, RuleSet
+from ..services.rules_watcher import RulesWatcher
+from ..services.session_backends import create_session_backend
+from ..services.session_store import PersistentSessionStore, Session, SessionStore
 
 router = APIRouter()
 
-# グローバルな知識ベースと診断セッション
-kb = None
-consultation = None
+# ビザタイプごとのコンパイル済み知識ベース（全セッションで共有）
+rule_repository = RuleRepository()
 
+# rules.json の変更を監視して知識ベースを差し替える（RULES_RELOAD_INTERVAL=0 で無効）
+rules_watcher = RulesWatcher(rule_repository, interval=float(os.environ.get("RULES_RELOAD_INTERVAL", "2")))
 
-def auto_detect_visa_type(rule_data: dict) -> str:
-    """ルールからビザタイプを自動判定"""
-    conclusion = rule_data.get('conclusion', '')
-    conditions_text = ' '.join([c['fact_name'] for c in rule_data.get('conditions', [])])
+# 回答の組み合わせごとの推論結果（全セッションで共有）
+outcome_cache = OutcomeCache(max_entries=int(os.environ.get("OUTCOME_CACHE_SIZE", "50000")))
 
-    # 結論または条件にビザタイプのキーワードが含まれているか確認
-    if 'Eビザ' in conclusion or 'Eビザ' in conditions_text:
-        return 'E'
-    elif 'Lビザ' in conclusion or 'Blanket L' in conclusion or 'Lビザ' in conditions_text or 'Blanket L' in conditions_text:
-        return 'L'
-    elif 'H-1B' in conclusion or 'H-1B' in conditions_text:
-        return 'H-1B'
-    elif 'Bビザ' in conclusion or 'B-1' in conclusion or 'Bビザ' in conditions_text:
-        return 'B'
-    elif 'J-1' in conclusion or 'J-1' in conditions_text:
-        return 'J-1'
+# 一括診断のアップロードをメモリに保持する上限（超えた分は一時ファイルに書き出す）
+BATCH_SPOOL_BYTES = 1024 * 1024
 
-    return None
+# 一括診断の結果を1回のスレッドでの処理で求めて送る件数
+BATCH_RESPONSE_RECORDS = 256
 
 
-def load_knowledge_base(visa_type: str = None):
-    """知識ベースをJSONファイルから読み込み"""
-    kb = KnowledgeBase(visa_type=visa_type)
+def _new_consultation(rule_set: RuleSet, visa_type: Optional[str]) -> Consultation:
+    """ルール一式の知識ベースと決定木を使う診断セッションを作成"""
+    return Consultation(
+        rule_set.get(visa_type),
+        outcome_cache=outcome_cache,
+        decision_tree=rule_set.get_decision_tree(visa_type)
+    )
+
+
+def _restore_consultation(state: Dict) -> Consultation:
+    """保存された状態（回答とルールのバージョン）から診断セッションを復元"""
+    # 開始時のルールがこのプロセスにない場合は、現在のルールで回答を再現する
+    rule_set = rule_repository.get_rule_set(state["rules_version"]) or rule_repository.current
+    consultation = _new_consultation(rule_set, state["visa_type"])
+    fact_table = consultation.kb.fact_table
+    consultation.replay([(fact_table.intern(fact_name), answer) for fact_name, answer in state["answers"]])
+    return consultation
+
+
+# セッションIDをキーにした診断セッション
+# SESSION_BACKEND=memory（既定）はプロセス内に保持し、TTLとLRUでメモリ使用量を制限する。
+# sqlite / redis は複数のワーカー・インスタンスで共有する保存先に回答のみを保存する。
+SESSION_COOKIE_NAME = "session_id"
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", "1800"))
+session_backend = create_session_backend(os.environ.get("SESSION_BACKEND", "memory"))
+if session_backend is None:
+    session_store = SessionStore(
+        max_sessions=int(os.environ.get("MAX_SESSIONS", "10000")),
+        ttl_seconds=SESSION_TTL_SECONDS,
+    )
+else:
+    session_store = PersistentSessionStore(
+        session_backend, _restore_consultation, ttl_seconds=SESSION_TTL_SECONDS
+    )
+
+
+# SSE の接続ごとに溜めるイベントの上限（超えた場合は状態全体を送り直す）
+STREAM_BUFFER_EVENTS = int(os.environ.get("STREAM_BUFFER_EVENTS", "256"))
+
+# イベントがない間、接続を維持するためのコメントを送る間隔（秒）
+STREAM_HEARTBEAT_SECONDS = 15.0
+
+# 1つの接続を維持する最長の時間（秒）。EventSource は切断後に自動で再接続する。
+# 開いたままの接続がサーバーの停止（graceful shutdown）を妨げないようにする
+STREAM_MAX_SECONDS = float(os.environ.get("STREAM_MAX_SECONDS", "300"))
+
+# 切断後に EventSource が再接続するまでの待ち時間（ミリ秒）
+STREAM_RETRY_MS = 3000
+
+# 推論やファイルの読み込みなどブロッキングする処理を実行するスレッド数の上限
+blocking_limiter = anyio.CapacityLimiter(int(os.environ.get("INFERENCE_THREADS", "8")))
+
+# 別のワーカーと同時に更新した場合に、診断セッションへの操作をやり直す回数の上限
+SAVE_ATTEMPTS = 3
+
+T = TypeVar("T")
+
+
+async def run_blocking(func: Callable[..., T], *args) -> T:
+    """ブロッキングする処理をイベントループの外（上限付きのスレッド）で実行"""
+    if metrics.enabled:
+        func = metrics.profiled(func)
+    return await anyio.to_thread.run_sync(func, *args, limiter=blocking_limiter)
+
+
+async def run_in_session(session: Session, func: Callable[..., T], *args, save: bool = False) -> T:
+    """セッションのロックを取得して、診断セッションへの操作をスレッドで実行
+
+    同じセッションへの操作はセッションごとのロックで1つずつ実行し、
+    異なるセッションの操作は並行して実行する。順番待ちはイベントループ上のロックで行い、
+    上限付きのスレッドは実行できる操作にのみ使う。操作の前にセッションを保存先の状態に合わせ、
+    save が True の場合は操作後の状態を保存する。別のワーカーが先に保存していた場合は、
+    その状態から作り直して操作をやり直す（SAVE_ATTEMPTS 回で保存できなければ 409）。
+    """
+    def locked():
+        with session.lock:
+            for _ in range(SAVE_ATTEMPTS):
+                if not session_store.sync(session):
+                    raise HTTPException(status_code=400, detail="診断セッションが開始されていません")
+                result = func(session.consultation, *args)
+                if not save or session_store.save(session):
+                    return result
+        raise HTTPException(status_code=409, detail="診断セッションが別のリクエストで更新されました")
 
-    # JSONファイルのパスを取得
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(current_dir, "..", "data")
-    rules_file = os.path.join(data_dir, "rules.json")
+    async with session.async_lock:
+        return await run_blocking(locked)
 
-    # ルールを読み込み
-    with open(rules_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
 
-    for rule_data in data["rules"]:
-        # ビザタイプが指定されていない場合は自動判定
-        if 'visa_type' not in rule_data or rule_data['visa_type'] is None:
-            rule_data['visa_type'] = auto_detect_visa_type(rule_data)
+async def get_session(
+    x_session_id: Optional[str] = Header(default=None),
+    session_id: Optional[str] = Cookie(default=None),
+) -> Session:
+    """リクエストのセッションID（X-Session-ID ヘッダーまたはCookie）からセッションを取得"""
+    # 保存先からの読み込みは、Starlette のスレッドプールではなく上限付きのスレッドで行う
+    session = await run_blocking(session_store.get, x_session_id or session_id)
+    if session is None:
+        raise HTTPException(status_code=400, detail="診断セッションが開始されていません")
+    return session
+
+
+# リクエストで事実を指定する値（真偽値は ID として受け付けない）
+FactRef = Union[StrictInt, str]
+
+
+def _fact_name(consultation: Consultation, fact: FactRef) -> str:
+    """リクエストの事実（事実名または GET /facts の ID）を、知識ベースの事実名に変換"""
+    fact_table = consultation.kb.fact_table
+    if isinstance(fact, int):
+        fact_name = fact_table.get_name(fact)
+        if fact_name is None:
+            raise HTTPException(status_code=400, detail="不明な事実の ID です")
+        return fact_name
+    return fact_table.intern(fact)
 
-        rule = Rule(**rule_data)
-        kb.add_rule(rule)
 
-    kb.finalize()
-    return kb
+# 事実名を値に持つ応答・イベントの項目（fact_ids=true の場合に ID に変換する）
+_FACT_FIELDS = ("next_question", "previous_question", "current_question", "fact_name", "conclusion")
+_FACT_LIST_FIELDS = ("conclusions", "removed_facts", "question_history")
+_FACT_DICT_FIELDS = ("facts", "answer_history")
+
+
+def _encode_fact_ids(fact_table: FactTable, data: Dict[str, Any]) -> Dict[str, Any]:
+    """応答・イベントの事実名を ID に変換した複製"""
+    encoded = dict(data)
+    for field in _FACT_FIELDS:
+        if field in encoded:
+            encoded[field] = fact_table.to_key(encoded[field])
+    for field in _FACT_LIST_FIELDS:
+        if field in encoded:
+            encoded[field] = fact_table.to_keys(encoded[field])
+    for field in _FACT_DICT_FIELDS:
+        if field in encoded:
+            encoded[field] = fact_table.to_key_dict(encoded[field])
+    if "rules" in encoded:
+        encoded["rules"] = [fact_table.encode_rule(rule) for rule in encoded["rules"]]
+    return encoded
 
 
 # Request/Response models
+# 事実は事実名（文字列）と GET /facts の ID（整数）のどちらでも指定でき、
+# fact_ids=true を指定すると応答の事実も ID で返す
 class StartRequest(BaseModel):
     visa_type: str  # E, L, B, H-1B, J-1
 
 
 class AnswerRequest(BaseModel):
-    question: str
+    question: FactRef
     answer: bool
 
 
+class BackRequest(BaseModel):
+    steps: int = 1  # 何個前の質問に戻るか
+    question: Optional[FactRef] = None  # 指定した場合はこの質問まで戻る
+
+
 class StartResponse(BaseModel):
-    next_question: Optional[str]
+    next_question: Optional[FactKey]
     visa_type: str
+    session_id: str
+    rules_version: Optional[str] = None
 
 
 class AnswerResponse(BaseModel):
-    next_question: Optional[str]
-    conclusions: List[str]
+    next_question: Optional[FactKey]
+    conclusions: List[FactKey]
     is_finished: bool
 
 
 class VisualizationResponse(BaseModel):
+    version: str  # 次の要求の since に指定すると差分のみを取得できる
+    full: bool  # False の場合は since の版からの差分
+    total_rules: int  # 分割前のルールの件数
     rules: List[Dict]
-    facts: Dict[str, bool]
+    facts: Dict[FactKey, bool]
+    removed_facts: List[FactKey]  # 差分で不明に戻った事実
     fired_rules: List[str]
-    question_history: List[str]
-    answer_history: Dict[str, bool]
+    question_history: List[FactKey]
+    answer_history: Dict[FactKey, bool]
+
+
+def _start_session(visa_type: str):
+    """診断セッションを作成して最初の質問を求める"""
+    # 選択されたビザタイプのコンパイル済み知識ベースを取得
+    # （セッションは開始時のバージョンのルールを使い続ける）
+    rule_set = rule_repository.current
+    if visa_type not in rule_set.visa_types():
+        raise HTTPException(status_code=400, detail=f"不明なビザタイプです: {visa_type}")
+    consultation = _new_consultation(rule_set, visa_type)
+    consultation.start()
+    session = session_store.create(consultation)
+
+    with session.lock:
+        next_question = consultation.get_next_question()
+    return session, next_question
 
 
 @router.post("/consultation/start", response_model=StartResponse)
-async def start_consultation(request: StartRequest):
+async def start_consultation(request: StartRequest, response: Response, fact_ids: bool = False):
     """診断セッションを開始"""
-    global consultation, kb
-
-    # 選択されたビザタイプで知識ベースを読み込み
-    kb = load_knowledge_base(visa_type=request.visa_type)
-
-    consultation = Consultation(kb)
-    consultation.start()
-
-    next_question = consultation.get_next_question()
+    session, next_question = await run_blocking(_start_session, request.visa_type)
+    kb = session.consultation.kb
+
+    response.set_cookie(
+        SESSION_COOKIE_NAME,
+        session.session_id,
+        max_age=int(session_store.ttl_seconds),
+        httponly=True,
+        samesite="lax",
+    )
 
-    return StartResponse(next_question=next_question, visa_type=request.visa_type)
+    if fact_ids:
+        next_question = kb.fact_table.to_key(next_question)
+    return StartResponse(
+        next_question=next_question,
+        visa_type=request.visa_type,
+        session_id=session.session_id,
+        rules_version=kb.rules_version
+    )
 
 
 @router.post("/consultation/answer", response_model=AnswerResponse)
-async def answer_question(request: AnswerRequest):
+async def answer_question(
+    request: AnswerRequest, fact_ids: bool = False, session: Session = Depends(get_session)
+):
     """質問に回答"""
-    global consultation
-
-    if consultation is None:
-        raise HTTPException(status_code=400, detail="診断セッションが開始されていません")
-
-    consultation.answer_question(request.question, request.answer)
-
-    next_question = consultation.get_next_question()
-    conclusions = consultation.get_conclusions()
-    is_finished = consultation.is_finished()
-
-    return AnswerResponse(
-        next_question=next_question,
-        conclusions=conclusions,
-        is_finished=is_finished
-    )
+    def answer(consultation: Consultation) -> AnswerResponse:
+        consultation.answer_question(_fact_name(consultation, request.question), request.answer)
+        next_question = consultation.get_next_question()
+        conclusions = consultation.get_conclusions()
+        if fact_ids:
+            fact_table = consultation.kb.fact_table
+            next_question = fact_table.to_key(next_question)
+            conclusions = fact_table.to_keys(conclusions)
+        return AnswerResponse(
+            next_question=next_question,
+            conclusions=conclusions,
+            is_finished=consultation.is_finished()
+        )
+
+    return await run_in_session(session, answer, save=True)
 
 
 @router.post("/consultation/back")
-async def go_back():
-    """前の質問に戻る"""
-    global consultation
-
-    if consultation is None:
-        raise HTTPException(status_code=400, detail="診断セッションが開始されていません")
-
-    previous_question = consultation.go_back()
-
-    return {
-        "previous_question": previous_question,
-        "current_question": consultation.question_history[-1] if consultation.question_history else None
-    }
+async def go_back(
+    request: Optional[BackRequest] = None,
+    fact_ids: bool = False,
+    session: Session = Depends(get_session),
+):
+    """前の質問に戻る（steps で複数個前、question で指定した質問まで戻る）"""
+    request = request or BackRequest()
+
+    def back(consultation: Consultation) -> Dict:
+        if request.question is not None:
+            question = _fact_name(consultation, request.question)
+            if question not in consultation.question_history:
+                raise HTTPException(status_code=400, detail="指定された質問は質問履歴にありません")
+            previous_question = consultation.jump_to_question(question)
+        else:
+            previous_question = consultation.go_back(request.steps)
+        result = {
+            "previous_question": previous_question,
+            "current_question": consultation.question_history[-1] if consultation.question_history else None
+        }
+        return _encode_fact_ids(consultation.kb.fact_table, result) if fact_ids else result
+
+    return await run_in_session(session, back, save=True)
 
 
 @router.post("/consultation/restart", response_model=StartResponse)
-async def restart_consultation():
+async def restart_consultation(fact_ids: bool = False, session: Session = Depends(get_session)):
     """診断を最初からやり直し"""
-    global consultation
+    def restart(consultation: Consultation) -> StartResponse:
+        consultation.restart()
+        next_question = consultation.get_next_question()
+        if fact_ids:
+            next_question = consultation.kb.fact_table.to_key(next_question)
+        return StartResponse(
+            next_question=next_question,
+            visa_type=consultation.kb.visa_type,
+            session_id=session.session_id,
+            rules_version=consultation.kb.rules_version
+        )
 
-    if consultation is None:
-        raise HTTPException(status_code=400, detail="診断セッションが開始されていません")
-
-    consultation.restart()
-    next_question = consultation.get_next_question()
-
-    return StartResponse(next_question=next_question)
+    return await run_in_session(session, restart, save=True)
 
 
 @router.get("/consultation/visualization", response_model=VisualizationResponse)
-async def get_visualization():
-    """推論過程の可視化データを取得"""
-    global consultation
-
-    if consultation is None:
+async def get_visualization(
+    since: Optional[str] = None,
+    reachable_only: bool = False,
+    offset: int = Query(default=0, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1),
+    fact_ids: bool = False,
+    session: Session = Depends(get_session),
+):
+    """推論過程の可視化データを取得
+
+    since に前回の version を指定すると変更されたルールと事実のみを返し、
+    reachable_only で今後発火し得るルールに絞り込み、offset / limit でルールを分割して返す。
+    """
+    def visualize(consultation: Consultation) -> VisualizationResponse:
+        data = consultation.get_visualization_data(since, reachable_only, offset, limit)
+        if fact_ids:
+            data = _encode_fact_ids(consultation.kb.fact_table, data)
+        return VisualizationResponse(**data)
+
+    return await run_in_session(session, visualize)
+
+
+def _format_event(event: str, data: Dict, event_id: int) -> str:
+    """イベントを SSE の形式に変換"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/consultation/stream")
+async def stream_consultation(
+    request: Request,
+    session_id_query: Optional[str] = Query(default=None, alias="session_id"),
+    x_session_id: Optional[str] = Header(default=None),
+    session_id: Optional[str] = Cookie(default=None),
+    fact_ids: bool = False,
+):
+    """推論の過程を Server-Sent Events で送信
+
+    最初に現在の状態全体（state）を送り、以降は事実の確定（fact）・ルールの発火（rule_fired）・
+    次の質問（question）を推論エンジンが処理した順に送る。前の質問に戻ったときや、
+    クライアントの読み出しが遅くバッファがあふれたときは state を送り直す。
+    EventSource はヘッダーを設定できないため、?session_id= でもセッションを指定できる。
+    """
+    session = await run_blocking(session_store.get, session_id_query or x_session_id or session_id)
+    if session is None:
         raise HTTPException(status_code=400, detail="診断セッションが開始されていません")
-
-    viz_data = consultation.get_visualization_data()
-
-    return VisualizationResponse(**viz_data)
+    buffer = EventBuffer(asyncio.get_running_loop(), max_events=STREAM_BUFFER_EVENTS)
+
+    def subscribe(consultation: Consultation) -> Dict:
+        state = consultation.get_state()
+        consultation.add_listener(buffer.put)
+        return state
+
+    def unsubscribe(consultation: Consultation):
+        consultation.remove_listener(buffer.put)
+
+    state = await run_in_session(session, subscribe)
+
+    def format_event(event: str, data: Dict, event_id: int) -> str:
+        if fact_ids:
+            # ルールの再読み込みで診断が置き換わった後は、新しい知識ベースの ID で送る
+            data = _encode_fact_ids(session.consultation.kb.fact_table, data)
+        return _format_event(event, data, event_id)
+
+    async def generate():
+        event_id = 0
+        deadline = anyio.current_time() + STREAM_MAX_SECONDS
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n" + format_event("state", state, event_id)
+            while not await request.is_disconnected():
+                remaining = deadline - anyio.current_time()
+                if remaining <= 0:
+                    break
+                events, overflowed = await buffer.get(timeout=min(STREAM_HEARTBEAT_SECONDS, remaining))
+                if overflowed:
+                    # 捨てたイベントの代わりに現在の状態全体を送る
+                    events = [("state", await run_in_session(session, Consultation.get_state))]
+                if not events:
+                    yield ": keep-alive\n\n"
+                for event, data in events:
+                    event_id += 1
+                    yield format_event(event, data, event_id)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await run_in_session(session, unsubscribe)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/consultation/conclusions")
-async def get_conclusions():
+async def get_conclusions(fact_ids: bool = False, session: Session = Depends(get_session)):
     """診断結果を取得"""
-    global consultation
-
-    if consultation is None:
-        raise HTTPException(status_code=400, detail="診断セッションが開始されていません")
-
-    conclusions = consultation.get_conclusions()
+    conclusions = await run_in_session(session, Consultation.get_conclusions)
+    if fact_ids:
+        conclusions = session.consultation.kb.fact_table.to_keys(conclusions)
 
     return {"conclusions": conclusions}
 
 
-@router.get("/rules")
-async def get_all_rules():
-    """すべてのルールを取得"""
-    global kb
+@router.post("/consultations/evaluate")
+async def evaluate_consultations(request: Request, workers: int = Query(default=0, ge=0)):
+    """NDJSON の (visa_type, answers) を一括で推論し、結果を NDJSON で返す
+
+    1行に {"id": 任意, "visa_type": "E", "answers": {事実名: 真偽値}} を1件ずつ送る。
+    結果は入力と同じ順序で、結論と残りの質問（または error）を1行ずつ返す。
+    workers が2以上の場合はプロセスプールで並列に推論する。
+    """
+    # 大きなアップロードでもメモリを使い切らないよう、一定量を超えたら一時ファイルに書き出す
+    upload = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_BYTES)
+    async for chunk in request.stream():
+        if upload.tell() + len(chunk) > BATCH_SPOOL_BYTES:
+            # ファイルへの書き出しはイベントループの外で行う
+            await run_blocking(upload.write, chunk)
+        else:
+            upload.write(chunk)
+    await run_blocking(upload.seek, 0)
+    rule_set = await run_blocking(lambda: rule_repository.current)
+    results = evaluate_batch(upload, rule_set, workers=workers)
+
+    def next_lines() -> str:
+        """次の BATCH_RESPONSE_RECORDS 件の結果を NDJSON に変換（終わりなら空文字列）"""
+        return "".join(
+            json.dumps(result, ensure_ascii=False) + "\n"
+            for result in islice(results, BATCH_RESPONSE_RECORDS)
+        )
+
+    def close():
+        results.close()
+        upload.close()
+
+    async def generate():
+        # 推論は上限付きのスレッドでまとまりごとに実行する
+        try:
+            while True:
+                lines = await run_blocking(next_lines)
+                if not lines:
+                    break
+                yield lines
+        finally:
+            with anyio.CancelScope(shield=True):
+                await run_blocking(close)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.get("/stats")
+async def get_stats():
+    """セッション数と推論結果キャッシュの統計を取得"""
+    return {
+        "sessions": len(session_store),
+        "outcome_cache": outcome_cache.get_stats()
+    }
 
-    if kb is None:
-        load_knowledge_base()
 
+@router.get("/rules/version")
+async def get_rules_version():
+    """現在のルール定義のバージョン（rules.json の内容のハッシュ値）を取得"""
+    rule_set = await run_blocking(lambda: rule_repository.current)
     return {
-        "rules": [rule.dict() for rule in kb.rules]
+        "rules_version": rule_set.rules_version,
+        "visa_types": rule_set.visa_types()
     }
 
 
-@router.get("/facts")
-async def get_all_facts():
-    """すべての事実を取得"""
-    global kb
+async def encoded_response(
+    request: Request, visa_type: Optional[str], key: Tuple, build: Callable[[RuleSet], Dict]
+) -> Response:
+    """現在のルール一式から作る応答を、ルールのバージョンごとに一度だけエンコードして返す
 
-    if kb is None:
-        load_knowledge_base()
+    ETag・Last-Modified による条件付きリクエスト（304）と、圧縮済みの本文（gzip / br）に対応する。
+    ルールにないビザタイプは、応答をキャッシュに追加する前に 400 にする。
+    """
+    def get_response() -> EncodedResponse:
+        rule_set = rule_repository.current
+        if visa_type is not None and visa_type not in rule_set.visa_types():
+            raise HTTPException(status_code=400, detail=f"不明なビザタイプです: {visa_type}")
+        return rule_set.get_response(key, build)
 
-    return {
-        "all_facts": list(kb.all_fact_names),
-        "basic_facts": list(kb.basic_facts),
-        "derivable_facts": list(kb.derivable_facts)
-    }
+    encoded = await run_blocking(get_response)
+    return encoded.respond(request)
+
+
+@router.get("/rules")
+async def get_all_rules(request: Request, visa_type: Optional[str] = None, fact_ids: bool = False):
+    """すべてのルールを取得（visa_type 指定時はそのビザタイプのルールのみ）"""
+    def build(rule_set: RuleSet) -> Dict:
+        kb = rule_set.get(visa_type)
+        rules = [rule.to_dict() for rule in kb.rules]
+        if fact_ids:
+            rules = [kb.fact_table.encode_rule(rule) for rule in rules]
+        return {
+            "rules": rules
+        }
+
+    return await encoded_response(request, visa_type, ("rules", visa_type, fact_ids), build)
+
+
+@router.get("/facts")
+async def get_all_facts(request: Request, visa_type: Optional[str] = None, fact_ids: bool = False):
+    """すべての事実と事実の ID を取得（visa_type 指定時はそのビザタイプの事実のみ）
+
+    fact_ids の対応表（事実名 → ID）はルールのバージョン（rules_version）ごとに固定で、
+    ID はそのバージョンで開始した診断セッションのリクエストと応答で使える。
+    """
+    def build(rule_set: RuleSet) -> Dict:
+        kb = rule_set.get(visa_type)
+        fact_table = kb.fact_table
+        # 事実の一覧は定義順（ID 順）に並べ、どのワーカーでも同じ本文（ETag）になるようにする
+        all_facts = [fact_name for fact_name in fact_table.names if fact_name in kb.all_fact_names]
+        facts = {
+            "all_facts": all_facts,
+            "basic_facts": [fact_name for fact_name in all_facts if fact_name in kb.basic_facts],
+            "derivable_facts": [fact_name for fact_name in all_facts if fact_name in kb.derivable_facts]
+        }
+        if fact_ids:
+            facts = {name: fact_table.to_keys(fact_names) for name, fact_names in facts.items()}
+        return {
+            **facts,
+            "rules_version": kb.rules_version,
+            "fact_ids": {fact_name: fact_table.ids[fact_name] for fact_name in all_facts}
+        }
+
+    return await encoded_response(request, visa_type, ("facts", visa_type, fact_ids), build)
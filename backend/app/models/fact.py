@@ -1,14 +1,26 @@
 """Fact クラス - エキスパートシステムの事実を表現"""
 from typing import Optional
-from pydantic import BaseModel
 
 
-class Fact(BaseModel):
+class Fact:
     """事実を表すクラス"""
-    name: str
-    value: Optional[bool] = None
-    is_derived: bool = False  # 推論で導出された事実かどうか
-    derived_from_rule: Optional[str] = None  # どのルールから導出されたか
+
+    __slots__ = ("name", "value", "is_derived", "derived_from_rule")
+
+    def __init__(
+        self,
+        name: str,
+        value: Optional[bool] = None,
+        is_derived: bool = False,  # 推論で導出された事実かどうか
+        derived_from_rule: Optional[str] = None,  # どのルールから導出されたか
+    ):
+        self.name = name
+        self.value = value
+        self.is_derived = is_derived
+        self.derived_from_rule = derived_from_rule
+
+    def __repr__(self) -> str:
+        return f"Fact(name={self.name!r}, value={self.value!r})"
 
     def __hash__(self):
         return hash(self.name)
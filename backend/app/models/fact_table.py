@@ -0,0 +1,72 @@
+"""FactTable クラス - 事実名と短い整数の ID の対応表"""
+from typing import Dict, Iterable, List, Optional, Union
+
+from .rule import Rule
+
+# API で事実を表す値（表にある事実は ID、ない事実は事実名のまま）
+FactKey = Union[int, str]
+
+
+class FactTable:
+    """事実名と短い整数の ID の対応表（ルール一式で共有し、変更しない）
+
+    ID はルールの定義順（条件 → 結論）に事実名が初めて現れた順の通し番号で、
+    同じ rules.json からはどのプロセスでも同じ ID になる（ルールバンドルの事実名の表と同じ順）。
+    API の入力の事実名は intern() で表の文字列に置き換え、セッション間で共有する。
+    """
+
+    def __init__(self, names: List[str]):
+        self.names = names  # ID → 事実名
+        self.ids: Dict[str, int] = {name: fact_id for fact_id, name in enumerate(names)}
+
+    @classmethod
+    def from_rules(cls, rules: Iterable[Rule]) -> "FactTable":
+        """ルールに現れる事実名から対応表を作成"""
+        ids: Dict[str, None] = {}
+        for rule in rules:
+            for cond in rule.conditions:
+                ids.setdefault(cond.fact_name, None)
+            ids.setdefault(rule.conclusion, None)
+        return cls(list(ids))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get_name(self, fact_id: int) -> Optional[str]:
+        """ID に対応する事実名（ない場合は None）"""
+        if 0 <= fact_id < len(self.names):
+            return self.names[fact_id]
+        return None
+
+    def intern(self, fact_name: str) -> str:
+        """表にある事実名は表の文字列を返す（同じ事実名の文字列を重複して保持しない）"""
+        fact_id = self.ids.get(fact_name)
+        return fact_name if fact_id is None else self.names[fact_id]
+
+    def to_key(self, fact_name: Optional[str]) -> Optional[FactKey]:
+        """事実名を API で返す値に変換（表にない事実名はそのまま）"""
+        if fact_name is None:
+            return None
+        return self.ids.get(fact_name, fact_name)
+
+    def to_keys(self, fact_names: Iterable[str]) -> List[FactKey]:
+        """事実名の一覧を API で返す値の一覧に変換"""
+        ids = self.ids
+        return [ids.get(fact_name, fact_name) for fact_name in fact_names]
+
+    def to_key_dict(self, values: Dict[str, bool]) -> Dict[FactKey, bool]:
+        """事実名をキーにした辞書を、API で返す値をキーにした辞書に変換"""
+        ids = self.ids
+        return {ids.get(fact_name, fact_name): value for fact_name, value in values.items()}
+
+    def encode_rule(self, rule: Dict) -> Dict:
+        """ルールまたはルールの状態（辞書）の事実名を API で返す値に変換した複製"""
+        ids = self.ids
+        return {
+            **rule,
+            "conditions": [
+                {**cond, "fact_name": ids.get(cond["fact_name"], cond["fact_name"])}
+                for cond in rule["conditions"]
+            ],
+            "conclusion": ids.get(rule["conclusion"], rule["conclusion"]),
+        }
@@ -1,32 +1,107 @@
 """KnowledgeBase クラス - ルールと事実の知識ベースを管理"""
-from typing import Dict, List, Set, Optional
+import hashlib
+import heapq
+from collections import deque
+from typing import Dict, FrozenSet, List, Set, Optional, Tuple
 from .rule import Rule
 from .fact import Fact
+from .fact_table import FactTable
+from .visa_index import build_visa_type_index, is_application_conclusion
+
+
+def bit_indices(mask: int) -> List[int]:
+    """ビットマスクで立っているビットの位置を昇順に取得
+
+    大きな整数のビットを1つずつ取り出すと1回ごとに整数全体を複製するため、
+    2進数の文字列にしてから探す。
+    """
+    bits = bin(mask)[:1:-1]
+    indices = []
+    index = bits.find("1")
+    while index >= 0:
+        indices.append(index)
+        index = bits.find("1", index + 1)
+    return indices
 
 
 class KnowledgeBase:
-    """知識ベースを管理するクラス"""
+    """知識ベースを管理するクラス
+
+    finalize() 後は変更されず、複数の診断セッションで共有される。
+    事実の値（セッションごとの状態）は InferenceEngine が保持する。
+    """
 
-    def __init__(self, visa_type: Optional[str] = None):
+    def __init__(
+        self,
+        visa_type: Optional[str] = None,
+        rules_version: Optional[str] = None,
+        fact_table: Optional[FactTable] = None,
+    ):
         self.all_rules: List[Rule] = []  # すべてのルール
         self.rules: List[Rule] = []  # フィルタリングされたルール
-        self.facts: Dict[str, bool] = {}
         self.all_fact_names: Set[str] = set()
         self.derivable_facts: Set[str] = set()  # 他のルールから導出可能な事実
         self.basic_facts: Set[str] = set()  # 利用者に質問すべき基本事実
         self.visa_type: Optional[str] = visa_type  # フィルタリング対象のビザタイプ
+        self.rules_version: Optional[str] = rules_version  # ルール定義のバージョン（ハッシュ値）
+        self.rules_digest: Optional[str] = None  # フィルタリングされたルールの並び（ID）のハッシュ値
+        # API で使う事実の ID の対応表（すべてのルールから作成し、ビザタイプ間で共有する）
+        self.fact_table: Optional[FactTable] = fact_table
+        self.rules_by_id: Dict[str, Rule] = {}  # ルールID → ルール
+        self.rules_by_conclusion: Dict[str, List[Rule]] = {}  # 事実名 → その事実を結論とするルール
+        self.rules_by_condition: Dict[str, List[Rule]] = {}  # 事実名 → その事実を条件に持つルール
+        self.needed_facts: Dict[str, FrozenSet[str]] = {}  # ルールID → 条件の事実名
+        self.dependent_facts: Dict[str, FrozenSet[str]] = {}  # 事実名 → 推移的に依存する導出事実
+        self.topological_facts: List[str] = []  # 条件 → 結論の順に並べた事実名
+        # 事実名 → ルールの定義順での通し番号（事実の状態のビット位置）
+        self.fact_index: Dict[str, int] = {}
+        self.fact_names: List[str] = []  # 通し番号 → 事実名
+        # 結論の事実の番号 → それを結論とするルールが必要とする (基本事実の番号, 優先度 + 1) の一覧
+        self.question_weights: List[List[Tuple[int, int]]] = []
+        self.conclusion_facts: List[str] = []  # 診断結果として扱う事実（定義順）
+        self.has_conflicting_conclusions = False
+
+        # ルールの位置ごとにコンパイルしたビットマスク（推論エンジン用）。
+        # ルールの条件の事実は番号が近いことが多いため、条件の事実の最小の番号（mask_offsets）を
+        # 基準にずらして保持する（事実の数だけの幅のマスクをルールごとに持たない）
+        self.mask_offsets: List[int] = []  # 条件のビットマスクの基準の事実の番号
+        self.condition_masks: List[int] = []  # 条件に現れるすべての事実
+        self.required_masks: List[int] = []  # True であることを要求する事実
+        self.forbidden_masks: List[int] = []  # False であることを要求する事実
+        self.conclusion_indices: List[int] = []  # 結論の事実の番号
+        self.is_and_rule: List[bool] = []  # 演算子が AND か
+        self.consumer_positions: List[List[int]] = []  # 事実の番号 → それを条件に持つルールの位置
+        self.producer_positions: List[List[int]] = []  # 事実の番号 → それを結論とするルールの位置
+        self.rule_positions: Dict[str, int] = {}  # ルールID → ルールの位置
+        self.basic_mask = 0  # 基本事実
+        self.derivable_mask = 0  # 導出可能な事実
+        self.conclusion_mask = 0  # 診断結果として扱う事実
+        # 事実が1つも判明していない状態の推論エンジンの照合状態（診断の開始時に複製して使う）
+        self.initial_agenda: List[Tuple[int, int]] = []
+        self.initial_scores: List[int] = []
+        self.initial_question_queue: List[Tuple[int, int]] = []
 
     def add_rule(self, rule: Rule):
         """ルールを追加"""
         self.all_rules.append(rule)
 
-    def finalize(self):
-        """知識ベースの初期化を完了（基本事実と導出可能な事実を分類）"""
+    def finalize(self, filtered_rules: Optional[List[Rule]] = None):
+        """知識ベースの初期化を完了（基本事実と導出可能な事実を分類）
+
+        filtered_rules を指定した場合は、ビザタイプでのフィルタリングを省略してそのルールを使う。
+        """
         # ビザタイプでフィルタリング
-        if self.visa_type:
+        if filtered_rules is not None:
+            self.rules = filtered_rules
+        elif self.visa_type:
             self.rules = self._filter_rules_by_visa_type(self.visa_type)
         else:
             self.rules = self.all_rules
+        if self.fact_table is None:
+            self.fact_table = FactTable.from_rules(self.all_rules)
+        self.rules_digest = hashlib.sha256(
+            "\n".join(rule.id for rule in self.rules).encode("utf-8")
+        ).hexdigest()[:16]
 
         # フィルタリングされたルールから事実を収集
         for rule in self.rules:
@@ -37,45 +112,169 @@ class KnowledgeBase:
                 self.all_fact_names.add(cond.fact_name)
             self.all_fact_names.add(rule.conclusion)
 
+            self.rules_by_id[rule.id] = rule
+            self.rules_by_conclusion.setdefault(rule.conclusion, []).append(rule)
+            needed = frozenset(cond.fact_name for cond in rule.conditions)
+            self.needed_facts[rule.id] = needed
+            for fact_name in needed:
+                self.rules_by_condition.setdefault(fact_name, []).append(rule)
+
         # 導出可能な事実以外は基本事実
         self.basic_facts = self.all_fact_names - self.derivable_facts
+        self.fact_names = self._fact_names_in_rule_order()
+        self.fact_index = {fact_name: index for index, fact_name in enumerate(self.fact_names)}
 
-    def _filter_rules_by_visa_type(self, visa_type: str) -> List[Rule]:
-        """ビザタイプに関連するルールを再帰的に取得"""
-        # まず、ビザタイプに直接マッチするルールを取得
-        target_rules = [r for r in self.all_rules if r.visa_type == visa_type]
+        # 診断結果として扱う事実（ビザ申請の結論）
+        self.conclusion_facts = [
+            fact_name for fact_name in self.fact_index if is_application_conclusion(fact_name)
+        ]
+        # 同じ事実を異なる値で結論とするルールがあるか（あると推論結果が回答の順序に依存する）
+        conclusion_values: Dict[str, Set[bool]] = {}
+        for rule in self.rules:
+            conclusion_values.setdefault(rule.conclusion, set()).add(rule.conclusion_value)
+        self.has_conflicting_conclusions = any(len(values) > 1 for values in conclusion_values.values())
+
+        # 質問の選択に使う重み（結論が未確定のルールの条件にある基本事実ほど高い）
+        self.question_weights = [[] for _ in self.fact_names]
+        for rule in self.rules:
+            weights = self.question_weights[self.fact_index[rule.conclusion]]
+            for fact_name in sorted(self.needed_facts[rule.id], key=self.fact_index.__getitem__):
+                if fact_name in self.basic_facts:
+                    weights.append((self.fact_index[fact_name], rule.priority + 1))
+
+        self._compile_masks()
+        self._compile_initial_state()
 
-        # 依存するルールを再帰的に追加
-        needed_conclusions = set()
-        for rule in target_rules:
+        # 依存関係グラフ（条件の事実 → 結論の事実）をトポロジカル順に並べる
+        self.topological_facts = self._sort_facts_topologically()
+        self.dependent_facts = self._collect_dependent_facts()
+
+        # 共有されるため、確定後は変更できない形にする
+        self.all_fact_names = frozenset(self.all_fact_names)
+        self.derivable_facts = frozenset(self.derivable_facts)
+        self.basic_facts = frozenset(self.basic_facts)
+
+    def _compile_masks(self):
+        """事実の番号をビット位置として、ルールと事実の分類をビットマスクにコンパイル
+
+        ルールの条件のビットマスクは mask_offsets[位置] からの相対的なビット位置で表す。
+        """
+        self.consumer_positions = [[] for _ in self.fact_names]
+        self.producer_positions = [[] for _ in self.fact_names]
+        for position, rule in enumerate(self.rules):
+            offset = min((self.fact_index[cond.fact_name] for cond in rule.conditions), default=0)
+            condition_mask = required_mask = forbidden_mask = 0
             for cond in rule.conditions:
-                needed_conclusions.add(cond.fact_name)
-
-        # 必要な結論を出すルールを追加
-        changed = True
-        while changed:
-            changed = False
-            for rule in self.all_rules:
-                if rule not in target_rules and rule.conclusion in needed_conclusions:
-                    target_rules.append(rule)
-                    # このルールの条件も必要
-                    for cond in rule.conditions:
-                        if cond.fact_name not in needed_conclusions:
-                            needed_conclusions.add(cond.fact_name)
-                            changed = True
-
-        return target_rules
+                index = self.fact_index[cond.fact_name]
+                consumers = self.consumer_positions[index]
+                if not consumers or consumers[-1] != position:
+                    consumers.append(position)
+                index -= offset
+                condition_mask |= 1 << index
+                if cond.required_value:
+                    required_mask |= 1 << index
+                else:
+                    forbidden_mask |= 1 << index
+            self.mask_offsets.append(offset)
+            self.condition_masks.append(condition_mask)
+            self.required_masks.append(required_mask)
+            self.forbidden_masks.append(forbidden_mask)
+            self.conclusion_indices.append(self.fact_index[rule.conclusion])
+            self.producer_positions[self.fact_index[rule.conclusion]].append(position)
+            self.rule_positions[rule.id] = position
+            self.is_and_rule.append(rule.operator == "AND")
+
+        self.basic_mask = self.to_mask(self.basic_facts)
+        self.derivable_mask = self.to_mask(self.derivable_facts)
+        self.conclusion_mask = self.to_mask(self.conclusion_facts)
+
+    def _compile_initial_state(self):
+        """事実が1つも判明していない状態の、発火待ちのルールと質問スコアを求める"""
+        # 条件のない AND のルールだけが最初から発火できる
+        self.initial_agenda = [
+            (0, position) for position, is_and in enumerate(self.is_and_rule)
+            if is_and and not self.condition_masks[position]
+        ]
+        scores = [0] * len(self.fact_names)
+        for weights in self.question_weights:
+            for index, weight in weights:
+                scores[index] += weight
+        self.initial_scores = scores
+        self.initial_question_queue = [(-scores[index], index) for index in bit_indices(self.basic_mask)]
+        heapq.heapify(self.initial_question_queue)
+
+    def to_mask(self, fact_names) -> int:
+        """事実名の集まりをビットマスクに変換"""
+        return self.indices_to_mask(self.fact_index[fact_name] for fact_name in fact_names)
+
+    def indices_to_mask(self, indices) -> int:
+        """事実の番号の集まりをビットマスクに変換"""
+        bits = bytearray((len(self.fact_names) + 7) // 8)
+        for index in indices:
+            bits[index >> 3] |= 1 << (index & 7)
+        return int.from_bytes(bits, "little")
+
+    def _sort_facts_topologically(self) -> List[str]:
+        """事実をトポロジカル順に並べる（循環がある場合は ValueError）"""
+        in_degree = {fact_name: 0 for fact_name in self.all_fact_names}
+        for fact_name, rules in self.rules_by_condition.items():
+            for rule in rules:
+                in_degree[rule.conclusion] += 1
+
+        # 依存のない事実から順に、ルールの定義順で取り出す（Kahn のアルゴリズム）
+        ready = deque(fact_name for fact_name in self.fact_names if in_degree[fact_name] == 0)
+        ordered = []
+        while ready:
+            fact_name = ready.popleft()
+            ordered.append(fact_name)
+            for rule in self.rules_by_condition.get(fact_name, []):
+                in_degree[rule.conclusion] -= 1
+                if in_degree[rule.conclusion] == 0:
+                    ready.append(rule.conclusion)
+
+        if len(ordered) < len(in_degree):
+            cyclic = sorted(fact_name for fact_name, degree in in_degree.items() if degree > 0)
+            raise ValueError(f"ルールの依存関係に循環があります: {cyclic}")
+        return ordered
+
+    def _collect_dependent_facts(self) -> Dict[str, FrozenSet[str]]:
+        """事実ごとに推移的に依存する導出事実を求める（トポロジカル順の逆順に、結論の事実の結果を集める）"""
+        empty: FrozenSet[str] = frozenset()
+        dependents: Dict[str, FrozenSet[str]] = {}
+        for fact_name in reversed(self.topological_facts):
+            rules = self.rules_by_condition.get(fact_name)
+            if not rules:
+                dependents[fact_name] = empty
+                continue
+            found: Set[str] = set()
+            for rule in rules:
+                if rule.conclusion not in found:
+                    found.add(rule.conclusion)
+                    found |= dependents[rule.conclusion]
+            dependents[fact_name] = frozenset(found)
+        return dependents
+
+    def _fact_names_in_rule_order(self) -> List[str]:
+        """ルールの定義順（条件 → 結論）に重複なく並べた事実名"""
+        seen = {}
+        for rule in self.rules:
+            for cond in rule.conditions:
+                seen.setdefault(cond.fact_name, None)
+            seen.setdefault(rule.conclusion, None)
+        return list(seen)
+
+    def _filter_rules_by_visa_type(self, visa_type: str) -> List[Rule]:
+        """ビザタイプの診断に使うルールを依存関係から取得（build_visa_type_index を参照）"""
+        positions = build_visa_type_index(self.all_rules).get(visa_type, [])
+        return [self.all_rules[position] for position in positions]
 
     def get_rule_by_id(self, rule_id: str) -> Rule:
         """IDでルールを取得"""
-        for rule in self.rules:
-            if rule.id == rule_id:
-                return rule
-        return None
+        return self.rules_by_id.get(rule_id)
 
     def get_rules_with_conclusion(self, fact_name: str) -> List[Rule]:
         """特定の事実を結論とするルールを取得"""
-        return [rule for rule in self.rules if rule.conclusion == fact_name]
+        return self.rules_by_conclusion.get(fact_name, [])
 
     def is_derivable(self, fact_name: str) -> bool:
         """事実が導出可能かを判定"""
@@ -85,14 +284,17 @@ class KnowledgeBase:
         """事実が基本事実（質問すべき）かを判定"""
         return fact_name in self.basic_facts
 
-    def get_facts_needed_for_rule(self, rule: Rule) -> Set[str]:
+    def get_rules_with_condition(self, fact_name: str) -> List[Rule]:
+        """特定の事実を条件に持つルールを取得"""
+        return self.rules_by_condition.get(fact_name, [])
+
+    def get_dependent_facts(self, fact_name: str) -> FrozenSet[str]:
+        """事実に推移的に依存する導出事実を取得"""
+        return self.dependent_facts.get(fact_name, frozenset())
+
+    def get_facts_needed_for_rule(self, rule: Rule) -> FrozenSet[str]:
         """ルールが必要とする事実を取得"""
-        return {cond.fact_name for cond in rule.conditions}
-
-    def get_unknown_basic_facts_for_rule(self, rule: Rule) -> Set[str]:
-        """ルールの条件のうち、まだ不明な基本事実を取得"""
-        needed_facts = self.get_facts_needed_for_rule(rule)
-        return {
-            fact for fact in needed_facts
-            if self.is_basic_fact(fact) and self.facts.get(fact) is None
-        }
+        needed = self.needed_facts.get(rule.id)
+        if needed is None:
+            needed = frozenset(cond.fact_name for cond in rule.conditions)
+        return needed
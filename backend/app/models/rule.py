@@ -1,23 +1,68 @@
 """Rule クラス - エキスパートシステムのルールを表現"""
-from typing import List, Literal, Optional
-from pydantic import BaseModel
+from typing import Dict, List, Optional
 
 
-class Condition(BaseModel):
+class Condition:
     """条件を表すクラス"""
-    fact_name: str
-    required_value: bool = True
-
-
-class Rule(BaseModel):
-    """ルールを表すクラス"""
-    id: str
-    conditions: List[Condition]
-    operator: Literal["AND", "OR"] = "AND"  # 条件間の論理演算子
-    conclusion: str  # 結論となる事実の名前
-    conclusion_value: bool = True  # 結論の真偽値
-    priority: int = 0  # 優先順位（質問の順序制御に使用）
-    visa_type: Optional[str] = None  # ビザタイプ（E, L, B, H-1B, J-1など）
+
+    __slots__ = ("fact_name", "required_value")
+
+    def __init__(self, fact_name: str, required_value: bool = True):
+        self.fact_name = fact_name
+        self.required_value = required_value
+
+    def __repr__(self) -> str:
+        return f"Condition(fact_name={self.fact_name!r}, required_value={self.required_value!r})"
+
+    def to_dict(self) -> Dict:
+        """辞書に変換（API応答用）"""
+        return {"fact_name": self.fact_name, "required_value": self.required_value}
+
+
+class Rule:
+    """ルールを表すクラス
+
+    推論の中心で大量に参照されるため、pydantic モデルではなく __slots__ を持つ
+    通常のクラスとして定義する。rules.json の検証は読み込み時に
+    app.models.schemas.RulesFileSchema で一度だけ行う。
+    """
+
+    __slots__ = (
+        "id", "conditions", "operator", "conclusion", "conclusion_value", "priority", "visa_type"
+    )
+
+    def __init__(
+        self,
+        id: str,
+        conditions: List[Condition],
+        conclusion: str,
+        operator: str = "AND",  # 条件間の論理演算子
+        conclusion_value: bool = True,  # 結論の真偽値
+        priority: int = 0,  # 優先順位（質問の順序制御に使用）
+        visa_type: Optional[str] = None,  # ビザタイプ（E, L, B, H-1B, J-1など）
+    ):
+        self.id = id
+        self.conditions = conditions
+        self.operator = operator
+        self.conclusion = conclusion  # 結論となる事実の名前
+        self.conclusion_value = conclusion_value
+        self.priority = priority
+        self.visa_type = visa_type
+
+    def __repr__(self) -> str:
+        return f"Rule(id={self.id!r}, operator={self.operator!r}, conclusion={self.conclusion!r})"
+
+    def to_dict(self) -> Dict:
+        """辞書に変換（API応答用）"""
+        return {
+            "id": self.id,
+            "conditions": [cond.to_dict() for cond in self.conditions],
+            "operator": self.operator,
+            "conclusion": self.conclusion,
+            "conclusion_value": self.conclusion_value,
+            "priority": self.priority,
+            "visa_type": self.visa_type,
+        }
 
     def can_fire(self, facts: dict) -> bool:
         """ルールが発火可能かを判定"""
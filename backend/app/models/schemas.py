@@ -0,0 +1,39 @@
+"""rules.json の検証用スキーマ（pydantic）"""
+from typing import List, Literal, Optional
+from pydantic import BaseModel
+
+from .rule import Condition, Rule
+
+
+class ConditionSchema(BaseModel):
+    """条件の定義"""
+    fact_name: str
+    required_value: bool = True
+
+
+class RuleSchema(BaseModel):
+    """ルールの定義"""
+    id: str
+    conditions: List[ConditionSchema]
+    operator: Literal["AND", "OR"] = "AND"  # 条件間の論理演算子
+    conclusion: str  # 結論となる事実の名前
+    conclusion_value: bool = True  # 結論の真偽値
+    priority: int = 0  # 優先順位（質問の順序制御に使用）
+    visa_type: Optional[str] = None  # ビザタイプ（E, L, B, H-1B, J-1など）
+
+    def to_rule(self) -> Rule:
+        """推論エンジン用の Rule に変換"""
+        return Rule(
+            id=self.id,
+            conditions=[Condition(cond.fact_name, cond.required_value) for cond in self.conditions],
+            conclusion=self.conclusion,
+            operator=self.operator,
+            conclusion_value=self.conclusion_value,
+            priority=self.priority,
+            visa_type=self.visa_type,
+        )
+
+
+class RulesFileSchema(BaseModel):
+    """rules.json 全体の定義"""
+    rules: List[RuleSchema]
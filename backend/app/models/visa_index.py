@@ -0,0 +1,71 @@
+"""ビザタイプごとのルールの索引 - 申請の可否の結論から依存関係をさかのぼって求める"""
+from typing import Dict, List, Optional, Tuple
+
+from .rule import Rule
+
+# 診断結果（ビザ申請の可否）の結論であることを表す文言
+APPLICATION_CONCLUSION = "申請ができます"
+
+# 申請の結論の文言からビザタイプを判定するキーワード（上から順に判定）
+VISA_TYPE_KEYWORDS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("E", ("Eビザ",)),
+    ("L", ("Lビザ", "Blanket L")),
+    ("H-1B", ("H-1B",)),
+    ("B", ("Bビザ", "B-1")),
+    ("J-1", ("J-1",)),
+]
+
+
+def is_application_conclusion(fact_name: str) -> bool:
+    """事実がビザ申請の可否の結論かを判定"""
+    return APPLICATION_CONCLUSION in fact_name
+
+
+def classify_conclusion(conclusion: str) -> Optional[str]:
+    """申請の結論の文言からビザタイプを判定（該当しない場合は None）"""
+    for visa_type, keywords in VISA_TYPE_KEYWORDS:
+        if any(keyword in conclusion for keyword in keywords):
+            return visa_type
+    return None
+
+
+def root_visa_type(rule: Rule) -> Optional[str]:
+    """ルールを起点とするビザタイプ（明示的な visa_type、または申請の結論から判定）"""
+    if rule.visa_type:
+        return rule.visa_type
+    if is_application_conclusion(rule.conclusion):
+        return classify_conclusion(rule.conclusion)
+    return None
+
+
+def build_visa_type_index(rules: List[Rule]) -> Dict[str, List[int]]:
+    """ビザタイプ → そのビザタイプの診断に使うルールの位置（定義順）
+
+    申請の結論を出すルール（と visa_type を明示したルール）を起点に、条件の事実を
+    結論とするルールを依存関係グラフで推移的にさかのぼる。複数のビザタイプの
+    条件を導出するルールは、それぞれのビザタイプに含まれる。
+    """
+    producers: Dict[str, List[int]] = {}  # 事実名 → それを結論とするルールの位置
+    roots: Dict[str, List[int]] = {}  # ビザタイプ → 起点のルールの位置
+    for position, rule in enumerate(rules):
+        producers.setdefault(rule.conclusion, []).append(position)
+        visa_type = root_visa_type(rule)
+        if visa_type:
+            roots.setdefault(visa_type, []).append(position)
+
+    index = {}
+    for visa_type, positions in roots.items():
+        selected = set(positions)
+        needed = set()  # 条件として必要になった事実
+        stack = list(positions)
+        while stack:
+            for cond in rules[stack.pop()].conditions:
+                if cond.fact_name in needed:
+                    continue
+                needed.add(cond.fact_name)
+                for producer in producers.get(cond.fact_name, ()):
+                    if producer not in selected:
+                        selected.add(producer)
+                        stack.append(producer)
+        index[visa_type] = sorted(selected)
+    return index
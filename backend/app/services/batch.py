@@ -0,0 +1,283 @@
+"""一括診断 - 多数の (ビザタイプ, 回答) をまとめて推論"""
+import json
+import multiprocessing
+import os
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .inference_engine import InferenceEngine
+from ..models.knowledge_base import KnowledgeBase
+from ..models.rule import Rule
+from .rule_repository import RuleRepository, RuleSet
+from .vectorized_evaluator import VectorizedEvaluator, np
+
+# 1回の処理（ワーカープロセスへの受け渡し）でまとめて推論するレコード数
+DEFAULT_CHUNK_SIZE = 256
+
+# 一括診断に使うワーカープロセス数の上限（リクエストの workers もこの数までに制限する）
+MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "0")) or os.cpu_count() or 1
+
+# まとまり内の同じビザタイプのレコードがこの件数以上あれば、VectorizedEvaluator でまとめて評価する
+VECTORIZE_MIN_RECORDS = 16
+
+# 知識ベース → VectorizedEvaluator（知識ベースとともに破棄する）
+_evaluators: "weakref.WeakKeyDictionary[KnowledgeBase, VectorizedEvaluator]" = weakref.WeakKeyDictionary()
+
+# ワーカープロセスごとの知識ベース（_init_worker で初期化）
+_worker_rule_set: Optional[RuleSet] = None
+
+
+def _validate_record(rule_set: RuleSet, record: Dict) -> Tuple[str, Dict[str, bool]]:
+    """レコードのビザタイプと回答を取得（不正なレコードは ValueError）"""
+    if not isinstance(record, dict):
+        raise ValueError("レコードはJSONオブジェクトである必要があります")
+    visa_type = record.get("visa_type")
+    if visa_type not in rule_set.visa_types():
+        raise ValueError(f"不明なビザタイプです: {visa_type}")
+    answers = record.get("answers", {})
+    if not isinstance(answers, dict) or not all(isinstance(value, bool) for value in answers.values()):
+        raise ValueError("answers は事実名をキー、真偽値を値とするオブジェクトである必要があります")
+    return visa_type, answers
+
+
+def _evaluate_answers(kb: KnowledgeBase, visa_type: str, answers: Dict[str, bool]) -> Dict:
+    """回答から結論と残りの質問を求める"""
+    # 診断セッションと同じく、回答ごとに前向き推論を実行する
+    engine = InferenceEngine(kb)
+    for fact_name, answer in answers.items():
+        engine.assert_fact(fact_name, answer)
+        engine.forward_chain()
+
+    next_question = engine.get_next_question()
+    conclusions = engine.get_conclusions()
+    is_finished = next_question is None or len(conclusions) > 0
+    return {
+        "visa_type": visa_type,
+        "conclusions": conclusions,
+        "is_finished": is_finished,
+        "next_question": None if is_finished else next_question,
+        "missing_questions": [] if is_finished else engine.get_open_questions(),
+    }
+
+
+def evaluate_record(rule_set: RuleSet, record: Dict) -> Dict:
+    """1件の回答から結論と残りの質問を求める（不正なレコードは ValueError）"""
+    visa_type, answers = _validate_record(rule_set, record)
+    return _evaluate_answers(rule_set.get(visa_type), visa_type, answers)
+
+
+def _evaluate_vectorized(kb: KnowledgeBase, visa_type: str, answer_sets: List[Dict[str, bool]]) -> List[Optional[Dict]]:
+    """基本事実のみの回答をまとめて評価（結論が出たレコードの結果、出なかったレコードは None）
+
+    同じ事実を異なる値で結論とするルールがない知識ベースでは、導出される事実は回答の順序に
+    依存しないため、InferenceEngine で1件ずつ推論した結果と一致する。次の質問と残りの質問は
+    推論エンジンでしか求められないため、結論が出なかったレコードは呼び出し側で推論する。
+    """
+    evaluator = _evaluators.get(kb)
+    if evaluator is None:
+        evaluator = _evaluators[kb] = VectorizedEvaluator(kb)
+    values, known = evaluator.encode_answers(answer_sets)
+    _, true = evaluator.evaluate(values, known)
+    results: List[Optional[Dict]] = []
+    for row in evaluator.get_conclusions(true):
+        indices = np.flatnonzero(row)
+        if len(indices) == 0:
+            results.append(None)
+            continue
+        results.append({
+            "visa_type": visa_type,
+            "conclusions": [kb.conclusion_facts[index] for index in indices],
+            "is_finished": True,
+            "next_question": None,
+            "missing_questions": [],
+        })
+    return results
+
+
+def _evaluate_pending(rule_set: RuleSet, pending: Dict[str, Tuple[str, Dict[str, bool]]], memo: Dict[str, Dict]):
+    """未評価の回答の組み合わせを推論して memo に追加（推論できない回答は error の結果）
+
+    numpy がインストールされていて、同じビザタイプのレコードが VECTORIZE_MIN_RECORDS 件以上ある
+    場合は、基本事実のみに回答したレコードを VectorizedEvaluator でまとめて評価する。
+    それ以外のレコードと、結論が出なかったレコードは InferenceEngine で1件ずつ推論する。
+    """
+    by_visa_type: Dict[str, List[str]] = {}
+    for key, (visa_type, _) in pending.items():
+        by_visa_type.setdefault(visa_type, []).append(key)
+
+    for visa_type, keys in by_visa_type.items():
+        kb = rule_set.get(visa_type)
+        if np is not None and len(keys) >= VECTORIZE_MIN_RECORDS and not kb.has_conflicting_conclusions:
+            vectorized = [
+                key for key in keys
+                if all(kb.is_basic_fact(fact_name) for fact_name in pending[key][1])
+            ]
+            if len(vectorized) >= VECTORIZE_MIN_RECORDS:
+                answer_sets = [pending[key][1] for key in vectorized]
+                for key, result in zip(vectorized, _evaluate_vectorized(kb, visa_type, answer_sets)):
+                    if result is not None:
+                        memo[key] = result
+        for key in keys:
+            if key not in memo:
+                try:
+                    memo[key] = _evaluate_answers(kb, visa_type, pending[key][1])
+                except (ValueError, TypeError) as e:
+                    memo[key] = {"error": str(e)}
+
+
+def _evaluate_chunk(rule_set: RuleSet, records: List[Union[Dict, str, bytes]]) -> List[Dict]:
+    """レコードのまとまりを推論（同じ回答の組み合わせは1回だけ推論する）"""
+    parsed = []  # (レコード, 推論結果のキー, エラーの結果)
+    pending: Dict[str, Tuple[str, Dict[str, bool]]] = {}  # キー → (ビザタイプ, 回答)
+    for record in records:
+        key, error = None, None
+        try:
+            if isinstance(record, (str, bytes)):
+                try:
+                    record = json.loads(record)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"JSONとして解釈できません: {e}")
+            visa_type, answers = _validate_record(rule_set, record)
+            key = json.dumps([visa_type, answers], ensure_ascii=False)
+            pending.setdefault(key, (visa_type, answers))
+        except (ValueError, TypeError) as e:
+            error = {"error": str(e)}
+        parsed.append((record, key, error))
+
+    memo: Dict[str, Dict] = {}
+    _evaluate_pending(rule_set, pending, memo)
+
+    results = []
+    for record, key, error in parsed:
+        result = error if key is None else dict(memo[key])
+        if isinstance(record, dict) and "id" in record:
+            result = {"id": record["id"], **result}
+        results.append(result)
+    return results
+
+
+def _init_worker(rules: List[Rule], rules_version: Optional[str]):
+    """ワーカープロセスの知識ベースを準備（呼び出し元と同じバージョンのルールを使う）"""
+    global _worker_rule_set
+    _worker_rule_set = RuleSet(rules, rules_version)
+    _worker_rule_set.preload()
+
+
+def _evaluate_chunk_in_worker(records: List[Union[Dict, str, bytes]]) -> List[Dict]:
+    return _evaluate_chunk(_worker_rule_set, records)
+
+
+class _WorkerPool:
+    """あるバージョンのルールで初期化したワーカープロセスのプール"""
+
+    def __init__(self, rule_set: RuleSet):
+        # サーバーはスレッド（ルールの監視・推論用のスレッド）を持つため、fork ではなく spawn で起動する
+        self.executor = ProcessPoolExecutor(
+            max_workers=MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(rule_set.rules, rule_set.rules_version),
+        )
+        self.users = 0  # このプールを使用中の一括診断の数
+
+
+# ルールのバージョン → プール（最後に使われたバージョン以外は、使用中の一括診断がなくなったら終了する）
+_pools: Dict[Optional[str], _WorkerPool] = {}
+_latest_version: Optional[str] = None
+_pools_lock = threading.Lock()
+
+
+def _acquire_pool(rule_set: RuleSet) -> _WorkerPool:
+    """ルールのバージョンに対応するプールを取得（初回のみ作成し、リクエスト間で再利用する）"""
+    global _latest_version
+    with _pools_lock:
+        pool = _pools.get(rule_set.rules_version)
+        if pool is None:
+            pool = _pools[rule_set.rules_version] = _WorkerPool(rule_set)
+        pool.users += 1
+        _latest_version = rule_set.rules_version
+        _shutdown_unused_pools()
+    return pool
+
+
+def _release_pool(pool: _WorkerPool):
+    with _pools_lock:
+        pool.users -= 1
+        _shutdown_unused_pools()
+
+
+def _shutdown_unused_pools():
+    """再読み込み前のバージョンで、使用中でないプールを終了（_pools_lock を取得済みで呼び出す）"""
+    for rules_version, pool in list(_pools.items()):
+        if rules_version != _latest_version and pool.users == 0:
+            del _pools[rules_version]
+            pool.executor.shutdown(wait=False)
+
+
+def shutdown_pools():
+    """すべてのプールのワーカープロセスを終了（アプリケーションの終了時に呼び出す）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _chunks(records: Iterable, chunk_size: int) -> Iterator[List]:
+    """空行を除いたレコードを chunk_size 件ずつに分割"""
+    chunk = []
+    for record in records:
+        if isinstance(record, (str, bytes)) and not record.strip():
+            continue
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def evaluate_batch(
+    records: Iterable[Union[Dict, str, bytes]],
+    repository: Optional[Union[RuleRepository, RuleSet]] = None,
+    workers: int = 0,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Dict]:
+    """多数のレコードを推論し、入力と同じ順序で結果を返す
+
+    records は {"id": 任意, "visa_type": "E", "answers": {事実名: 真偽値}} の辞書か、
+    それを1行にしたNDJSONの行。入力は順に読み進め、処理中のまとまりの数を
+    制限するため、件数が多くてもメモリ使用量は一定に保たれる。
+    workers が2以上の場合は、ルールのバージョンごとに共有するプロセスプール（MAX_WORKERS 個の
+    ワーカープロセス）で並列に推論し、処理中のまとまりを workers の2倍までに抑える。
+    プールは初回に作成して以降のリクエストで再利用し、ルールが再読み込みされると、
+    使用中の一括診断が終わってから古いプールを終了する。
+    途中でルールが再読み込みされても、開始時のバージョンのルールで推論する。
+    """
+    if repository is None:
+        repository = RuleRepository()
+    rule_set = repository.current if isinstance(repository, RuleRepository) else repository
+
+    if workers < 2:
+        for chunk in _chunks(records, chunk_size):
+            yield from _evaluate_chunk(rule_set, chunk)
+        return
+
+    workers = min(workers, MAX_WORKERS)
+    pool = _acquire_pool(rule_set)
+    pending = deque()
+    try:
+        for chunk in _chunks(records, chunk_size):
+            pending.append(pool.executor.submit(_evaluate_chunk_in_worker, chunk))
+            # 先頭のまとまりから順に結果を返し、処理中のまとまりを workers の2倍までに抑える
+            while len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        _release_pool(pool)
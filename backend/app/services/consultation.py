@@ -1,57 +1,281 @@
 """Consultation クラス - 診断セッションの管理"""
-from typing import Dict, List, Optional
+import secrets
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 from ..models.knowledge_base import KnowledgeBase
-from .inference_engine import InferenceEngine
+from ..models.rule import Rule
+from . import metrics
+from .decision_tree import DecisionTree
+from .inference_engine import EngineObserver, EngineSnapshot, InferenceEngine
+from .outcome_cache import OutcomeCache
+
+# 可視化の差分の基準として保持する、過去に返した可視化データの版の数
+MAX_VISUALIZATION_SNAPSHOTS = 8
+
+
+class Evaluation(NamedTuple):
+    """推論結果（次の質問・結論・完了状態）"""
+    next_question: Optional[str]
+    conclusions: List[str]
+    is_finished: bool
+
+
+# 診断セッションのイベント (種類, 内容) を受け取る関数
+ConsultationListener = Callable[[str, Dict], None]
+
+
+class _EngineEventRelay(EngineObserver):
+    """推論エンジンの通知を診断セッションのイベントとしてリスナーに送る"""
+
+    def __init__(self, consultation: "Consultation"):
+        self.consultation = consultation
+
+    def on_fact_asserted(self, fact_name: str, value: bool, derived: bool):
+        self.consultation._emit("fact", {"fact_name": fact_name, "value": value, "derived": derived})
+
+    def on_rule_fired(self, rule: Rule):
+        self.consultation._emit("rule_fired", {
+            "rule_id": rule.id,
+            "conclusion": rule.conclusion,
+            "conclusion_value": rule.conclusion_value
+        })
 
 
 class Consultation:
-    """診断セッションを管理するクラス"""
+    """診断セッションを管理するクラス
+
+    推論結果と可視化用のルール状態は、回答の状態（version）が変わるまで再利用する。
+    可視化データには版を付け、直近に返した版からの差分だけを返せるようにする。
+    decision_tree が指定された場合は、決定木のノードをたどって推論結果を求める。
+    outcome_cache が指定された場合は、同じ回答の組み合わせに対する推論結果を
+    セッション間で共有する。どちらの場合も、推論エンジンへの回答の反映は
+    可視化などで必要になるまで遅らせる。
 
-    def __init__(self, knowledge_base: KnowledgeBase):
+    回答は1件ずつ手順として記録し、前の質問に戻るときは推論エンジンの
+    ジャーナルを使って最後の手順から順に取り消す（最初から推論し直さない）。
+
+    add_listener() でリスナーを登録している間は、回答をすぐに推論エンジンに反映し、
+    事実の確定（fact）・ルールの発火（rule_fired）・次の質問（question）と、
+    開始や前の質問に戻ったときの状態全体（state）をイベントとして通知する。
+    """
+
+    def __init__(
+        self,
+        knowledge_base: KnowledgeBase,
+        outcome_cache: Optional[OutcomeCache] = None,
+        decision_tree: Optional[DecisionTree] = None,
+    ):
         self.kb = knowledge_base
         self.engine = InferenceEngine(knowledge_base)
+        self.outcome_cache = outcome_cache
+        # ルールが変わっている決定木は使わない（推論エンジンで求める）
+        self.decision_tree = decision_tree if decision_tree and decision_tree.matches(knowledge_base) else None
+        self._node: Optional[int] = None  # 決定木の現在のノード
         self.question_history: List[str] = []  # 質問履歴
         self.answer_history: Dict[str, bool] = {}  # 回答履歴
+        self.version = 0  # 回答の状態が変わるたびに増える
+        self._pending_answers: List[Tuple[str, bool]] = []  # 推論エンジンに未反映の回答
+        # 回答ごとの手順 (事実名, 回答, 変更前の回答, 変更前のノード, 変更前の _cacheable)
+        self._steps: List[Tuple[str, bool, Optional[bool], Optional[int], bool]] = []
+        # 推論結果が回答の集合だけで決まる（回答の順序に依存しない）間は True
+        self._cacheable = not knowledge_base.has_conflicting_conclusions
+        self._evaluation: Optional[Evaluation] = None
+        self._evaluation_version = -1
+        self._rule_statuses: Dict[int, Dict] = {}  # ルールの位置 → 状態（必要になったルールのみ）
+        self._rule_statuses_version = -1
+        # 版は別のセッション・プロセスの版と区別できるようにセッションごとの接頭辞を付ける
+        self._visualization_prefix = secrets.token_hex(4)
+        self._visualization_snapshots: "OrderedDict[str, EngineSnapshot]" = OrderedDict()
+        self._listeners: List[ConsultationListener] = []
+        self._relay: Optional[_EngineEventRelay] = None
 
     def start(self):
         """診断セッションを開始"""
-        self.kb.facts = {}
+        self.engine.reset()
         self.question_history = []
         self.answer_history = {}
-        self.engine.fired_rules = []
+        self._pending_answers = []
+        self._steps = []
+        self._cacheable = not self.kb.has_conflicting_conclusions
+        self._node = self.decision_tree.root if self.decision_tree else None
+        self.version += 1
+        if self._listeners:
+            self._emit("state", self.get_state())
+
+    def _sync(self):
+        """未反映の回答を推論エンジンに反映して推論を実行"""
+        for fact_name, answer in self._pending_answers:
+            self.engine.begin_step()
+            self.engine.assert_fact(fact_name, answer)
+            self.engine.forward_chain()
+        self._pending_answers = []
+
+    def _outcome_key(self):
+        """共有キャッシュのキー（キャッシュを使えない状態なら None）"""
+        if self.outcome_cache is None or not self._cacheable:
+            return None
+        return (self.kb.visa_type, self.kb.rules_version, frozenset(self.answer_history.items()))
+
+    def evaluate(self) -> Evaluation:
+        """推論を実行し、次の質問・結論・完了状態をまとめて取得"""
+        if self._evaluation is not None and self._evaluation_version == self.version:
+            if metrics.enabled:
+                metrics.record_evaluation("reused")
+            return self._evaluation
+
+        if self._node is not None:
+            # 決定木のノードに推論結果が格納されている
+            question, conclusions, is_finished, _, _ = self.decision_tree.get_node(self._node)
+            evaluation = Evaluation(question, list(conclusions), is_finished)
+            if metrics.enabled:
+                metrics.record_evaluation("decision_tree")
+        else:
+            evaluation = self._evaluate_with_engine()
+
+        self._evaluation = evaluation
+        self._evaluation_version = self.version
+        return evaluation
+
+    def _evaluate_with_engine(self) -> Evaluation:
+        """共有キャッシュまたは推論エンジンで推論結果を求める"""
+        key = self._outcome_key()
+        evaluation = self.outcome_cache.get(key) if key is not None else None
+        if metrics.enabled:
+            metrics.record_evaluation("engine" if evaluation is None else "outcome_cache")
+        if evaluation is None:
+            self._sync()
+            next_question = self.engine.get_next_question()
+            conclusions = self.engine.get_conclusions()
+            # 次の質問がない、または結論が導出された場合は完了
+            is_finished = next_question is None or len(conclusions) > 0
+            evaluation = Evaluation(next_question, conclusions, is_finished)
+            if key is not None:
+                self.outcome_cache.put(key, evaluation)
+        return evaluation
 
     def get_next_question(self) -> Optional[str]:
         """次の質問を取得"""
-        next_fact = self.engine.get_next_question()
+        next_fact = self.evaluate().next_question
         if next_fact and next_fact not in self.question_history:
             self.question_history.append(next_fact)
         return next_fact
 
     def answer_question(self, fact_name: str, answer: bool):
         """質問に回答"""
-        self.kb.facts[fact_name] = answer
+        previous = self.answer_history.get(fact_name)
+        self._steps.append((fact_name, answer, previous, self._node, self._cacheable))
+        if not self.kb.is_basic_fact(fact_name) or (previous is not None and previous != answer):
+            # 導出可能な事実への回答や回答の書き換えは、推論結果が回答の順序に依存する
+            self._cacheable = False
+        if self._node is not None:
+            # 決定木が想定しない回答の場合は、以降は推論エンジンで求める
+            self._node = self.decision_tree.get_child(self._node, fact_name, answer)
         self.answer_history[fact_name] = answer
-        # 推論を実行して導出可能な事実を導出
-        self.engine.forward_chain()
+        # 推論エンジンへの反映（前向き推論）は、結果が必要になるまで遅らせる
+        self._pending_answers.append((fact_name, answer))
+        self.version += 1
+        if self._listeners:
+            self._sync()
+            self._emit("question", self.evaluate()._asdict())
 
-    def go_back(self) -> Optional[str]:
-        """前の質問に戻る"""
-        if len(self.question_history) < 2:
-            # 最初の質問の場合は戻れない
+    def go_back(self, steps: int = 1) -> Optional[str]:
+        """steps 個前の質問に戻る（戻った質問を返す）"""
+        if steps < 1 or len(self.question_history) <= steps:
+            # 最初の質問より前には戻れない
             return None
+        return self.jump_to_question(self.question_history[-1 - steps])
 
-        # 最後の質問を削除
-        last_question = self.question_history.pop()
+    def jump_to_question(self, fact_name: str) -> Optional[str]:
+        """質問履歴にある質問に戻り、その質問以降の回答を取り消す"""
+        if fact_name not in self.question_history:
+            return None
 
-        # 最後の回答をクリア
-        if last_question in self.answer_history:
-            del self.answer_history[last_question]
+        # 戻る質問への回答がなくなるまで、最後の回答から順に取り消す
+        while fact_name in self.answer_history and self._steps:
+            self._undo_step()
 
-        # 推論エンジンで該当する事実とその依存事実をリセット
-        self.engine.reset_from_fact(last_question)
+        # 戻った質問より後の質問を履歴から削除
+        del self.question_history[self.question_history.index(fact_name) + 1:]
+        self.version += 1
+        if self._listeners:
+            self._emit("state", self.get_state())
+        return fact_name
 
-        # 前の質問を返す
-        return self.question_history[-1] if self.question_history else None
+    def _undo_step(self):
+        """最後の回答を取り消す（推論エンジンに反映済みならジャーナルで戻す）"""
+        fact_name, _, previous, node, cacheable = self._steps.pop()
+        if self._pending_answers:
+            self._pending_answers.pop()
+        else:
+            self.engine.undo_step()
+        if previous is None:
+            del self.answer_history[fact_name]
+        else:
+            self.answer_history[fact_name] = previous
+        self._node = node
+        self._cacheable = cacheable
+
+    def add_listener(self, listener: ConsultationListener):
+        """イベントのリスナーを登録（以降の回答はすぐに推論エンジンに反映する）"""
+        self._listeners.append(listener)
+        if self._relay is None:
+            self._relay = _EngineEventRelay(self)
+            self.engine.observers.append(self._relay)
+
+    def remove_listener(self, listener: ConsultationListener):
+        """イベントのリスナーの登録を解除"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+        if not self._listeners and self._relay is not None:
+            self.engine.observers.remove(self._relay)
+            self._relay = None
+
+    def move_listeners(self, target: "Consultation"):
+        """リスナーを別の診断に移し、移した先の状態全体（state）を通知する"""
+        listeners = list(self._listeners)
+        for listener in listeners:
+            self.remove_listener(listener)
+            target.add_listener(listener)
+        if listeners:
+            target._emit("state", target.get_state())
+
+    def _emit(self, event: str, data: Dict):
+        """リスナーにイベントを通知"""
+        for listener in list(self._listeners):
+            listener(event, data)
+
+    def get_state(self) -> Dict:
+        """現在の事実・発火したルール・質問と回答の履歴・推論結果をまとめて取得"""
+        self._sync()
+        self.engine.forward_chain()
+        evaluation = self.evaluate()
+        return {
+            "facts": self.engine.facts,
+            "fired_rules": list(self.engine.fired_rules),
+            "question_history": list(self.question_history),
+            "answer_history": dict(self.answer_history),
+            **evaluation._asdict()
+        }
+
+    def get_answer_steps(self) -> List[Tuple[str, bool]]:
+        """これまでの回答を回答した順に取得（取り消した回答は含まない）"""
+        return [(fact_name, answer) for fact_name, answer, _, _, _ in self._steps]
+
+    def to_state(self) -> Dict:
+        """セッションの保存用の状態（回答とルールのバージョンのみ）"""
+        return {
+            "visa_type": self.kb.visa_type,
+            "rules_version": self.kb.rules_version,
+            "answers": [[fact_name, answer] for fact_name, answer in self.get_answer_steps()],
+        }
+
+    def replay(self, answers: List[Tuple[str, bool]]):
+        """診断を開始し、API と同じ順序（質問を取得してから回答）で回答を再現する"""
+        self.start()
+        for fact_name, answer in answers:
+            self.get_next_question()
+            self.answer_question(fact_name, answer)
+        self.get_next_question()
 
     def restart(self):
         """診断を最初からやり直し"""
@@ -59,21 +283,75 @@ class Consultation:
 
     def get_conclusions(self) -> List[str]:
         """診断結果（結論）を取得"""
-        return self.engine.get_conclusions()
+        return self.evaluate().conclusions
+
+    def _sync_rule_statuses(self):
+        """推論エンジンを現在の回答に合わせ、古くなったルールの状態を破棄"""
+        if self._rule_statuses_version != self.version:
+            self._sync()
+            self.engine.forward_chain()
+            self._rule_statuses = {}
+            self._rule_statuses_version = self.version
+
+    def _get_rule_status(self, position: int) -> Dict:
+        """ルールの状態を取得（回答の状態が変わるまで再利用）"""
+        status = self._rule_statuses.get(position)
+        if status is None:
+            status = self._rule_statuses[position] = self.engine.get_rule_status(position)
+        return status
+
+    def get_rule_statuses(self) -> List[Dict]:
+        """すべてのルールの状態を取得（回答の状態が変わるまで再利用）"""
+        self._sync_rule_statuses()
+        return [self._get_rule_status(position) for position in range(len(self.kb.rules))]
+
+    def get_visualization_data(
+        self,
+        since: Optional[str] = None,
+        reachable_only: bool = False,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Dict:
+        """推論過程の可視化データを取得
+
+        since に以前の応答の version を指定すると、その版から状態が変わったルールと事実
+        （不明に戻った事実は removed_facts）だけを返す（full が False）。
+        版が古すぎる・別のセッションのものなどで差分を求められない場合はすべてを返す。
+        reachable_only が True の場合は、今後発火し得るルールのみを返す（差分では、
+        到達できなくなったルールも is_reachable が False の状態として返す）。
+        ルールは offset と limit で分割して返し、total_rules に分割前の件数を返す。
+        """
+        self._sync_rule_statuses()
+        engine = self.engine
+        version = f"{self._visualization_prefix}.{self.version}"
+        snapshot = self._visualization_snapshots.get(since) if since is not None else None
+
+        positions: Sequence[int]
+        if snapshot is not None:
+            positions, facts, removed_facts = engine.get_changes_since(snapshot)
+        else:
+            positions, facts, removed_facts = range(len(self.kb.rules)), engine.facts, []
+            if reachable_only:
+                positions = [position for position in positions if engine.is_reachable(position)]
+
+        if version not in self._visualization_snapshots:
+            self._visualization_snapshots[version] = engine.snapshot()
+            if len(self._visualization_snapshots) > MAX_VISUALIZATION_SNAPSHOTS:
+                self._visualization_snapshots.popitem(last=False)
 
-    def get_visualization_data(self) -> Dict:
-        """推論過程の可視化データを取得"""
+        end = None if limit is None else offset + limit
         return {
-            "rules": self.engine.get_rule_statuses(),
-            "facts": self.kb.facts,
-            "fired_rules": self.engine.fired_rules,
+            "version": version,
+            "full": snapshot is None,
+            "total_rules": len(positions),
+            "rules": [self._get_rule_status(position) for position in positions[offset:end]],
+            "facts": facts,
+            "removed_facts": removed_facts,
+            "fired_rules": engine.fired_rules,
             "question_history": self.question_history,
             "answer_history": self.answer_history
         }
 
     def is_finished(self) -> bool:
         """診断が完了したか判定"""
-        # 次の質問がない、または結論が導出された場合
-        next_question = self.engine.get_next_question()
-        conclusions = self.get_conclusions()
-        return next_question is None or len(conclusions) > 0
+        return self.evaluate().is_finished
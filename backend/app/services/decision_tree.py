@@ -0,0 +1,157 @@
+"""DecisionTree クラス - ビザタイプごとの質問の流れを事前に展開した決定木"""
+import json
+from typing import Dict, List, Optional, Tuple
+
+from ..models.knowledge_base import KnowledgeBase
+from .inference_engine import InferenceEngine
+
+# 保存形式のバージョン
+FORMAT_VERSION = 1
+
+# ノード: (次の質問, 結論, 完了したか, 「はい」の子ノード, 「いいえ」の子ノード)
+Node = Tuple[Optional[str], Tuple[str, ...], bool, int, int]
+
+# 子ノードがないことを表す番号
+NO_CHILD = -1
+
+
+class DecisionTree:
+    """知識ベースのすべての回答の流れを展開した決定木（DAG）
+
+    各ノードは推論エンジンの状態に対応し、次の質問・結論・完了状態を保持する。
+    今後の推論結果が同じになる状態（InferenceEngine.get_relevant_state）は
+    1つのノードにまとめる。
+    """
+
+    root = 0  # 診断開始時のノード
+
+    def __init__(
+        self,
+        visa_type: Optional[str],
+        rules_version: Optional[str],
+        nodes: List[Node],
+        rules_digest: Optional[str] = None,
+    ):
+        self.visa_type = visa_type
+        self.rules_version = rules_version
+        self.rules_digest = rules_digest  # 作成元の知識ベースのルールの並びのハッシュ値
+        self.nodes = nodes
+
+    def matches(self, kb: KnowledgeBase) -> bool:
+        """知識ベースと同じルールから作られた決定木かを判定"""
+        return (
+            self.rules_version is not None
+            and self.rules_version == kb.rules_version
+            and self.visa_type == kb.visa_type
+            # ビザタイプごとのルールの求め方が変わった場合も使わない
+            and self.rules_digest == kb.rules_digest
+        )
+
+    def get_node(self, node_id: int) -> Node:
+        """ノードを取得"""
+        return self.nodes[node_id]
+
+    def get_child(self, node_id: int, fact_name: str, answer: bool) -> Optional[int]:
+        """回答後のノードを取得（決定木が想定しない回答の場合は None）"""
+        question, _, _, yes_child, no_child = self.nodes[node_id]
+        if fact_name != question:
+            return None
+        child = yes_child if answer else no_child
+        return child if child != NO_CHILD else None
+
+    def to_dict(self) -> Dict:
+        """事実名を通し番号に置き換えたコンパクトな形式に変換"""
+        fact_table: Dict[str, int] = {}
+
+        def fact_id(fact_name: Optional[str]) -> int:
+            if fact_name is None:
+                return NO_CHILD
+            return fact_table.setdefault(fact_name, len(fact_table))
+
+        nodes = [
+            [fact_id(question), yes_child, no_child, [fact_id(c) for c in conclusions], int(is_finished)]
+            for question, conclusions, is_finished, yes_child, no_child in self.nodes
+        ]
+        return {
+            "format": FORMAT_VERSION,
+            "visa_type": self.visa_type,
+            "rules_version": self.rules_version,
+            "rules_digest": self.rules_digest,
+            "facts": list(fact_table),
+            "nodes": nodes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DecisionTree":
+        """to_dict() の形式から決定木を復元"""
+        if data.get("format") != FORMAT_VERSION:
+            raise ValueError(f"未対応の決定木の形式です: {data.get('format')}")
+        facts = data["facts"]
+        nodes = [
+            (
+                facts[question] if question != NO_CHILD else None,
+                tuple(facts[c] for c in conclusions),
+                bool(is_finished),
+                yes_child,
+                no_child,
+            )
+            for question, yes_child, no_child, conclusions, is_finished in data["nodes"]
+        ]
+        return cls(data["visa_type"], data["rules_version"], nodes, data.get("rules_digest"))
+
+
+def compile_decision_tree(kb: KnowledgeBase) -> DecisionTree:
+    """推論エンジンで知識ベースのすべての回答の流れをたどり、決定木を作成"""
+    root = InferenceEngine(kb)
+    root.forward_chain()
+
+    node_ids: Dict[object, int] = {root.get_relevant_state(): 0}
+    engines: List[Optional[InferenceEngine]] = [root]
+    nodes: List[Optional[Node]] = [None]
+    worklist = [0]
+
+    while worklist:
+        node_id = worklist.pop()
+        engine = engines[node_id]
+        engines[node_id] = None  # 展開後の状態は不要
+
+        question = engine.get_next_question()
+        conclusions = tuple(engine.get_conclusions())
+        # 次の質問がない、または結論が導出された場合は完了
+        is_finished = question is None or len(conclusions) > 0
+
+        children = []
+        for answer in (True, False):
+            if question is None:
+                children.append(NO_CHILD)
+                continue
+            child = engine.copy()
+            child.assert_fact(question, answer)
+            child.forward_chain()
+            state = child.get_relevant_state()
+            child_id = node_ids.get(state)
+            if child_id is None:
+                child_id = len(nodes)
+                node_ids[state] = child_id
+                engines.append(child)
+                nodes.append(None)
+                worklist.append(child_id)
+            children.append(child_id)
+
+        nodes[node_id] = (question, conclusions, is_finished, children[0], children[1])
+
+    return DecisionTree(kb.visa_type, kb.rules_version, nodes, kb.rules_digest)
+
+
+def save_decision_trees(trees: List[DecisionTree], path: str):
+    """決定木をJSONファイルに保存"""
+    data = {tree.visa_type: tree.to_dict() for tree in trees}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_decision_trees(path: str) -> Dict[str, DecisionTree]:
+    """JSONファイルから決定木を読み込み"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {visa_type: DecisionTree.from_dict(tree) for visa_type, tree in data.items()}
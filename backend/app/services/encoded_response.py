@@ -0,0 +1,94 @@
+"""EncodedResponse クラス - 事前に JSON にエンコード・圧縮した応答（ETag と条件付きリクエストに対応）"""
+import email.utils
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli  # 任意（インストールされていれば br でも返す）
+except ImportError:
+    brotli = None
+
+# これより小さい応答は圧縮しない（バイト数）
+MIN_COMPRESS_BYTES = 1024
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding ヘッダーを符号化方式 → q 値に変換"""
+    encodings = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        encodings[coding.strip().lower()] = q
+    return encodings
+
+
+class EncodedResponse:
+    """変更されない応答を一度だけエンコードして保持するクラス
+
+    本文は FastAPI の JSONResponse と同じ形式でエンコードし、gzip（と brotli がインストール
+    されていれば br）の圧縮済みの本文も作成時に用意する。ETag は本文のハッシュ値のため、
+    同じ rules.json から作った応答はどのワーカーでも同じ ETag になる。
+    """
+
+    def __init__(self, content: Any, last_modified: float):
+        self.body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:16]}"'
+        self.last_modified = int(last_modified)
+        self.variants: Dict[str, bytes] = {}  # 符号化方式 → 圧縮済みの本文
+        if len(self.body) >= MIN_COMPRESS_BYTES:
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(self.body)
+            self.variants["gzip"] = gzip.compress(self.body, compresslevel=9, mtime=0)
+
+    def _etag(self, encoding: Optional[str]) -> str:
+        """符号化方式ごとの ETag（圧縮した本文は別の表現として区別する）"""
+        return self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+
+    def _not_modified(self, request: Request) -> bool:
+        """条件付きリクエストの条件から、クライアントの応答が最新かを判定"""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags: List[str] = [tag.strip() for tag in if_none_match.split(",")]
+            if "*" in tags:
+                return True
+            current = {self._etag(encoding) for encoding in [None, *self.variants]}
+            return any((tag[2:] if tag.startswith("W/") else tag) in current for tag in tags)
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return self.last_modified <= since
+        return False
+
+    def respond(self, request: Request) -> Response:
+        """リクエストの条件と Accept-Encoding に応じた応答（最新なら 304）"""
+        accepted = parse_accept_encoding(request.headers.get("accept-encoding"))
+        default = accepted.get("*", 0)
+        encoding = next((name for name in self.variants if accepted.get(name, default) > 0), None)
+        headers = {
+            "ETag": self._etag(encoding),
+            "Last-Modified": email.utils.formatdate(self.last_modified, usegmt=True),
+            "Cache-Control": "no-cache",  # ルールは再読み込みされるため、毎回 ETag で確認する
+            "Vary": "Accept-Encoding",
+        }
+        if self._not_modified(request):
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(self.body, media_type="application/json", headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type="application/json", headers=headers)
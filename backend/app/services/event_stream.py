@@ -0,0 +1,59 @@
+"""EventBuffer クラス - 診断セッションのイベントを接続ごとに送るための上限付きバッファ"""
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+Event = Tuple[str, Dict]  # (種類, 内容)
+
+
+class EventBuffer:
+    """1つの接続（SSE）に送るイベントを溜める上限付きのバッファ
+
+    推論を実行するスレッドから put() し、イベントループで get() する。
+    読み出しが追いつかずに max_events を超えた場合は、溜まったイベントと以降の
+    イベントを捨てて overflowed とし、読み出し側は状態全体を送り直す。
+    これにより、遅いクライアントがあってもサーバーのメモリ使用量は増え続けない。
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_events: int = 256):
+        self.max_events = max_events
+        self._loop = loop
+        self._events: Deque[Event] = deque()
+        self._overflowed = False
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+
+    def put(self, event: str, data: Dict):
+        """イベントを追加（ブロックしない。どのスレッドからでも呼べる）"""
+        with self._lock:
+            if self._overflowed:
+                return
+            if len(self._events) >= self.max_events:
+                self._events.clear()
+                self._overflowed = True
+            else:
+                self._events.append((event, data))
+            notify = len(self._events) <= 1
+        if notify:
+            try:
+                self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:  # イベントループが終了している
+                pass
+
+    async def get(self, timeout: Optional[float] = None) -> Tuple[List[Event], bool]:
+        """溜まったイベントをすべて取り出す（(イベント, 取りこぼしがあったか)）
+
+        timeout 秒待ってもイベントがない場合は空のリストを返す。
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._ready.clear()
+        with self._lock:
+            events = list(self._events)
+            overflowed = self._overflowed
+            self._events.clear()
+            self._overflowed = False
+        return events, overflowed
@@ -1,147 +1,555 @@
 """InferenceEngine クラス - 推論エンジンの実装"""
-from typing import Dict, List, Set, Tuple
-from ..models.knowledge_base import KnowledgeBase
+import heapq
+import time
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+from ..models.knowledge_base import KnowledgeBase, bit_indices
 from ..models.rule import Rule
+from . import metrics
+
+
+class JournalEntry:
+    """1つの手順（回答とそれによる推論）の取り消しに必要な変更前の状態"""
+
+    __slots__ = ("known", "true", "fired_count", "agenda", "closed", "other_facts", "scores")
+
+    def __init__(self, known: int, true: int, fired_count: int, agenda: List[Tuple[int, int]]):
+        self.known = known
+        self.true = true
+        self.fired_count = fired_count
+        self.agenda = agenda
+        self.closed: List[int] = []  # 手順中に結論が確定した事実の番号
+        self.other_facts: List[Tuple[str, Optional[bool]]] = []  # (事実名, 変更前の値)
+        # 質問スコアを作り直した場合の直前の (スコア, 質問候補のキュー, closed の件数)
+        self.scores: Optional[Tuple[List[int], List[Tuple[int, int]], int]] = None
+
+
+class EngineObserver:
+    """推論エンジンの事実の確定とルールの発火を受け取るオブザーバー
+
+    必要なメソッドだけを上書きする。推論中に呼ばれるため、処理は短く保つこと。
+    """
+
+    def on_fact_asserted(self, fact_name: str, value: bool, derived: bool):
+        """事実が確定した（derived が True ならルールの発火による導出）"""
+
+    def on_rule_fired(self, rule: Rule):
+        """ルールが発火した（続けて結論の on_fact_asserted が呼ばれる）"""
+
+
+class EngineSnapshot(NamedTuple):
+    """可視化の差分を求めるための、ある時点の事実の状態と発火したルール"""
+    known: int
+    true: int
+    fired_rules: FrozenSet[str]
+    other_facts: Dict[str, bool]
 
 
 class InferenceEngine:
-    """前向き推論（Forward Chaining）エンジン"""
+    """前向き推論（Forward Chaining）エンジン
+
+    事実の状態は、知識ベースが割り当てた事実の番号をビット位置とする
+    2つのビットマスク（判明している事実 known / True の事実 true）で保持する。
+    各ルールは KnowledgeBase でビットマスクにコンパイルされており、
+    発火の判定は数回の整数演算で済む。ルールのビットマスクは条件の事実の付近だけを
+    表すため、判定では事実の状態をルールの基準の位置（mask_offsets）までずらして照合する。
+
+    事実が確定したときはその事実を条件に持つルールだけを再評価する
+    （Rete 方式の差分照合）。発火の順序と結果は、すべてのルールを
+    先頭から繰り返し走査する素朴な前向き推論と同一になる。
+
+    begin_step() 以降の変更は手順ごとのジャーナルに記録され、undo_step() で
+    その手順の変更量に比例した時間で取り消せる。
+    """
 
     def __init__(self, knowledge_base: KnowledgeBase):
-        self.kb = knowledge_base
+        self.kb = knowledge_base  # 共有される知識ベース（変更しない）
+        self.known = 0  # 値が判明している事実のビットマスク
+        self.true = 0  # 値が True の事実のビットマスク
+        self._other_facts: Dict[str, bool] = {}  # 知識ベースにない事実への回答
         self.fired_rules: List[str] = []  # 発火したルールの履歴
+        self._fired_rule_ids: Set[str] = set()  # 発火したルール（所属の判定用）
+        self.version = 0  # 事実の状態が外部から変更されるたびに増える
+        # 発火待ちのルール (走査回, ルールの位置)。素朴な推論での発火順に取り出される
+        self._agenda: List[Tuple[int, int]] = []
+        self._scores: List[int] = []  # 事実の番号ごとの質問スコア
+        # 質問候補 (-スコア, 事実の番号)。古くなった項目は取り出し時に捨てる
+        self._question_queue: List[Tuple[int, int]] = []
+        self._journal: List[JournalEntry] = []  # 手順ごとの変更履歴（undo_step 用）
+        self.observers: List[EngineObserver] = []  # 事実の確定とルールの発火の通知先
+        self._rebuild()
+
+    @property
+    def facts(self) -> Dict[str, bool]:
+        """事実名をキーにした事実の状態（API・可視化用）"""
+        fact_names = self.kb.fact_names
+        true = set(bit_indices(self.true))
+        facts = {fact_names[index]: index in true for index in bit_indices(self.known)}
+        facts.update(self._other_facts)
+        return facts
+
+    def get_fact(self, fact_name: str) -> Optional[bool]:
+        """事実の値を取得（不明な場合は None）"""
+        index = self.kb.fact_index.get(fact_name)
+        if index is None:
+            return self._other_facts.get(fact_name)
+        if not (self.known >> index) & 1:
+            return None
+        return bool((self.true >> index) & 1)
+
+    def reset(self):
+        """事実の状態と発火履歴をすべてクリア"""
+        self.known = 0
+        self.true = 0
+        self._other_facts = {}
+        self.fired_rules = []
+        self._fired_rule_ids = set()
+        self._journal = []
+        self.version += 1
+        self._rebuild()
+
+    def copy(self) -> "InferenceEngine":
+        """同じ知識ベースと事実の状態を持つ推論エンジンを複製（ジャーナルは引き継がない）"""
+        clone = InferenceEngine.__new__(InferenceEngine)
+        clone.kb = self.kb
+        clone.known = self.known
+        clone.true = self.true
+        clone._other_facts = dict(self._other_facts)
+        clone.fired_rules = list(self.fired_rules)
+        clone._fired_rule_ids = set(self._fired_rule_ids)
+        clone.version = self.version
+        clone._agenda = list(self._agenda)
+        clone._scores = list(self._scores)
+        clone._question_queue = list(self._question_queue)
+        clone._journal = []
+        clone.observers = []
+        return clone
+
+    def begin_step(self):
+        """以降の変更を1つの手順としてジャーナルに記録する"""
+        self._journal.append(JournalEntry(self.known, self.true, len(self.fired_rules), list(self._agenda)))
+
+    @property
+    def step_count(self) -> int:
+        """取り消し可能な手順の数"""
+        return len(self._journal)
+
+    def undo_step(self) -> bool:
+        """最後の手順の変更を取り消す（取り消す手順がない場合は False）"""
+        if not self._journal:
+            return False
+        entry = self._journal.pop()
+        kb = self.kb
+        # 手順中に判明した事実（再び質問候補になる）
+        cleared = self.known & ~entry.known
+        self.known = entry.known
+        self.true = entry.true
+        if len(self.fired_rules) > entry.fired_count:
+            del self.fired_rules[entry.fired_count:]
+            self._fired_rule_ids = set(self.fired_rules)
+        self._agenda = entry.agenda
+        for fact_name, previous in reversed(entry.other_facts):
+            if previous is None:
+                self._other_facts.pop(fact_name, None)
+            else:
+                self._other_facts[fact_name] = previous
+
+        closed = entry.closed
+        if entry.scores is not None:
+            self._scores, self._question_queue, closed_count = entry.scores
+            closed = closed[:closed_count]
+        # 結論が確定して差し引いた重みを戻す
+        for index in closed:
+            for basic_index, weight in kb.question_weights[index]:
+                self._scores[basic_index] += weight
+                if not (self.known >> basic_index) & 1:
+                    heapq.heappush(self._question_queue, (-self._scores[basic_index], basic_index))
+        for index in bit_indices(cleared & kb.basic_mask):
+            heapq.heappush(self._question_queue, (-self._scores[index], index))
 
-    def forward_chain(self) -> Dict[str, bool]:
+        self.version += 1
+        return True
+
+    def assert_fact(self, fact_name: str, value: bool):
+        """事実の値を確定（推論は forward_chain で実行）"""
+        current = self.get_fact(fact_name)
+        if current == value:
+            return
+        self.version += 1
+
+        index = self.kb.fact_index.get(fact_name)
+        if index is None:
+            # どのルールにも現れない事実は推論に影響しない
+            if self._journal:
+                self._journal[-1].other_facts.append((fact_name, current))
+            self._other_facts[fact_name] = value
+            self._notify_fact(fact_name, value, derived=False)
+            return
+
+        bit = 1 << index
+        if current is not None:
+            # 確定済みの値の書き換えは差分では扱えないため、照合状態を作り直す
+            if self._journal and self._journal[-1].scores is None:
+                entry = self._journal[-1]
+                entry.scores = (self._scores, self._question_queue, len(entry.closed))
+            self.true ^= bit
+            self._rebuild()
+            self._notify_fact(fact_name, value, derived=False)
+            return
+        self._set_fact(index, value)
+        self._notify_fact(fact_name, value, derived=False)
+        self._propagate(index, pass_number=0, position=-1)
+
+    def _notify_fact(self, fact_name: str, value: bool, derived: bool):
+        """オブザーバーに事実の確定を通知"""
+        for observer in self.observers:
+            observer.on_fact_asserted(fact_name, value, derived)
+
+    def forward_chain(self):
         """前向き推論を実行し、導出可能なすべての事実を推論"""
-        changed = True
-        iteration = 0
-        max_iterations = 100  # 無限ループ防止
+        kb = self.kb
+        fired_before = len(self.fired_rules)
+        while self._agenda:
+            pass_number, position = heapq.heappop(self._agenda)
+            conclusion = kb.conclusion_indices[position]
+            # すでに結論が導出済みの場合はスキップ
+            if (self.known >> conclusion) & 1:
+                continue
+
+            # 結論を導出
+            rule = kb.rules[position]
+            self._set_fact(conclusion, rule.conclusion_value)
+            self.fired_rules.append(rule.id)
+            self._fired_rule_ids.add(rule.id)
+            if self.observers:
+                for observer in self.observers:
+                    observer.on_rule_fired(rule)
+                self._notify_fact(rule.conclusion, rule.conclusion_value, derived=True)
+            self._propagate(conclusion, pass_number, position)
+        if metrics.enabled:
+            metrics.record_forward_chain(len(self.fired_rules) - fired_before)
+
+    def _set_fact(self, index: int, value: bool):
+        """事実のビットを立て、結論が確定したルールを質問スコアから外す"""
+        bit = 1 << index
+        self.known |= bit
+        if value:
+            self.true |= bit
+        self._close_rules_concluding(index)
+
+    def _fires(self, position: int, known: int, true: int) -> bool:
+        """ルールが発火可能かをビットマスクで判定（Rule.can_fire と同じ意味）
 
-        while changed and iteration < max_iterations:
-            changed = False
-            iteration += 1
+        known と true は、事実の状態をルールの基準の位置（mask_offsets）だけ右にずらした値。
+        """
+        kb = self.kb
+        if kb.is_and_rule[position]:
+            condition_mask = kb.condition_masks[position]
+            return (
+                known & condition_mask == condition_mask
+                and true & kb.required_masks[position] == kb.required_masks[position]
+                and not true & kb.forbidden_masks[position]
+            )
+        return bool(
+            known & true & kb.required_masks[position]
+            or known & ~true & kb.forbidden_masks[position]
+        )
 
-            for rule in self.kb.rules:
-                # すでに結論が導出済みの場合はスキップ
-                if self.kb.facts.get(rule.conclusion) is not None:
-                    continue
+    def _can_fire(self, position: int) -> bool:
+        """現在の事実でルールが発火可能かを判定"""
+        offset = self.kb.mask_offsets[position]
+        return self._fires(position, self.known >> offset, self.true >> offset)
 
-                # ルールが発火可能かチェック
-                if rule.can_fire(self.kb.facts):
-                    # 結論を導出
-                    self.kb.facts[rule.conclusion] = rule.conclusion_value
-                    self.fired_rules.append(rule.id)
-                    changed = True
+    def _is_dead(self, position: int, known: int, true: int) -> bool:
+        """ルールが今後発火し得ないかを判定（満たされない条件が確定している）
 
-        return self.kb.facts
+        known と true は _fires と同じく、ルールの基準の位置だけ右にずらした値。
+        """
+        kb = self.kb
+        if kb.is_and_rule[position]:
+            return bool(
+                known & ~true & kb.required_masks[position]
+                or known & true & kb.forbidden_masks[position]
+            )
+        condition_mask = kb.condition_masks[position]
+        return known & condition_mask == condition_mask and not self._fires(position, known, true)
+
+    def get_relevant_state(self) -> Tuple[int, int]:
+        """今後の推論結果を決める事実の状態を (known, true) のビットマスクで取得
+
+        結論が未確定で発火し得るルールの条件にない基本事実は、値が今後の
+        推論に影響しないため、判明しているかどうかだけを残す（true から除く）。
+        この値が等しい2つの状態からは、同じ回答に対して同じ質問と結論が得られる。
+        """
+        kb = self.kb
+        relevant = kb.derivable_mask | kb.conclusion_mask | self._open_condition_mask()
+        return self.known, self.true & relevant
+
+    def _open_condition_mask(self) -> int:
+        """結論が未確定で発火し得るルールの条件に現れる事実のビットマスク"""
+        kb = self.kb
+        indices = []
+        for position in range(len(kb.rules)):
+            if self.is_reachable(position):
+                offset = kb.mask_offsets[position]
+                indices.extend(offset + index for index in bit_indices(kb.condition_masks[position]))
+        return kb.indices_to_mask(indices)
+
+    def get_open_questions(self) -> List[str]:
+        """今後の推論に影響し得る未回答の基本事実を定義順に取得"""
+        self.forward_chain()
+        open_mask = self._open_condition_mask() & self.kb.basic_mask & ~self.known
+        fact_names = self.kb.fact_names
+        return [fact_names[index] for index in bit_indices(open_mask)]
+
+    def _propagate(self, index: int, pass_number: int, position: int):
+        """確定した事実を条件に持つルールのうち、発火可能になったルールを登録"""
+        kb = self.kb
+        if metrics.enabled:
+            metrics.record_rule_evaluations(len(kb.consumer_positions[index]))
+        for target in kb.consumer_positions[index]:
+            if (self.known >> kb.conclusion_indices[target]) & 1:
+                continue
+            offset = kb.mask_offsets[target]
+            known = self.known >> offset
+            true = self.true >> offset
+            if not self._fires(target, known, true):
+                continue
+            # 事実が確定する前から発火可能だった場合は登録済み
+            bit = ~(1 << (index - offset))
+            if self._fires(target, known & bit, true & bit):
+                continue
+            # 素朴な推論では、走査中の位置より後ろのルールは同じ回で、前のルールは次の回で発火する
+            next_pass = pass_number if target > position else pass_number + 1
+            heapq.heappush(self._agenda, (next_pass, target))
+
+    def _rebuild(self):
+        """現在の事実から発火待ちのルールと質問スコアを作り直す"""
+        kb = self.kb
+        if not self.known:
+            # 事実が1つも判明していない状態は知識ベースで求めてある
+            self._agenda = list(kb.initial_agenda)
+            self._scores = list(kb.initial_scores)
+            self._question_queue = list(kb.initial_question_queue)
+            return
+        if metrics.enabled:
+            metrics.record_rule_evaluations(len(kb.rules))
+        self._agenda = [
+            (0, position)
+            for position, conclusion in enumerate(kb.conclusion_indices)
+            if not (self.known >> conclusion) & 1 and self._can_fire(position)
+        ]
+        self._rebuild_question_scores()
+
+    def _rebuild_question_scores(self):
+        """現在の事実から質問スコアと質問候補のキューを作り直す"""
+        kb = self.kb
+        self._scores = [0] * len(kb.fact_names)
+        for conclusion, weights in enumerate(kb.question_weights):
+            if not (self.known >> conclusion) & 1:
+                for index, weight in weights:
+                    self._scores[index] += weight
+        self._question_queue = [
+            (-self._scores[index], index) for index in bit_indices(kb.basic_mask & ~self.known)
+        ]
+        heapq.heapify(self._question_queue)
+
+    def _close_rules_concluding(self, index: int):
+        """結論が確定したルールの重みを、その条件にある基本事実のスコアから差し引く"""
+        if self._journal:
+            self._journal[-1].closed.append(index)
+        for basic_index, weight in self.kb.question_weights[index]:
+            score = self._scores[basic_index] - weight
+            self._scores[basic_index] = score
+            if not (self.known >> basic_index) & 1:
+                heapq.heappush(self._question_queue, (-score, basic_index))
 
     def get_next_question(self) -> str:
         """次に質問すべき基本事実を取得"""
         # まず推論を実行して、導出可能な事実を全て導出
         self.forward_chain()
 
-        # すでに判明している基本事実を除外
-        unknown_basic_facts = {
-            fact for fact in self.kb.basic_facts
-            if self.kb.facts.get(fact) is None
-        }
-
-        if not unknown_basic_facts:
-            return None
-
         # 優先順位を考慮して次の質問を選択
         # 1. 最も優先度の高いルールの条件に含まれる基本事実
         # 2. より多くのルールに影響する基本事実
-        best_fact = self._select_best_fact(unknown_basic_facts)
-        return best_fact
-
-    def _select_best_fact(self, candidates: Set[str]) -> str:
-        """最適な質問対象の事実を選択"""
-        if not candidates:
-            return None
-
-        # 各候補事実について、それを条件とするルールをカウント
-        fact_scores = {}
-        for fact in candidates:
-            score = 0
-            for rule in self.kb.rules:
-                # このルールがまだ評価中で、この事実を必要としているか
-                if self.kb.facts.get(rule.conclusion) is None:
-                    needed_facts = self.kb.get_unknown_basic_facts_for_rule(rule)
-                    if fact in needed_facts:
-                        # ルールの優先度を考慮
-                        score += rule.priority + 1
+        if metrics.enabled:
+            started = time.perf_counter()
+            fact_name = self._select_best_fact()
+            metrics.record_select(time.perf_counter() - started)
+            return fact_name
+        return self._select_best_fact()
 
-            fact_scores[fact] = score
+    def _select_best_fact(self) -> Optional[str]:
+        """最適な質問対象の事実を選択
 
-        # スコアが最も高い事実を選択
-        best_fact = max(fact_scores.items(), key=lambda x: x[1])[0]
-        return best_fact
+        スコアは、結論が未確定のルールのうちその事実を条件に持つものの
+        (優先度 + 1) の合計。同点の場合はルールの定義順で先に現れる事実を選ぶ。
+        """
+        queue = self._question_queue
+        while queue:
+            negative_score, index = queue[0]
+            # すでに判明した事実や、スコアが更新された古い項目は捨てる
+            if not (self.known >> index) & 1 and -negative_score == self._scores[index]:
+                return self.kb.fact_names[index]
+            heapq.heappop(queue)
+        return None
 
     def get_conclusions(self) -> List[str]:
         """導出されたすべての結論を取得"""
         # まず推論を実行
         self.forward_chain()
 
-        # ビザ申請の結論（末端の結論）を取得
-        conclusions = []
-        for fact_name, value in self.kb.facts.items():
-            if value and "申請ができます" in fact_name:
-                conclusions.append(fact_name)
+        # ビザ申請の結論（末端の結論）を取得（事実の番号順は conclusion_facts の順と同じ）
+        fact_names = self.kb.fact_names
+        return [fact_names[index] for index in bit_indices(self.true & self.kb.conclusion_mask)]
 
-        return conclusions
+    def is_fired(self, rule_id: str) -> bool:
+        """ルールが発火済みかを判定"""
+        return rule_id in self._fired_rule_ids
+
+    def is_reachable(self, position: int) -> bool:
+        """ルールが今後発火し得るかを判定（結論が未確定で、満たされない条件が確定していない）"""
+        if (self.known >> self.kb.conclusion_indices[position]) & 1:
+            return False
+        offset = self.kb.mask_offsets[position]
+        return not self._is_dead(position, self.known >> offset, self.true >> offset)
+
+    def get_rule_status(self, position: int) -> Dict:
+        """ルールの状態を取得（可視化用）"""
+        kb = self.kb
+        rule = kb.rules[position]
+        # 事実の状態をルールの基準の位置までずらして、条件の事実だけを調べる
+        offset = kb.mask_offsets[position]
+        known = self.known >> offset
+        true = self.true >> offset
+        derivable = kb.derivable_mask >> offset
+        conclusion_derived = bool((self.known >> kb.conclusion_indices[position]) & 1)
+        conditions = []
+        for cond in rule.conditions:
+            index = kb.fact_index[cond.fact_name] - offset
+            if not (known >> index) & 1:
+                status = "unknown"
+            elif bool((true >> index) & 1) == cond.required_value:
+                status = "satisfied"
+            else:
+                status = "not_satisfied"
+            conditions.append({
+                "fact_name": cond.fact_name,
+                "required_value": cond.required_value,
+                "status": status,
+                "is_derivable": bool((derivable >> index) & 1)
+            })
+        can_fire = self._fires(position, known, true)
+
+        return {
+            "rule_id": rule.id,
+            "conditions": conditions,
+            "operator": rule.operator,
+            "conclusion": rule.conclusion,
+            "conclusion_value": rule.conclusion_value,
+            "conclusion_derived": conclusion_derived,
+            "can_fire": can_fire,
+            "is_fired": rule.id in self._fired_rule_ids,
+            "is_reachable": not conclusion_derived and not self._is_dead(position, known, true)
+        }
 
     def get_rule_statuses(self) -> List[Dict]:
         """すべてのルールの状態を取得（可視化用）"""
-        statuses = []
-        for rule in self.kb.rules:
-            condition_status = rule.get_condition_status(self.kb.facts)
-            conclusion_derived = self.kb.facts.get(rule.conclusion) is not None
-
-            statuses.append({
-                "rule_id": rule.id,
-                "conditions": [
-                    {
-                        "fact_name": cond.fact_name,
-                        "required_value": cond.required_value,
-                        "status": condition_status.get(cond.fact_name, "unknown"),
-                        "is_derivable": self.kb.is_derivable(cond.fact_name)
-                    }
-                    for cond in rule.conditions
-                ],
-                "operator": rule.operator,
-                "conclusion": rule.conclusion,
-                "conclusion_value": rule.conclusion_value,
-                "conclusion_derived": conclusion_derived,
-                "can_fire": rule.can_fire(self.kb.facts),
-                "is_fired": rule.id in self.fired_rules
-            })
+        return [self.get_rule_status(position) for position in range(len(self.kb.rules))]
+
+    def snapshot(self) -> EngineSnapshot:
+        """現在の事実の状態と発火したルールを記録（get_changes_since で差分を求める）"""
+        return EngineSnapshot(
+            self.known, self.true, frozenset(self._fired_rule_ids), dict(self._other_facts)
+        )
+
+    def get_changes_since(self, snapshot: EngineSnapshot) -> Tuple[List[int], Dict[str, bool], List[str]]:
+        """記録した時点からの差分 (状態が変わったルールの位置, 変わった事実, 不明に戻った事実) を取得
 
-        return statuses
+        ルールの状態は条件と結論の事実および発火の有無だけで決まるため、
+        値が変わった事実に関わるルールと、発火の有無が変わったルールだけを返す。
+        """
+        kb = self.kb
+        fact_names = kb.fact_names
+        changed = (self.known ^ snapshot.known) | (self.true ^ snapshot.true)
+        positions: Set[int] = set()
+        facts: Dict[str, bool] = {}
+        removed: List[str] = []
+        known = set(bit_indices(self.known & changed))
+        true = set(bit_indices(self.true & changed))
+        for index in bit_indices(changed):
+            positions.update(kb.consumer_positions[index])
+            positions.update(kb.producer_positions[index])
+            if index in known:
+                facts[fact_names[index]] = index in true
+            else:
+                removed.append(fact_names[index])
+        for rule_id in self._fired_rule_ids.symmetric_difference(snapshot.fired_rules):
+            positions.add(kb.rule_positions[rule_id])
+
+        for fact_name, value in self._other_facts.items():
+            if snapshot.other_facts.get(fact_name) != value:
+                facts[fact_name] = value
+        removed.extend(fact_name for fact_name in snapshot.other_facts if fact_name not in self._other_facts)
+        return sorted(positions), facts, removed
 
     def reset_from_fact(self, fact_name: str):
         """特定の事実とそれに依存する導出事実をリセット"""
-        # 該当する事実をクリア
-        if fact_name in self.kb.facts:
-            del self.kb.facts[fact_name]
+        self.version += 1
 
-        # この事実に依存する導出事実を再帰的にクリア
-        self._clear_dependent_facts(fact_name)
-
-        # 発火したルールの履歴をリセット
+        # 発火したルールの履歴をリセット（ジャーナルとも整合しなくなるため破棄）
         self.fired_rules = []
+        self._fired_rule_ids = set()
+        self._journal = []
+
+        # 該当する事実をクリア
+        self._other_facts.pop(fact_name, None)
+        known_before = self.known
+        index = self.kb.fact_index.get(fact_name)
+        if index is not None:
+            self._clear_fact(index)
+
+            # この事実に依存する導出事実を再帰的にクリア
+            self._clear_dependent_facts(index)
 
-        # 推論を再実行
+        # クリアした事実に関わるルールだけ照合状態を戻して、推論を再実行
+        self._reopen_facts(bit_indices(known_before & ~self.known))
         self.forward_chain()
 
-    def _clear_dependent_facts(self, fact_name: str):
+    def _clear_fact(self, index: int):
+        """事実のビットをクリア"""
+        mask = ~(1 << index)
+        self.known &= mask
+        self.true &= mask
+
+    def _clear_dependent_facts(self, index: int):
         """依存する導出事実を再帰的にクリア"""
-        for rule in self.kb.rules:
-            # このルールが該当する事実を条件として使用しているか
-            if any(cond.fact_name == fact_name for cond in rule.conditions):
-                # このルールの結論をクリア
-                conclusion = rule.conclusion
-                if conclusion in self.kb.facts:
-                    del self.kb.facts[conclusion]
-                    # さらにこの結論に依存する事実もクリア
-                    self._clear_dependent_facts(conclusion)
+        kb = self.kb
+        stack = [index]
+        while stack:
+            for position in kb.consumer_positions[stack.pop()]:
+                # このルールの結論をクリアし、さらにこの結論に依存する事実もクリア
+                conclusion = kb.conclusion_indices[position]
+                if (self.known >> conclusion) & 1:
+                    self._clear_fact(conclusion)
+                    stack.append(conclusion)
+
+    def _reopen_facts(self, cleared: List[int]):
+        """クリアした事実について、発火待ちのルールと質問スコアを _rebuild と同じ状態に戻す"""
+        kb = self.kb
+        # 発火待ちのルールのうち、クリアした事実により発火できなくなったものを除く
+        agenda = [
+            (0, position) for _, position in self._agenda
+            if not (self.known >> kb.conclusion_indices[position]) & 1 and self._can_fire(position)
+        ]
+        for index in cleared:
+            # 結論が未確定に戻ったルールの重みを戻す
+            for basic_index, weight in kb.question_weights[index]:
+                self._scores[basic_index] += weight
+                if not (self.known >> basic_index) & 1:
+                    heapq.heappush(self._question_queue, (-self._scores[basic_index], basic_index))
+            # 残った事実で発火できるルールを登録
+            agenda.extend((0, position) for position in kb.producer_positions[index] if self._can_fire(position))
+        for index in bit_indices(kb.indices_to_mask(cleared) & kb.basic_mask):
+            heapq.heappush(self._question_queue, (-self._scores[index], index))
+        heapq.heapify(agenda)
+        self._agenda = agenda
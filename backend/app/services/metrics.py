@@ -0,0 +1,260 @@
+"""メトリクス - 推論の計測値の集計と Prometheus 形式での出力
+
+METRICS_ENABLED=1 の場合のみ、推論エンジン・診断セッション・ルールの読み込みで
+計測値を記録する。無効の場合、各計測箇所のコストはモジュール変数 enabled の確認のみ。
+
+計測値はプロセス全体の合計に加えて、リクエストごとの RequestStats にも記録する
+（main.py のミドルウェアが contextvars で設定し、タイミングのヘッダーに使う）。
+PROFILE_SAMPLE_RATE が 0 より大きい場合は、その割合のリクエストを cProfile で計測し、
+PROFILE_SLOW_MS 以上かかったリクエストのプロファイルを PROFILE_DIR に保存する。
+"""
+import cProfile
+import math
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+enabled = os.environ.get("METRICS_ENABLED", "0").lower() not in ("", "0", "false", "no")
+
+# プロファイルを取るリクエストの割合（0 で無効）と、保存する処理時間の閾値・保存先
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "200"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# 処理時間のヒストグラムの境界（秒）
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# 件数のヒストグラムの境界
+COUNT_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+T = TypeVar("T")
+
+Labels = Tuple[str, ...]
+
+
+class Counter:
+    """単調に増える値（ラベルの組み合わせごと）"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, labels: Labels = ()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            return [("", labels, value) for labels, value in self._values.items()]
+
+    def label_names_for(self, suffix: str) -> Tuple[str, ...]:
+        return self.label_names
+
+
+class Histogram:
+    """観測値の分布（Prometheus の累積バケット・合計・件数）"""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: Sequence[float] = DURATION_BUCKETS,
+        label_names: Sequence[str] = (),
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Labels, List[float]] = {}  # ラベル → [バケットごとの件数..., 合計, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Labels = ()):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        samples = []
+        with self._lock:
+            items = [(labels, list(counts)) for labels, counts in self._values.items()]
+        for labels, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", labels + (_format_value(bound),), cumulative))
+            samples.append(("_bucket", labels + ("+Inf",), counts[-1]))
+            samples.append(("_sum", labels, counts[-2]))
+            samples.append(("_count", labels, counts[-1]))
+        return samples
+
+    def label_names_for(self, suffix: str) -> Tuple[str, ...]:
+        return self.label_names + ("le",) if suffix == "_bucket" else self.label_names
+
+
+forward_chain_calls = Counter("visa_forward_chain_calls_total", "前向き推論の実行回数")
+rule_evaluations = Counter(
+    "visa_rule_evaluations_total", "発火の判定をしたルールの数（差分照合と照合状態の作り直し）"
+)
+rules_fired = Counter("visa_rules_fired_total", "発火したルールの数")
+select_seconds = Histogram("visa_select_best_fact_seconds", "次の質問の選択にかかった時間")
+evaluations = Counter(
+    "visa_evaluations_total", "推論結果を求めた回数（求めた方法ごと）", label_names=("source",)
+)
+knowledge_base_build_seconds = Histogram(
+    "visa_knowledge_base_build_seconds", "知識ベースの構築にかかった時間", label_names=("visa_type",)
+)
+rules_load_seconds = Histogram(
+    "visa_rules_load_seconds", "ルールの読み込みにかかった時間（読み込み元ごと）", label_names=("source",)
+)
+request_seconds = Histogram(
+    "visa_request_duration_seconds", "リクエストの処理時間", label_names=("method", "handler", "status")
+)
+request_rule_evaluations = Histogram(
+    "visa_request_rule_evaluations", "リクエストごとの発火を判定したルールの数",
+    buckets=COUNT_BUCKETS, label_names=("handler",)
+)
+profiles_written = Counter("visa_profiles_written_total", "保存した遅いリクエストのプロファイルの数")
+
+REGISTRY = [
+    forward_chain_calls, rule_evaluations, rules_fired, select_seconds, evaluations,
+    knowledge_base_build_seconds, rules_load_seconds, request_seconds, request_rule_evaluations,
+    profiles_written,
+]
+
+
+class RequestStats:
+    """1つのリクエストでの計測値"""
+
+    __slots__ = ("forward_chain_calls", "rule_evaluations", "rules_fired", "select_seconds", "profiler")
+
+    def __init__(self, profiler: Optional[cProfile.Profile] = None):
+        self.forward_chain_calls = 0
+        self.rule_evaluations = 0
+        self.rules_fired = 0
+        self.select_seconds = 0.0
+        self.profiler = profiler  # サンプリングされたリクエストのみ
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def start_request() -> Tuple[RequestStats, object]:
+    """リクエストの計測を開始（(計測値, end_request に渡すトークン)）"""
+    profiler = None
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+    stats = RequestStats(profiler)
+    return stats, _current.set(stats)
+
+
+def end_request(token: object):
+    """リクエストの計測を終了"""
+    _current.reset(token)
+
+
+def profiled(func: Callable[..., T]) -> Callable[..., T]:
+    """サンプリングされたリクエストなら、実行したスレッドで cProfile を有効にする関数を返す"""
+    stats = _current.get()
+    if stats is None or stats.profiler is None:
+        return func
+    profiler = stats.profiler
+
+    def run(*args):
+        profiler.enable()
+        try:
+            return func(*args)
+        finally:
+            profiler.disable()
+
+    return run
+
+
+def save_profile(stats: RequestStats, duration: float, name: str) -> Optional[str]:
+    """PROFILE_SLOW_MS 以上かかったサンプリング対象のリクエストのプロファイルを保存"""
+    if stats.profiler is None or duration * 1000 < PROFILE_SLOW_MS:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_")
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{duration * 1000:.0f}ms-{safe_name}.prof")
+    stats.profiler.dump_stats(path)
+    profiles_written.inc()
+    return path
+
+
+def record_forward_chain(fired: int):
+    """前向き推論の実行を記録"""
+    forward_chain_calls.inc()
+    rules_fired.inc(fired)
+    stats = _current.get()
+    if stats is not None:
+        stats.forward_chain_calls += 1
+        stats.rules_fired += fired
+
+
+def record_rule_evaluations(count: int):
+    """発火を判定したルールの数を記録"""
+    rule_evaluations.inc(count)
+    stats = _current.get()
+    if stats is not None:
+        stats.rule_evaluations += count
+
+
+def record_select(seconds: float):
+    """次の質問の選択にかかった時間を記録"""
+    select_seconds.observe(seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.select_seconds += seconds
+
+
+def record_evaluation(source: str):
+    """推論結果を求めた方法を記録（decision_tree / outcome_cache / engine / reused）"""
+    evaluations.inc(labels=(source,))
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(extra: Optional[Dict[str, Tuple[str, str, float]]] = None) -> str:
+    """すべての計測値を Prometheus のテキスト形式で出力
+
+    extra には、出力時に求める値を 名前 → (種類, 説明, 値) で渡す（セッション数など）。
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples():
+            label_names = metric.label_names_for(suffix)
+            label_text = ",".join(f'{name}="{_escape(label)}"' for name, label in zip(label_names, labels))
+            if label_text:
+                lines.append(f"{metric.name}{suffix}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{metric.name}{suffix} {_format_value(value)}")
+    for name, (kind, help, value) in (extra or {}).items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,62 @@
+"""OutcomeCache クラス - 回答の組み合わせごとの推論結果のキャッシュ"""
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Hashable, Optional, Tuple
+
+# (ビザタイプ, ルールのバージョン, 回答の集合)
+OutcomeKey = Tuple[Optional[str], Optional[str], FrozenSet[Tuple[str, bool]]]
+
+
+class OutcomeCache:
+    """推論結果を全セッションで共有するキャッシュ（LRUで上限を設ける）
+
+    推論結果はビザタイプ・ルールのバージョン・回答の集合だけで決まるため、
+    同じ回答をした利用者の間で再利用できる。ルールのバージョンをキーに含むので、
+    rules.json が変わると古い結果は参照されなくなり、やがて追い出される。
+    """
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: OutcomeKey) -> Optional[object]:
+        """キャッシュされた推論結果を取得"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: OutcomeKey, value: object):
+        """推論結果を登録"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """すべての推論結果を破棄"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        """ヒット率などの統計を取得"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
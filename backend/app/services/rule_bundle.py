@@ -0,0 +1,135 @@
+"""ルールバンドル - rules.json を事前にコンパイルしたバイナリ形式
+
+起動時の JSON の解析・pydantic による検証・ビザタイプごとのルールの索引の作成を
+省略するため、その結果を marshal 形式で保存する。
+
+ファイルの構成:
+    MAGIC (4バイト) | 形式のバージョン (2バイト) | ルールのバージョン (16バイト) | 本体 (marshal)
+
+本体には、事実名の表（ルールからは番号で参照する）、ルールの配列、
+ビザタイプごとのルールの位置の一覧（app.models.visa_index の索引）を格納する。
+"""
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from ..models.rule import Condition, Rule
+
+MAGIC = b"VESB"
+
+# 保存形式のバージョン（変更した場合は古いバンドルを使わない）
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct(">4sH16s")
+
+
+def save_rule_bundle(
+    rules: List[Rule], rules_version: str, subsets: Dict[str, List[Rule]], path: str
+):
+    """ルールとビザタイプごとのルールの一覧をバンドルに保存（一時ファイルから置き換える）"""
+    fact_index: Dict[str, int] = {}
+    for rule in rules:
+        for cond in rule.conditions:
+            fact_index.setdefault(cond.fact_name, len(fact_index))
+        fact_index.setdefault(rule.conclusion, len(fact_index))
+    positions = {id(rule): position for position, rule in enumerate(rules)}
+
+    payload = {
+        "facts": list(fact_index),
+        "rules": [
+            (
+                rule.id,
+                tuple(fact_index[cond.fact_name] for cond in rule.conditions),
+                tuple(cond.required_value for cond in rule.conditions),
+                rule.operator,
+                fact_index[rule.conclusion],
+                rule.conclusion_value,
+                rule.priority,
+                rule.visa_type,
+            )
+            for rule in rules
+        ],
+        "subsets": {
+            visa_type: [positions[id(rule)] for rule in subset]
+            for visa_type, subset in subsets.items()
+        },
+    }
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, rules_version.encode("ascii"))
+
+    with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(path) or ".", suffix=".tmp", delete=False) as f:
+        f.write(header)
+        marshal.dump(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(f.name, 0o644)  # 一時ファイルは所有者のみ読み書きできるため
+    os.replace(f.name, path)
+
+
+def load_rule_bundle(
+    path: str, rules_version: str
+) -> Optional[Tuple[List[Rule], Dict[str, List[Rule]]]]:
+    """バンドルから (ルール, ビザタイプごとのルール) を読み込み
+
+    ファイルがない・壊れている、形式や構造が異なる、または rules_version と一致しない（古い）場合は None
+    （呼び出し側は rules.json から読み込む）。
+    """
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    with f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # 空のファイル
+            return None
+        with mapped:
+            if len(mapped) < _HEADER.size:
+                return None
+            magic, format_version, bundle_version = _HEADER.unpack_from(mapped)
+            if (
+                magic != MAGIC
+                or format_version != FORMAT_VERSION
+                or bundle_version != rules_version.encode("ascii")
+            ):
+                return None
+            try:
+                with memoryview(mapped) as view:
+                    payload = marshal.loads(view[_HEADER.size:])
+            except (EOFError, ValueError, TypeError):  # 壊れたバンドル
+                return None
+
+    try:
+        return _decode_payload(payload)
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError):  # 構造が異なるバンドル
+        return None
+
+
+def _decode_payload(payload) -> Tuple[List[Rule], Dict[str, List[Rule]]]:
+    """バンドルの本体から (ルール, ビザタイプごとのルール) を復元"""
+    facts = payload["facts"]
+    rules = [
+        Rule(
+            id=rule_id,
+            conditions=[
+                Condition(facts[fact], required_value)
+                for fact, required_value in zip(condition_facts, required_values)
+            ],
+            conclusion=facts[conclusion],
+            operator=operator,
+            conclusion_value=conclusion_value,
+            priority=priority,
+            visa_type=visa_type,
+        )
+        for (
+            rule_id, condition_facts, required_values, operator,
+            conclusion, conclusion_value, priority, visa_type,
+        ) in payload["rules"]
+    ]
+    subsets = {
+        visa_type: [rules[position] for position in positions]
+        for visa_type, positions in payload["subsets"].items()
+    }
+    return rules, subsets
@@ -0,0 +1,281 @@
+"""RuleRepository クラス - コンパイル済み知識ベースのキャッシュと再読み込み"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from ..models.fact_table import FactTable
+from ..models.knowledge_base import KnowledgeBase
+from ..models.rule import Rule
+from ..models.schemas import RulesFileSchema
+from ..models.visa_index import build_visa_type_index
+from . import metrics
+from .decision_tree import DecisionTree, load_decision_trees
+from .encoded_response import EncodedResponse
+from .rule_bundle import load_rule_bundle, save_rule_bundle
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data"))
+
+# ルール定義ファイルの既定パス
+DEFAULT_RULES_FILE = os.path.join(DATA_DIR, "rules.json")
+
+# 再読み込みの後も保持しておく、差し替え前のルール一式の数
+MAX_PREVIOUS_RULE_SETS = 4
+
+# add_visa_types.py が出力するルールバンドルの既定パス
+DEFAULT_RULE_BUNDLE_FILE = os.path.join(DATA_DIR, "rules.bundle")
+
+# compile_decision_trees.py が出力する決定木の既定パス
+DEFAULT_DECISION_TREES_FILE = os.path.join(DATA_DIR, "decision_trees.json")
+
+
+def compute_rules_version(content: bytes) -> str:
+    """ルール定義の内容からバージョン（ハッシュ値）を計算"""
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+def read_rules(rules_file: str = DEFAULT_RULES_FILE) -> List[Rule]:
+    """JSONファイルからルールを読み込み"""
+    with open(rules_file, "rb") as f:
+        content = f.read()
+    return parse_rules(content)
+
+
+def parse_rules(content: bytes) -> List[Rule]:
+    """JSONの内容からルールを生成（ビザタイプごとのルールは RuleSet が依存関係から求める）"""
+    data = json.loads(content)
+    # pydantic による検証は読み込み時の一度だけ行い、推論には軽量な Rule を使う
+    schema = RulesFileSchema(**data)
+    return [rule_schema.to_rule() for rule_schema in schema.rules]
+
+
+def build_knowledge_base(
+    rules: List[Rule],
+    visa_type: Optional[str] = None,
+    rules_version: Optional[str] = None,
+    filtered_rules: Optional[List[Rule]] = None,
+    fact_table: Optional[FactTable] = None,
+) -> KnowledgeBase:
+    """ルール一覧から知識ベースを構築して確定（filtered_rules はフィルタリング済みのルール）"""
+    kb = KnowledgeBase(visa_type=visa_type, rules_version=rules_version, fact_table=fact_table)
+    for rule in rules:
+        kb.add_rule(rule)
+    kb.finalize(filtered_rules)
+    return kb
+
+
+class RuleSet:
+    """ある時点の rules.json から構築したルール一式
+
+    ルールとバージョンは変更されない。ビザタイプごとのルールは、申請の結論から
+    依存関係をさかのぼった索引（build_visa_type_index）として作成時に一度だけ求め、
+    すべてのビザタイプの知識ベースが同じ Rule を共有する。ビザタイプごとの知識ベースは
+    初回のみ構築し、以降はすべての診断セッションで同じ（変更されない）知識ベースを共有する。
+    セッション固有の事実の状態は InferenceEngine 側が保持する。
+    ルールから作る API の応答（/rules・/facts）も、初回のみエンコードして保持する。
+    """
+
+    def __init__(
+        self,
+        rules: List[Rule],
+        rules_version: Optional[str],
+        decision_trees_file: Optional[str] = None,
+        subsets: Optional[Dict[str, List[Rule]]] = None,
+        modified_at: Optional[float] = None,
+    ):
+        self.rules = rules
+        self.rules_version = rules_version  # rules.json の内容のハッシュ値
+        self.modified_at = time.time() if modified_at is None else modified_at  # rules.json の更新日時
+        self.decision_trees_file = decision_trees_file
+        # ビザタイプ → そのビザタイプの診断に使うルール（ルールバンドルから読み込んだ場合はその索引）
+        if subsets is None:
+            subsets = {
+                visa_type: [rules[position] for position in positions]
+                for visa_type, positions in build_visa_type_index(rules).items()
+            }
+        self._subsets = subsets
+        self._visa_types = sorted(subsets)
+        # 事実名と ID の対応表（すべてのビザタイプの知識ベースで共有）
+        self.fact_table = FactTable.from_rules(rules)
+        self._knowledge_bases: Dict[Optional[str], KnowledgeBase] = {}
+        self._decision_trees: Optional[Dict[str, DecisionTree]] = None
+        self._responses: Dict[Hashable, EncodedResponse] = {}
+        self._lock = threading.Lock()
+
+    def get(self, visa_type: Optional[str] = None) -> KnowledgeBase:
+        """ビザタイプに対応する知識ベースを取得（初回のみ構築）
+
+        索引にないビザタイプはルールのない知識ベースになる。任意の文字列で
+        キャッシュが増え続けないよう、保持せずにその都度構築する。
+        """
+        kb = self._knowledge_bases.get(visa_type)
+        if kb is not None:
+            return kb
+        if visa_type is not None and visa_type not in self._subsets:
+            return build_knowledge_base(self.rules, visa_type, self.rules_version, [], self.fact_table)
+
+        with self._lock:
+            kb = self._knowledge_bases.get(visa_type)
+            if kb is None:
+                started = time.perf_counter()
+                subset = None if visa_type is None else self._subsets[visa_type]
+                kb = build_knowledge_base(
+                    self.rules, visa_type, self.rules_version, subset, self.fact_table
+                )
+                if metrics.enabled:
+                    metrics.knowledge_base_build_seconds.observe(
+                        time.perf_counter() - started, labels=(visa_type or "all",)
+                    )
+                self._knowledge_bases[visa_type] = kb
+            return kb
+
+    def get_response(self, key: Hashable, build: Callable[["RuleSet"], Any]) -> EncodedResponse:
+        """ルール一式から作る応答を取得（初回のみ build(self) の結果をエンコード）"""
+        response = self._responses.get(key)
+        if response is None:
+            # build は知識ベースの構築でロックを取得するため、ロックの外で作成する
+            response = EncodedResponse(build(self), self.modified_at)
+            response = self._responses.setdefault(key, response)
+        return response
+
+    def load_decision_trees(self):
+        """コンパイル済みの決定木をファイルから読み込み"""
+        trees = {}
+        if self.decision_trees_file and os.path.exists(self.decision_trees_file):
+            trees = load_decision_trees(self.decision_trees_file)
+        self._decision_trees = trees
+
+    def get_decision_tree(self, visa_type: Optional[str]) -> Optional[DecisionTree]:
+        """コンパイル済みの決定木を取得（ないか、ルールが変わっている場合は None）"""
+        if self._decision_trees is None:
+            self.load_decision_trees()
+
+        tree = self._decision_trees.get(visa_type)
+        if tree is None or not tree.matches(self.get(visa_type)):
+            return None
+        return tree
+
+    def visa_types(self) -> List[str]:
+        """ルールに含まれるビザタイプの一覧を取得"""
+        return self._visa_types
+
+    def preload(self):
+        """すべてのビザタイプの知識ベースと決定木を事前に読み込み"""
+        self.get(None)
+        for visa_type in self.visa_types():
+            self.get_decision_tree(visa_type)
+
+    def save_bundle(self, path: str = DEFAULT_RULE_BUNDLE_FILE):
+        """ルールとビザタイプごとのルールの索引をバンドルに保存"""
+        save_rule_bundle(self.rules, self.rules_version, self._subsets, path)
+
+
+class RuleRepository:
+    """現在のルール一式（RuleSet）を保持するクラス
+
+    rules.json は初回のアクセス時に読み込む。内容が一致するルールバンドルがあれば、
+    JSON の解析と検証を省略してバンドルから読み込む。reload() は変更されたルールを
+    検証してすべての知識ベースを構築してから、現在のルール一式を差し替える。
+    差し替えは参照の置き換えだけで行うため、処理中のリクエストは止まらず、
+    開始済みの診断セッションは開始時の知識ベースを使い続ける。
+    """
+
+    def __init__(
+        self,
+        rules_file: str = DEFAULT_RULES_FILE,
+        decision_trees_file: Optional[str] = DEFAULT_DECISION_TREES_FILE,
+        bundle_file: Optional[str] = DEFAULT_RULE_BUNDLE_FILE,
+    ):
+        self.rules_file = rules_file
+        self.decision_trees_file = decision_trees_file
+        self.bundle_file = bundle_file
+        self._current: Optional[RuleSet] = None
+        # 差し替え前のルール一式（保存されたセッションを開始時のルールで復元するため）
+        self._previous: "OrderedDict[str, RuleSet]" = OrderedDict()
+        self._lock = threading.Lock()  # 読み込み・再読み込みを1つずつ行う
+
+    def _load(self) -> RuleSet:
+        """rules.json からルール一式を構築（最新のルールバンドルがあればそれを使う）"""
+        started = time.perf_counter()
+        with open(self.rules_file, "rb") as f:
+            content = f.read()
+            modified_at = os.fstat(f.fileno()).st_mtime
+        rules_version = compute_rules_version(content)
+        bundle = load_rule_bundle(self.bundle_file, rules_version) if self.bundle_file else None
+        if bundle is None:
+            rule_set = RuleSet(
+                parse_rules(content), rules_version, self.decision_trees_file, modified_at=modified_at
+            )
+        else:
+            rules, subsets = bundle
+            rule_set = RuleSet(rules, rules_version, self.decision_trees_file, subsets, modified_at)
+        if metrics.enabled:
+            metrics.rules_load_seconds.observe(
+                time.perf_counter() - started, labels=("json" if bundle is None else "bundle",)
+            )
+        return rule_set
+
+    @property
+    def current(self) -> RuleSet:
+        """現在のルール一式（初回のみ読み込み）"""
+        rule_set = self._current
+        if rule_set is None:
+            with self._lock:
+                if self._current is None:
+                    self._current = self._load()
+                rule_set = self._current
+        return rule_set
+
+    @property
+    def rules_version(self) -> Optional[str]:
+        """現在のルール定義のバージョン（ハッシュ値）"""
+        return self.current.rules_version
+
+    def reload(self) -> bool:
+        """rules.json が変わっていれば新しいルール一式に差し替える（差し替えたら True）
+
+        ルールが不正な場合は例外を送出し、現在のルール一式を使い続ける。
+        """
+        with self._lock:
+            rule_set = self._load()
+            if self._current is not None and rule_set.rules_version == self._current.rules_version:
+                return False
+            # 差し替える前に、すべてのビザタイプの知識ベースを構築しておく
+            rule_set.preload()
+            previous = self._current
+            self._current = rule_set
+            if previous is not None:
+                self._previous[previous.rules_version] = previous
+                while len(self._previous) > MAX_PREVIOUS_RULE_SETS:
+                    self._previous.popitem(last=False)
+            return True
+
+    def get_rule_set(self, rules_version: Optional[str]) -> Optional[RuleSet]:
+        """バージョンに対応するルール一式を取得（このプロセスで読み込んでいない場合は None）"""
+        rule_set = self.current
+        if rule_set.rules_version == rules_version:
+            return rule_set
+        return self._previous.get(rules_version)
+
+    def reload_decision_trees(self):
+        """現在のルール一式の決定木をファイルから読み直す"""
+        self.current.load_decision_trees()
+
+    def get(self, visa_type: Optional[str] = None) -> KnowledgeBase:
+        """ビザタイプに対応する知識ベースを取得（初回のみ構築）"""
+        return self.current.get(visa_type)
+
+    def get_decision_tree(self, visa_type: Optional[str]) -> Optional[DecisionTree]:
+        """コンパイル済みの決定木を取得（ないか、ルールが変わっている場合は None）"""
+        return self.current.get_decision_tree(visa_type)
+
+    def visa_types(self) -> List[str]:
+        """ルールに含まれるビザタイプの一覧を取得"""
+        return self.current.visa_types()
+
+    def preload(self):
+        """すべてのビザタイプの知識ベースと決定木を事前に読み込み"""
+        self.current.preload()
@@ -0,0 +1,82 @@
+"""RulesWatcher クラス - rules.json の変更を監視して再読み込み"""
+import logging
+import os
+import threading
+from typing import Optional, Tuple
+
+from .rule_repository import RuleRepository
+
+logger = logging.getLogger(__name__)
+
+FileStamp = Optional[Tuple[int, int]]  # (更新時刻, サイズ)。ファイルがない場合は None
+
+
+def _stamp(path: Optional[str]) -> FileStamp:
+    """ファイルの変更を検出するための (更新時刻, サイズ)"""
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class RulesWatcher:
+    """rules.json と決定木のファイルを定期的に確認し、変更されたら再読み込みするクラス
+
+    再読み込み（検証と知識ベースの構築）はバックグラウンドのスレッドで行い、
+    完成したルール一式を RuleRepository が差し替えるため、リクエストは待たされない。
+    ルールが不正な場合はログに記録し、現在のルールを使い続ける。
+    """
+
+    def __init__(self, repository: RuleRepository, interval: float = 2.0):
+        self.repository = repository
+        self.interval = interval  # 確認の間隔（秒）
+        self._rules_stamp = _stamp(repository.rules_file)
+        self._trees_stamp = _stamp(repository.decision_trees_file)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """監視を開始"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rules-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """監視を停止"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self) -> bool:
+        """ファイルの変更を確認して再読み込み（ルールを差し替えたら True）"""
+        reloaded = False
+        rules_stamp = _stamp(self.repository.rules_file)
+        if rules_stamp is not None and rules_stamp != self._rules_stamp:
+            # 不正なルールは同じ内容で何度も読み直さない（次に変更されたときに再度試す）
+            self._rules_stamp = rules_stamp
+            try:
+                reloaded = self.repository.reload()
+            except Exception:
+                logger.exception("rules.json の再読み込みに失敗しました。現在のルールを使い続けます")
+            else:
+                if reloaded:
+                    logger.info("rules.json を再読み込みしました (version %s)", self.repository.rules_version)
+
+        trees_stamp = _stamp(self.repository.decision_trees_file)
+        if trees_stamp != self._trees_stamp:
+            self._trees_stamp = trees_stamp
+            try:
+                self.repository.reload_decision_trees()
+            except Exception:
+                logger.exception("決定木の再読み込みに失敗しました")
+        return reloaded
@@ -0,0 +1,236 @@
+"""セッションの保存先 - 複数のワーカー・インスタンスで共有する診断セッションの状態
+
+保存するのは直列化した診断セッションの状態（回答とルールのバージョン）のみで、
+導出された事実は読み込み時に回答を再現して求め直す。
+保存は、保存先の版（revision）が読み込んだときの版と同じ場合にのみ行う（compare-and-set）。
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+
+class SessionBackend:
+    """直列化したセッションの状態をセッションIDをキーに保存する保存先の基底クラス"""
+
+    def load(self, session_id: str) -> Optional[bytes]:
+        """状態を取得（存在しないか期限切れの場合は None）"""
+        raise NotImplementedError
+
+    def save(
+        self, session_id: str, data: bytes, ttl_seconds: float, revision: str, expected: Optional[str]
+    ) -> bool:
+        """保存先の版が expected（None の場合は未保存）のときのみ、状態を版 revision として保存
+
+        最終アクセスから ttl_seconds で期限切れにする。別のワーカーが先に保存していた場合は False。
+        """
+        raise NotImplementedError
+
+    def touch(self, session_id: str, ttl_seconds: float):
+        """状態を変えずに有効期限を延長"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        """状態を削除"""
+        raise NotImplementedError
+
+    def count(self) -> Optional[int]:
+        """保存されているセッション数（数えられない保存先では None）"""
+        return None
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """SQLite ファイルに保存する保存先（同じホストの複数のワーカーで共有）"""
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.path = path
+        self._clock = clock
+        self._local = threading.local()  # スレッドごとの接続
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL, revision TEXT)"
+            )
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(sessions)")]
+            if "revision" not in columns:
+                # 版の列がない以前のファイル（保存済みのセッションは比較できないため破棄する）
+                connection.execute("DELETE FROM sessions")
+                connection.execute("ALTER TABLE sessions ADD COLUMN revision TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            # 読み込みと書き込みを複数のプロセスから並行して行えるようにする
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, session_id: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT data FROM sessions WHERE session_id = ? AND expires_at > ?",
+            (session_id, self._clock()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def save(
+        self, session_id: str, data: bytes, ttl_seconds: float, revision: str, expected: Optional[str]
+    ) -> bool:
+        now = self._clock()
+        with self._connect() as connection:
+            # 期限切れのセッションを削除
+            connection.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+            if expected is None:
+                try:
+                    connection.execute(
+                        "INSERT INTO sessions (session_id, data, expires_at, revision) VALUES (?, ?, ?, ?)",
+                        (session_id, data, now + ttl_seconds, revision),
+                    )
+                except sqlite3.IntegrityError:
+                    return False
+                return True
+            cursor = connection.execute(
+                "UPDATE sessions SET data = ?, expires_at = ?, revision = ? WHERE session_id = ? AND revision = ?",
+                (data, now + ttl_seconds, revision, session_id, expected),
+            )
+            return cursor.rowcount == 1
+
+    def touch(self, session_id: str, ttl_seconds: float):
+        now = self._clock()
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE sessions SET expires_at = ? WHERE session_id = ? AND expires_at > ?",
+                (now + ttl_seconds, session_id, now),
+            )
+
+    def delete(self, session_id: str):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def count(self) -> Optional[int]:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (self._clock(),)
+        ).fetchone()[0]
+
+
+# 保存先の版が期待する版と同じ場合のみ保存する Lua スクリプト（値は "版:状態"）
+# KEYS[1]: キー、ARGV[1]: 期待する版（未保存なら空文字列）、ARGV[2]: 保存する値、ARGV[3]: 有効期限（秒）
+COMPARE_AND_SET_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+local revision = ''
+if current then revision = string.match(current, '^([^:]*):') or '' end
+if revision ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class RedisSessionBackend(SessionBackend):
+    """Redis 互換のクライアント（get / eval / expire / delete）に保存する保存先
+
+    値は "版:状態" の形式で保存し、版の比較と保存は Lua スクリプトで不可分に行う。
+    client には redis.Redis や、ローカルで代わりに使う FakeRedis を渡す。
+    """
+
+    def __init__(self, client, prefix: str = "visa-expert:session:"):
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, session_id: str) -> Optional[bytes]:
+        value = self.client.get(self.prefix + session_id)
+        if value is None:
+            return None
+        return value.partition(b":")[2]
+
+    def save(
+        self, session_id: str, data: bytes, ttl_seconds: float, revision: str, expected: Optional[str]
+    ) -> bool:
+        saved = self.client.eval(
+            COMPARE_AND_SET_SCRIPT, 1, self.prefix + session_id,
+            expected or "", revision.encode("ascii") + b":" + data, max(1, int(ttl_seconds)),
+        )
+        return bool(saved)
+
+    def touch(self, session_id: str, ttl_seconds: float):
+        self.client.expire(self.prefix + session_id, max(1, int(ttl_seconds)))
+
+    def delete(self, session_id: str):
+        self.client.delete(self.prefix + session_id)
+
+
+class FakeRedis:
+    """Redis の get / set(ex=) / expire / delete と、COMPARE_AND_SET_SCRIPT の eval のみを実装したプロセス内の代替
+
+    1つのプロセスでのみ共有されるため、開発や動作確認で Redis の代わりに使う。
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= self._clock():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ex: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, None if ex is None else self._clock() + ex)
+
+    def expire(self, key: str, seconds: float) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or (item[1] is not None and item[1] <= self._clock()):
+                return False
+            self._data[key] = (item[0], self._clock() + seconds)
+            return True
+
+    def eval(self, script: str, numkeys: int, *keys_and_args) -> int:
+        if script != COMPARE_AND_SET_SCRIPT:
+            raise NotImplementedError("FakeRedis は COMPARE_AND_SET_SCRIPT のみ実行できます")
+        key, expected, value, ex = keys_and_args
+        with self._lock:
+            current = self._data.get(key)
+            if current is not None and current[1] is not None and current[1] <= self._clock():
+                current = None
+            revision = b"" if current is None else current[0].partition(b":")[0]
+            if revision != expected.encode("ascii"):
+                return 0
+            self._data[key] = (value, self._clock() + ex)
+            return 1
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+
+def create_session_backend(name: str) -> Optional[SessionBackend]:
+    """名前から保存先を作成（memory の場合は None）
+
+    sqlite: SESSION_SQLITE_PATH（既定 sessions.db）のファイル
+    redis: REDIS_URL の Redis（redis パッケージが必要）
+    fakeredis: プロセス内の FakeRedis
+    """
+    if name == "memory":
+        return None
+    if name == "sqlite":
+        return SQLiteSessionBackend(os.environ.get("SESSION_SQLITE_PATH", "sessions.db"))
+    if name == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("SESSION_BACKEND=redis には redis パッケージが必要です")
+        return RedisSessionBackend(redis.Redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0")))
+    if name == "fakeredis":
+        return RedisSessionBackend(FakeRedis())
+    raise ValueError(f"不明なセッションの保存先です: {name}")
@@ -0,0 +1,226 @@
+"""SessionStore クラス - 複数の診断セッションの管理"""
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import anyio
+
+from .consultation import Consultation
+from .session_backends import SessionBackend
+
+
+class Session:
+    """セッションIDと診断セッションの組"""
+
+    __slots__ = ("session_id", "consultation", "lock", "async_lock", "last_access", "revision")
+
+    def __init__(
+        self, session_id: str, consultation: Consultation, now: float, revision: Optional[str] = None
+    ):
+        self.session_id = session_id
+        self.consultation = consultation
+        self.lock = threading.Lock()  # セッション単位の操作を直列化
+        # イベントループ側で操作の順番を待つためのロック（待っている間はスレッドを使わない）
+        self.async_lock = anyio.Lock()
+        self.last_access = now
+        self.revision = revision  # consultation が反映している保存先の版（未保存なら None）
+
+
+class SessionStore:
+    """セッションIDをキーに診断セッションを保持するクラス
+
+    最終アクセスから ttl_seconds を過ぎたセッションは破棄され、
+    max_sessions を超えた場合は最も長くアクセスのないセッションから破棄される（LRU）。
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        ttl_seconds: float = 1800,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, consultation: Consultation) -> Session:
+        """新しいセッションを登録"""
+        session_id = secrets.token_urlsafe(16)
+        with self._lock:
+            now = self._clock()
+            self._evict_expired(now)
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            session = Session(session_id, consultation, now)
+            self._sessions[session_id] = session
+        return session
+
+    def get(self, session_id: Optional[str]) -> Optional[Session]:
+        """セッションを取得（期限切れまたは存在しない場合は None）"""
+        if not session_id:
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            now = self._clock()
+            if now - session.last_access > self.ttl_seconds:
+                del self._sessions[session_id]
+                return None
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def sync(self, session: Session) -> bool:
+        """セッションを保存先の状態に合わせる（メモリ上に保持しているため何もしない）"""
+        return True
+
+    def save(self, session: Session) -> bool:
+        """セッションの変更を保存（メモリ上に保持しているため何もしない）"""
+        return True
+
+    def delete(self, session_id: str):
+        """セッションを破棄"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict_expired(self, now: float):
+        """期限切れのセッションを破棄（ロック取得済みで呼び出す）"""
+        # 最終アクセス順に並んでいるため、先頭から期限切れのものだけを調べればよい
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_access <= self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class PersistentSessionStore:
+    """診断セッションの状態を共有の保存先（SQLite・Redis など）に保存するクラス
+
+    保存するのは回答とルールのバージョンのみ（Consultation.to_state）。
+    どのワーカーでも、保存された回答を再現して診断セッションを復元できる。
+    復元したセッションはプロセス内に cache_size 件まで保持し、操作の前に sync() で
+    保存先の版（revision）と比べて、別のワーカーが更新していれば回答を再現し直す。
+    save() は読み込んだ版が保存先の版と同じ場合のみ保存し、先に別のワーカーが保存して
+    いた場合は False を返す（呼び出し側は sync() で作り直してから操作をやり直す）。
+    """
+
+    def __init__(
+        self,
+        backend: SessionBackend,
+        restore: Callable[[Dict], Consultation],
+        ttl_seconds: float = 1800,
+        cache_size: int = 1000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.backend = backend
+        self.restore = restore  # 保存された状態から診断セッションを復元する関数
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self._clock = clock
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, session: Session) -> Session:
+        """復元したセッションをプロセス内に保持（すでに保持している場合はそれを返す）"""
+        with self._lock:
+            session = self._sessions.setdefault(session.session_id, session)
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.cache_size:
+                self._sessions.popitem(last=False)
+        return session
+
+    def _forget(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def create(self, consultation: Consultation) -> Session:
+        """新しいセッションを登録して保存"""
+        session = Session(secrets.token_urlsafe(16), consultation, self._clock())
+        self.save(session)
+        return self._remember(session)
+
+    def get(self, session_id: Optional[str]) -> Optional[Session]:
+        """セッションを取得（期限切れまたは存在しない場合は None）
+
+        このプロセスに保持しているセッションは保存先を読まずに返す（操作の前に sync() で確認する）。
+        """
+        if not session_id:
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+        if session is not None:
+            return session
+
+        data = self.backend.load(session_id)
+        if data is None:
+            return None
+        state = json.loads(data)
+        session = Session(session_id, self.restore(state), self._clock(), state["revision"])
+        return self._remember(session)
+
+    def sync(self, session: Session) -> bool:
+        """セッションを保存先の状態に合わせ、有効期限を延長（session.lock を取得済みで呼び出す）
+
+        期限切れか削除されている場合は False。
+        """
+        data = self.backend.load(session.session_id)
+        if data is None:
+            self._forget(session.session_id)
+            return False
+        state = json.loads(data)
+        if state["revision"] != session.revision:
+            # 別のワーカーが更新した。開始時と同じ知識ベースならリスナーを残したまま回答を再現する
+            consultation = session.consultation
+            kb = consultation.kb
+            if state["visa_type"] == kb.visa_type and state["rules_version"] == kb.rules_version:
+                fact_table = kb.fact_table
+                consultation.replay([(fact_table.intern(fact_name), answer) for fact_name, answer in state["answers"]])
+            else:
+                # ルールが再読み込みされた。新しい知識ベースで復元し、ストリームのリスナーも移す
+                session.consultation = self.restore(state)
+                consultation.move_listeners(session.consultation)
+            session.revision = state["revision"]
+
+        now = self._clock()
+        if now - session.last_access > self.ttl_seconds / 10:
+            # 読み込みだけのリクエストでも期限切れにならないよう延長する（頻繁には書き込まない）
+            self.backend.touch(session.session_id, self.ttl_seconds)
+            session.last_access = now
+        return True
+
+    def save(self, session: Session) -> bool:
+        """セッションの状態を保存先に保存（別のワーカーが先に保存していた場合は False）"""
+        revision = secrets.token_hex(8)
+        state = session.consultation.to_state()
+        state["revision"] = revision
+        saved = self.backend.save(
+            session.session_id,
+            json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            self.ttl_seconds,
+            revision,
+            session.revision,
+        )
+        if saved:
+            session.revision = revision
+            session.last_access = self._clock()
+        return saved
+
+    def delete(self, session_id: str):
+        """セッションを破棄"""
+        self.backend.delete(session_id)
+        self._forget(session_id)
+
+    def __len__(self) -> int:
+        count = self.backend.count()
+        return len(self._sessions) if count is None else count
@@ -0,0 +1,170 @@
+"""VectorizedEvaluator クラス - 多数の申請者に対するルールの一括評価（NumPy）"""
+from typing import Dict, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy は一括評価を使う場合のみ必要
+    np = None
+
+from ..models.knowledge_base import KnowledgeBase
+
+# 一度に評価する行数（作業用の配列の大きさを抑える）
+DEFAULT_CHUNK_ROWS = 65536
+
+
+class VectorizedEvaluator:
+    """知識ベースを「申請者 × 基本事実」の行列に対してまとめて評価するクラス
+
+    事実の状態は、判明しているか (known) と値 (true) の2つの真偽値の行列で表す。
+    ルールは結論の事実のトポロジカルな層ごとにまとめ、層内のすべてのルールを
+    すべての行に対して配列演算で評価する。結果は各行について
+    InferenceEngine の前向き推論と同じになる。
+
+    同じ事実を異なる値で結論とするルールがある知識ベースでは、結果が発火の順序に
+    依存するため、素朴な前向き推論と同じ順序でルールを1つずつ（全行まとめて）適用する。
+    """
+
+    def __init__(self, knowledge_base: KnowledgeBase):
+        if np is None:
+            raise ImportError("VectorizedEvaluator には numpy が必要です")
+        kb = knowledge_base
+        self.kb = kb
+        self.fact_count = len(kb.fact_names)
+        # 入力の列の並び（事実の番号順の基本事実）
+        self.basic_fact_names: List[str] = [name for name in kb.fact_names if name in kb.basic_facts]
+        self.basic_indices = np.array([kb.fact_index[name] for name in self.basic_fact_names], dtype=np.intp)
+        self.conclusion_indices = np.array(
+            [kb.fact_index[name] for name in kb.conclusion_facts], dtype=np.intp
+        )
+        self.sequential = kb.has_conflicting_conclusions
+        if self.sequential:
+            self.groups = [self._compile_group([position]) for position in range(len(kb.rules))]
+        else:
+            self.groups = [self._compile_group(positions) for positions in self._layers()]
+
+    def _layers(self) -> List[List[int]]:
+        """ルールの位置を、結論の事実のトポロジカルな深さごとにまとめる"""
+        kb = self.kb
+        depth: Dict[str, int] = {}
+        for fact_name in kb.topological_facts:
+            depth[fact_name] = max(
+                (
+                    1 + max((depth[cond.fact_name] for cond in rule.conditions), default=0)
+                    for rule in kb.get_rules_with_conclusion(fact_name)
+                ),
+                default=0,
+            )
+        layers: Dict[int, List[int]] = {}
+        for position, rule in enumerate(kb.rules):
+            layers.setdefault(depth[rule.conclusion], []).append(position)
+        return [layers[layer] for layer in sorted(layers)]
+
+    def _compile_group(self, positions: List[int]) -> Dict:
+        """ルールのまとまりを配列にコンパイル（結論の事実ごとに連続して並べる）"""
+        kb = self.kb
+        positions = sorted(positions, key=lambda position: (kb.conclusion_indices[position], position))
+        width = max([len(kb.rules[position].conditions) for position in positions] + [1])
+        condition_indices = np.zeros((len(positions), width), dtype=np.intp)
+        required = np.zeros((len(positions), width), dtype=bool)
+        valid = np.zeros((len(positions), width), dtype=bool)
+        conclusions, values, starts = [], [], []
+        for row, position in enumerate(positions):
+            rule = kb.rules[position]
+            for column, cond in enumerate(rule.conditions):
+                condition_indices[row, column] = kb.fact_index[cond.fact_name]
+                required[row, column] = cond.required_value
+                valid[row, column] = True
+            conclusion = kb.conclusion_indices[position]
+            if not conclusions or conclusions[-1] != conclusion:
+                conclusions.append(conclusion)
+                values.append(rule.conclusion_value)
+                starts.append(row)
+        return {
+            "condition_indices": condition_indices,
+            "required": required,
+            "valid": valid,
+            "is_and": np.array([kb.is_and_rule[position] for position in positions], dtype=bool),
+            "conclusions": np.array(conclusions, dtype=np.intp),
+            "values": np.array(values, dtype=bool),
+            "starts": np.array(starts, dtype=np.intp),
+        }
+
+    def _apply_group(self, group: Dict, known, true) -> bool:
+        """まとまり内のルールを全行に適用（新たに導出された事実があれば True）"""
+        condition_indices = group["condition_indices"]
+        valid = group["valid"]
+        # 行 × ルール × 条件 の配列で条件を評価する
+        matched = known[:, condition_indices] & (true[:, condition_indices] == group["required"])
+        fires = np.where(
+            group["is_and"],
+            np.all(matched | ~valid, axis=2),  # AND: すべての条件が判明して満たされている
+            np.any(matched & valid, axis=2),  # OR: いずれかの条件が判明して満たされている
+        )
+        # 同じ事実を結論とするルールのいずれかが発火すれば導出される
+        fires = np.logical_or.reduceat(fires, group["starts"], axis=1)
+        conclusions = group["conclusions"]
+        derived = fires & ~known[:, conclusions]
+        if not derived.any():
+            return False
+        known[:, conclusions] |= derived
+        true[:, conclusions] |= derived & group["values"]
+        return True
+
+    def _chain(self, known, true):
+        """前向き推論を全行に対して実行（known / true をその場で更新）"""
+        if not self.sequential:
+            # 条件の事実はすべて前の層で確定しているため、1回の走査で導出し尽くせる
+            for group in self.groups:
+                self._apply_group(group, known, true)
+            return
+
+        changed = True
+        while changed:
+            changed = False
+            for group in self.groups:
+                changed |= self._apply_group(group, known, true)
+
+    def evaluate(self, values, known=None, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Tuple:
+        """申請者 × 基本事実の回答を評価し、申請者 × 事実の (known, true) を返す
+
+        values と known の列は basic_fact_names の並び。known を省略した場合は
+        すべての基本事実が判明しているものとして扱う。結果の列は kb.fact_names の並び。
+        """
+        values = np.asarray(values, dtype=bool)
+        answered = np.ones_like(values) if known is None else np.asarray(known, dtype=bool)
+        rows = values.shape[0]
+        known_out = np.zeros((rows, self.fact_count), dtype=bool)
+        true_out = np.zeros((rows, self.fact_count), dtype=bool)
+        for start in range(0, rows, chunk_rows):
+            stop = min(start + chunk_rows, rows)
+            known_chunk = known_out[start:stop]
+            true_chunk = true_out[start:stop]
+            known_chunk[:, self.basic_indices] = answered[start:stop]
+            true_chunk[:, self.basic_indices] = values[start:stop] & answered[start:stop]
+            self._chain(known_chunk, true_chunk)
+        return known_out, true_out
+
+    def get_conclusions(self, true) -> "np.ndarray":
+        """評価結果から、申請者 × 診断結果（kb.conclusion_facts の並び）の真偽値を取得"""
+        return true[:, self.conclusion_indices]
+
+    def to_facts(self, known, true, row: int) -> Dict[str, bool]:
+        """評価結果の1行を事実名をキーにした辞書に変換"""
+        fact_names = self.kb.fact_names
+        return {
+            fact_names[index]: bool(true[row, index])
+            for index in np.flatnonzero(known[row])
+        }
+
+    def encode_answers(self, answer_sets: List[Dict[str, bool]]) -> Tuple["np.ndarray", "np.ndarray"]:
+        """回答の辞書の一覧を evaluate に渡す (values, known) の行列に変換（基本事実以外の回答は無視）"""
+        columns = {name: column for column, name in enumerate(self.basic_fact_names)}
+        values = np.zeros((len(answer_sets), len(columns)), dtype=bool)
+        known = np.zeros((len(answer_sets), len(columns)), dtype=bool)
+        for row, answers in enumerate(answer_sets):
+            for fact_name, answer in answers.items():
+                column = columns.get(fact_name)
+                if column is not None:
+                    known[row, column] = True
+                    values[row, column] = answer
+        return values, known
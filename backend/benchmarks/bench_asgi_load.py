@@ -0,0 +1,127 @@
+"""API の同時利用時のスループットとレイテンシの計測（プロセス内・オフライン）
+
+ネットワークやサーバーを起動せず、FastAPI アプリを ASGI で直接呼び出す。
+同時利用者数ごとに、各利用者が診断の開始・回答・可視化の取得を完了まで繰り返し、
+1秒あたりのリクエスト数と、レイテンシの p50 / p95 / p99 を計測する。
+推論はアプリと同じく上限付きのスレッドで実行されるため、イベントループと
+スレッドの受け渡しを含めた処理時間になる（HTTP の解析とネットワークは含まない）。
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.bench_asgi_load [--users 1,8,32,64] [--duration 秒]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+# rules.json の監視は不要（import 前に設定する）
+os.environ.setdefault("RULES_RELOAD_INTERVAL", "0")
+
+from main import app  # noqa: E402
+from app.api.routes import rule_repository  # noqa: E402
+
+DEFAULT_USERS = "1,8,32,64"
+
+
+class AsgiClient:
+    """ASGI アプリを直接呼び出す最小限の HTTP クライアント"""
+
+    def __init__(self, app):
+        self.app = app
+        self.headers: Dict[str, str] = {}
+
+    async def request(self, method: str, path: str, body=None) -> Tuple[int, object]:
+        path, _, query = path.partition("?")
+        payload = json.dumps(body).encode() if body is not None else b""
+        headers = [(b"content-type", b"application/json")]
+        headers += [(name.lower().encode(), value.encode()) for name, value in self.headers.items()]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+            "query_string": query.encode(), "root_path": "", "headers": headers,
+            "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 80),
+        }
+        finished = asyncio.Event()
+        sent = False
+        status = 0
+        chunks: List[bytes] = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    finished.set()
+
+        await self.app(scope, receive, send)
+        finished.set()
+        return status, json.loads(b"".join(chunks) or b"null")
+
+
+async def run_user(deadline: float, latencies: List[float], seed: int, visa_types: List[str]):
+    """診断の開始から完了までを期限まで繰り返す"""
+    rnd = random.Random(seed)
+    client = AsgiClient(app)
+
+    async def call(method: str, path: str, body=None):
+        started = time.perf_counter()
+        status, data = await client.request(method, path, body)
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            raise RuntimeError(f"{method} {path}: {status} {data}")
+        return data
+
+    while time.perf_counter() < deadline:
+        started = await call("POST", "/api/consultation/start", {"visa_type": rnd.choice(visa_types)})
+        client.headers["X-Session-ID"] = started["session_id"]
+        question: Optional[str] = started["next_question"]
+        while question and time.perf_counter() < deadline:
+            result = await call("POST", "/api/consultation/answer", {"question": question, "answer": rnd.random() < 0.6})
+            await call("GET", "/api/consultation/visualization")
+            question = None if result["is_finished"] else result["next_question"]
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+
+
+async def run_level(users: int, duration: float, visa_types: List[str]) -> List[float]:
+    latencies: List[float] = []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(run_user(deadline, latencies, seed, visa_types) for seed in range(users)))
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default=DEFAULT_USERS)
+    parser.add_argument("--duration", type=float, default=3.0)
+    args = parser.parse_args(argv)
+
+    rule_repository.preload()
+    visa_types = rule_repository.current.visa_types()
+    print(f"{'users':>6}{'req/s':>9}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    for users in (int(value) for value in args.users.split(",")):
+        latencies = asyncio.run(run_level(users, args.duration, visa_types))
+        print(
+            f"{users:>6}{len(latencies) / args.duration:>9.0f}{percentile(latencies, 0.5):>10.2f}"
+            f"{percentile(latencies, 0.95):>10.2f}{percentile(latencies, 0.99):>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
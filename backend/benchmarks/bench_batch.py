@@ -0,0 +1,48 @@
+"""一括診断（evaluate_batch）のスループット計測
+
+ランダムな回答を持つレコードを生成し、1プロセスでの推論と
+プロセスプールでの推論の1秒あたりの処理件数を比較する。
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.bench_batch [レコード数]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+from app.services.batch import evaluate_batch
+from app.services.rule_repository import RuleRepository
+
+VISA_TYPES = ["E", "L", "B", "H-1B", "J-1"]
+
+
+def generate_lines(repository: RuleRepository, count: int, seed: int = 0):
+    """ランダムな回答を持つNDJSONの行を生成"""
+    rnd = random.Random(seed)
+    basic_facts = {visa_type: sorted(repository.get(visa_type).basic_facts) for visa_type in VISA_TYPES}
+    for index in range(count):
+        visa_type = rnd.choice(VISA_TYPES)
+        facts = basic_facts[visa_type]
+        answers = {fact_name: rnd.random() < 0.5 for fact_name in rnd.sample(facts, rnd.randint(0, len(facts)))}
+        yield json.dumps({"id": index, "visa_type": visa_type, "answers": answers}, ensure_ascii=False)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repository = RuleRepository()
+    repository.preload()
+    lines = list(generate_lines(repository, count))
+
+    print(f"{count} records")
+    for workers in sorted({0, 2, os.cpu_count() or 1}):
+        started = time.perf_counter()
+        for _ in evaluate_batch(lines, repository, workers=workers):
+            pass
+        elapsed = time.perf_counter() - started
+        print(f"workers={workers:<3}{elapsed:>8.2f} s{count / elapsed:>12.0f} records/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""起動時のルール読み込み時間の計測
+
+新しいプロセスで RuleRepository を作成し、すべてのビザタイプの知識ベースを
+構築するまでの時間を、rules.json から読み込む場合とルールバンドルから読み込む場合で比較する。
+（決定木の読み込みは含めない）。引数で倍率を指定すると、事実名を変えて
+rules.json を複製した大きなルールで計測する。
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.bench_cold_start [倍率]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from app.services.rule_repository import RuleRepository
+from benchmarks.synthetic_rules import scaled_rules, write_rules
+
+RUNS = 20
+
+# 子プロセスで実行するコード（import 後のルール読み込み時間をミリ秒で出力）
+CHILD = """
+import time
+from app.services.rule_repository import RuleRepository
+started = time.perf_counter()
+repository = RuleRepository({rules_file!r}, decision_trees_file=None, bundle_file={bundle_file!r})
+rule_set = repository.current
+load = time.perf_counter() - started
+rule_set.get(None)
+for visa_type in rule_set.visa_types():
+    rule_set.get(visa_type)
+print(load * 1000, (time.perf_counter() - started) * 1000)
+"""
+
+
+def measure(rules_file: str, bundle_file) -> tuple:
+    """(ルールの読み込み, 知識ベースの構築まで) の時間の中央値（ミリ秒）"""
+    loads, totals = [], []
+    for _ in range(RUNS):
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD.format(rules_file=rules_file, bundle_file=bundle_file)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        load, total = map(float, output.split())
+        loads.append(load)
+        totals.append(total)
+    return statistics.median(loads), statistics.median(totals)
+
+
+def main():
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    with tempfile.TemporaryDirectory() as directory:
+        rules_file = os.path.join(directory, "rules.json")
+        bundle_file = os.path.join(directory, "rules.bundle")
+        write_rules(rules_file, scaled_rules(copies))
+        rule_set = RuleRepository(rules_file, decision_trees_file=None, bundle_file=None).current
+        rule_set.save_bundle(bundle_file)
+
+        print(f"{len(rule_set.rules)} rules")
+        print(f"{'source':<14}{'load rules (ms)':>18}{'all KBs (ms)':>16}")
+        for label, bundle in (("rules.json", None), ("rules.bundle", bundle_file)):
+            load, total = measure(rules_file, bundle)
+            print(f"{label:<14}{load:>18.2f}{total:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
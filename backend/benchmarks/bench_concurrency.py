@@ -0,0 +1,131 @@
+"""同時接続数を増やしたときの API レイテンシの計測（負荷試験）
+
+uvicorn でサーバーを起動し、同時利用者数ごとに、各利用者が診断の開始から
+完了までを繰り返す。API リクエストのレイテンシ（p50 / p99）と、並行して
+送る /health のレイテンシ（イベントループが止まっていないか）を計測する。
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.bench_concurrency [--app-dir DIR] [--duration 秒]
+
+--app-dir に別のチェックアウトの backend ディレクトリを指定すると、
+変更前のサーバーと比較できる。
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+USER_COUNTS = [1, 8, 32, 64]
+VISA_TYPES = ["E", "L", "B", "H-1B", "J-1"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app_dir: str, port: int) -> subprocess.Popen:
+    """uvicorn でサーバーを起動し、応答するまで待つ"""
+    env = dict(os.environ, RULES_RELOAD_INTERVAL="0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=app_dir, env=env,
+    )
+    for _ in range(100):
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            connection.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("サーバーが起動しませんでした")
+
+
+class Client:
+    """keep-alive で1つの接続を使い続ける HTTP クライアント"""
+
+    def __init__(self, port: int):
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        self.headers = {"Content-Type": "application/json"}
+
+    def request(self, method: str, path: str, body=None, latencies=None):
+        started = time.perf_counter()
+        self.connection.request(method, path, json.dumps(body) if body is not None else None, self.headers)
+        data = json.loads(self.connection.getresponse().read())
+        if latencies is not None:
+            latencies.append(time.perf_counter() - started)
+        return data
+
+
+def run_user(port: int, deadline: float, latencies: list, seed: int):
+    """診断の開始から完了までを期限まで繰り返す"""
+    rnd = random.Random(seed)
+    client = Client(port)
+    while time.perf_counter() < deadline:
+        started = client.request("POST", "/api/consultation/start", {"visa_type": rnd.choice(VISA_TYPES)}, latencies)
+        client.headers["X-Session-ID"] = started["session_id"]
+        question = started["next_question"]
+        while question and time.perf_counter() < deadline:
+            result = client.request(
+                "POST", "/api/consultation/answer", {"question": question, "answer": rnd.random() < 0.5}, latencies
+            )
+            client.request("GET", "/api/consultation/visualization", latencies=latencies)
+            question = None if result["is_finished"] else result["next_question"]
+
+
+def run_probe(port: int, deadline: float, latencies: list):
+    """/health を一定間隔で送り、イベントループの応答性を計測"""
+    client = Client(port)
+    while time.perf_counter() < deadline:
+        client.request("GET", "/health", latencies=latencies)
+        time.sleep(0.01)
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--app-dir", default=os.getcwd())
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_server(args.app_dir, port)
+    try:
+        print(f"{'users':>6}{'req/s':>9}{'p50 (ms)':>10}{'p99 (ms)':>10}{'health p99 (ms)':>17}")
+        for users in USER_COUNTS:
+            deadline = time.perf_counter() + args.duration
+            latencies, probe = [], []
+            threads = [
+                threading.Thread(target=run_user, args=(port, deadline, latencies, seed)) for seed in range(users)
+            ]
+            threads.append(threading.Thread(target=run_probe, args=(port, deadline, probe)))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            print(
+                f"{users:>6}{len(latencies) / args.duration:>9.0f}"
+                f"{statistics.median(latencies) * 1000:>10.2f}{percentile(latencies, 0.99):>10.2f}"
+                f"{percentile(probe, 0.99):>17.2f}"
+            )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""InferenceEngine の主要な処理のマイクロベンチマーク
+
+rules.json と、その 10 / 100 / 1000 倍の規模の合成ルール（benchmarks.synthetic_rules）の
+全ルールの知識ベースで、次の処理の1回あたりの時間（中央値）を計測する。
+
+- forward_chain: 基本事実の半数にランダムに回答し、前向き推論で導出し終えるまで
+- select_best_fact: 1問ずつ回答しながら次の質問を選ぶ1回分（_select_best_fact）
+- rule_statuses: 回答の途中の状態ですべてのルールの状態を作る（get_rule_statuses）
+- reset_from_fact: 回答済みの事実1つと、それに依存する導出事実をリセットして推論し直す
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.bench_engine [--scales 1,10,100,1000] [--kind scaled|random]
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Callable, List, Tuple
+
+from app.models.knowledge_base import KnowledgeBase
+from app.services.inference_engine import InferenceEngine
+from app.services.rule_repository import build_knowledge_base, parse_rules
+from benchmarks.synthetic_rules import generate, to_content
+
+DEFAULT_SCALES = "1,10,100,1000"
+BUDGET_SECONDS = 0.5  # 1つの計測に使う時間の目安
+MAX_RUNS = 200
+
+
+def build(scale: int, kind: str) -> KnowledgeBase:
+    """倍率 scale の合成ルールで全ルールの知識ベースを構築"""
+    return build_knowledge_base(parse_rules(to_content(generate(scale, kind))), None, f"bench-{kind}-{scale}")
+
+
+def random_answers(kb: KnowledgeBase, rnd: random.Random, fraction: float = 0.5) -> List[Tuple[str, bool]]:
+    """基本事実の一部へのランダムな回答（定義順）"""
+    basic = [fact_name for fact_name in kb.fact_names if kb.is_basic_fact(fact_name)]
+    return [(fact_name, rnd.random() < 0.6) for fact_name in basic if rnd.random() < fraction]
+
+
+def measure(run: Callable[[random.Random], float]) -> float:
+    """run（計測した秒数を返す）を時間の目安まで繰り返し、中央値をマイクロ秒で返す"""
+    rnd = random.Random(0)
+    samples = []
+    deadline = time.perf_counter() + BUDGET_SECONDS
+    while len(samples) < 3 or (time.perf_counter() < deadline and len(samples) < MAX_RUNS):
+        samples.append(run(rnd))
+    return statistics.median(samples) * 1e6
+
+
+def bench_forward_chain(kb: KnowledgeBase) -> float:
+    def run(rnd: random.Random) -> float:
+        answers = random_answers(kb, rnd)
+        engine = InferenceEngine(kb)
+        started = time.perf_counter()
+        for fact_name, answer in answers:
+            engine.assert_fact(fact_name, answer)
+        engine.forward_chain()
+        return time.perf_counter() - started
+    return measure(run)
+
+
+def bench_select_best_fact(kb: KnowledgeBase) -> float:
+    def run(rnd: random.Random) -> float:
+        engine = InferenceEngine(kb)
+        elapsed, steps = 0.0, 0
+        for _ in range(20):
+            engine.forward_chain()
+            started = time.perf_counter()
+            fact_name = engine._select_best_fact()
+            elapsed += time.perf_counter() - started
+            steps += 1
+            if fact_name is None:
+                break
+            engine.assert_fact(fact_name, rnd.random() < 0.6)
+        return elapsed / steps
+    return measure(run)
+
+
+def bench_rule_statuses(kb: KnowledgeBase) -> float:
+    def run(rnd: random.Random) -> float:
+        engine = InferenceEngine(kb)
+        for fact_name, answer in random_answers(kb, rnd, fraction=0.3):
+            engine.assert_fact(fact_name, answer)
+        engine.forward_chain()
+        started = time.perf_counter()
+        engine.get_rule_statuses()
+        return time.perf_counter() - started
+    return measure(run)
+
+
+def bench_reset_from_fact(kb: KnowledgeBase) -> float:
+    def run(rnd: random.Random) -> float:
+        answers = random_answers(kb, rnd)
+        engine = InferenceEngine(kb)
+        for fact_name, answer in answers:
+            engine.assert_fact(fact_name, answer)
+        engine.forward_chain()
+        started = time.perf_counter()
+        engine.reset_from_fact(rnd.choice(answers)[0])
+        return time.perf_counter() - started
+    return measure(run)
+
+
+BENCHMARKS = [
+    ("forward_chain", bench_forward_chain),
+    ("select_best_fact", bench_select_best_fact),
+    ("rule_statuses", bench_rule_statuses),
+    ("reset_from_fact", bench_reset_from_fact),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", default=DEFAULT_SCALES)
+    parser.add_argument("--kind", choices=["scaled", "random"], default="scaled")
+    args = parser.parse_args(argv)
+
+    print(f"{'scale':>6}{'rules':>8}{'facts':>8}" + "".join(f"{name + ' (us)':>22}" for name, _ in BENCHMARKS))
+    for scale in (int(value) for value in args.scales.split(",")):
+        kb = build(scale, args.kind)
+        results = [bench(kb) for _, bench in BENCHMARKS]
+        print(f"{scale:>6}{len(kb.rules):>8}{len(kb.fact_names):>8}" + "".join(f"{value:>22.1f}" for value in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""ルールモデルの比較: pydantic モデルと __slots__ を持つ通常のクラス
+
+ルールの生成・発火判定・知識ベースの構築にかかる時間と、
+ルール一覧が占めるメモリ量を比較する。
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.bench_models
+"""
+import json
+import statistics
+import time
+import tracemalloc
+
+from app.models.rule import Rule
+from app.models.schemas import RuleSchema
+from app.services.rule_repository import DEFAULT_RULES_FILE, build_knowledge_base
+
+ITERATIONS = 200
+COPIES = 100  # メモリ計測で複製するルール定義の数
+
+
+class PydanticRule(RuleSchema):
+    """比較用: 以前と同じく pydantic モデルのまま推論に使うルール"""
+
+    def can_fire(self, facts: dict) -> bool:
+        return Rule.can_fire(self, facts)
+
+
+def load_rule_data() -> list:
+    """rules.json のルール定義（辞書）を読み込み"""
+    with open(DEFAULT_RULES_FILE, encoding="utf-8") as f:
+        return json.load(f)["rules"]
+
+
+def build_pydantic(rule_data: list) -> list:
+    return [PydanticRule(**data) for data in rule_data]
+
+
+def build_slotted(rule_data: list) -> list:
+    return [RuleSchema(**data).to_rule() for data in rule_data]
+
+
+def fire_all(rules: list, facts: dict):
+    for rule in rules:
+        rule.can_fire(facts)
+
+
+def measure(func, *args) -> float:
+    """1回あたりの所要時間（マイクロ秒）の中央値"""
+    samples = []
+    for _ in range(ITERATIONS):
+        started = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def measure_memory(build, rule_data: list) -> int:
+    """ルール一覧が保持するメモリ量（バイト）"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rules = build(rule_data)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rules
+    return after - before
+
+
+def main():
+    rule_data = load_rule_data()
+    pydantic_rules = build_pydantic(rule_data)
+    slotted_rules = build_slotted(rule_data)
+    facts = {
+        cond["fact_name"]: index % 2 == 0
+        for index, data in enumerate(rule_data)
+        for cond in data["conditions"]
+    }
+
+    rows = [
+        ("construct (us)", measure(build_pydantic, rule_data), measure(build_slotted, rule_data)),
+        ("can_fire x all (us)", measure(fire_all, pydantic_rules, facts), measure(fire_all, slotted_rules, facts)),
+        (
+            "knowledge base (us)",
+            measure(build_knowledge_base, pydantic_rules),
+            measure(build_knowledge_base, slotted_rules),
+        ),
+        (
+            f"memory x{COPIES} (KiB)",
+            measure_memory(build_pydantic, rule_data * COPIES) / 1024,
+            measure_memory(build_slotted, rule_data * COPIES) / 1024,
+        ),
+    ]
+
+    print(f"{len(rule_data)} rules")
+    print(f"{'':<22}{'pydantic':>12}{'slots':>12}{'ratio':>9}")
+    for label, before, after in rows:
+        print(f"{label:<22}{before:>12.1f}{after:>12.1f}{before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
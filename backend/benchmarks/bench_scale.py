@@ -0,0 +1,144 @@
+"""大規模な知識ベース（既定 50,000 ルール）での読み込みと1回答あたりのレイテンシの計測
+
+合成ルール（benchmarks.synthetic_rules）から指定した件数のルールを生成し、
+次の処理の時間を計測して、目標値（TARGETS_MS）と比べる。
+
+- 読み込み: ルールの解析（parse_rules）と、全ルール・ビザタイプごとの知識ベースの構築
+- 診断の開始: Consultation の作成から最初の質問の取得まで
+- 回答: API と同じく、回答して次の質問と完了状態を取得するまで（1回答ごと）
+- 可視化の差分: 直前の版からの差分（get_visualization_data(since=...)）
+- 前の質問に戻る: 1つ前の質問に戻り、次の質問を取得するまで
+- 事実のリセット: 回答済みの事実1つと依存する導出事実のリセット（reset_from_fact）
+
+診断はすべて全ルールの知識ベースで行う。--check を指定すると、目標値を超えた
+処理がある場合に終了コード 1 で終了する。
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.bench_scale [--rules 50000] [--kind random|scaled] [--walkthroughs 20] [--check]
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+from app.services.consultation import Consultation
+from app.services.rule_repository import RuleSet, build_knowledge_base, parse_rules
+from benchmarks.synthetic_rules import random_rules, scaled_rules, to_content
+
+DEFAULT_RULES = 50000
+MAX_QUESTIONS = 50  # 1回の診断で回答する質問数の上限
+
+# 処理ごとのレイテンシの目標値（ミリ秒、p95）
+TARGETS_MS = {
+    "start": 20.0,
+    "answer": 2.0,
+    "visualization_diff": 10.0,
+    "back": 2.0,
+    "reset_from_fact": 10.0,
+}
+
+
+def make_rules(count: int, kind: str) -> List:
+    """count 件の合成ルール（JSON のまま）"""
+    if kind == "random":
+        return random_rules(count)
+    return scaled_rules(-(-count // 47))[:count]
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+
+
+def walkthrough(kb, rnd: random.Random, samples: Dict[str, List[float]]):
+    """API と同じ順序で診断を進め、処理ごとの時間を samples に追加"""
+    started = time.perf_counter()
+    consultation = Consultation(kb)
+    consultation.start()
+    question = consultation.get_next_question()
+    samples["start"].append(time.perf_counter() - started)
+    version = consultation.get_visualization_data(limit=0)["version"]
+
+    for _ in range(MAX_QUESTIONS):
+        if question is None:
+            break
+        started = time.perf_counter()
+        consultation.answer_question(question, rnd.random() < 0.6)
+        finished = consultation.is_finished()
+        question = None if finished else consultation.get_next_question()
+        samples["answer"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        version = consultation.get_visualization_data(since=version)["version"]
+        samples["visualization_diff"].append(time.perf_counter() - started)
+
+    if len(consultation.question_history) > 2:
+        started = time.perf_counter()
+        consultation.go_back()
+        consultation.get_next_question()
+        samples["back"].append(time.perf_counter() - started)
+
+    answered = list(consultation.answer_history)
+    if answered:
+        engine = consultation.engine.copy()
+        started = time.perf_counter()
+        engine.reset_from_fact(rnd.choice(answered))
+        samples["reset_from_fact"].append(time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=DEFAULT_RULES)
+    parser.add_argument("--kind", choices=["scaled", "random"], default="random")
+    parser.add_argument("--walkthroughs", type=int, default=20)
+    parser.add_argument("--check", action="store_true", help="目標値を超えた場合は終了コード 1")
+    args = parser.parse_args(argv)
+
+    content = to_content(make_rules(args.rules, args.kind))
+    started = time.perf_counter()
+    rules = parse_rules(content)
+    print(f"{len(rules)} rules ({args.kind}), {len(content) / 1e6:.1f} MB")
+    print(f"  parse_rules: {time.perf_counter() - started:.2f} s")
+
+    rule_set = RuleSet(rules, f"bench-{args.kind}-{args.rules}")
+    started = time.perf_counter()
+    kb = rule_set.get(None)
+    print(f"  knowledge base (all rules): {time.perf_counter() - started:.2f} s, {len(kb.fact_names)} facts")
+    for visa_type in rule_set.visa_types():
+        started = time.perf_counter()
+        rule_count = len(rule_set.get(visa_type).rules)
+        print(f"  knowledge base ({visa_type}, {rule_count} rules): {time.perf_counter() - started:.2f} s")
+
+    tracemalloc.start()
+    measured = build_knowledge_base(rules, None, "memory")
+    print(f"  knowledge base memory (all rules): {tracemalloc.get_traced_memory()[0] / 1e6:.1f} MB")
+    tracemalloc.stop()
+    del measured
+
+    samples: Dict[str, List[float]] = {name: [] for name in TARGETS_MS}
+    for seed in range(args.walkthroughs):
+        walkthrough(kb, random.Random(seed), samples)
+
+    print(f"\n{'operation':<20}{'count':>7}{'p50 (ms)':>10}{'p95 (ms)':>10}{'max (ms)':>10}{'target':>9}")
+    failed = []
+    for name, target in TARGETS_MS.items():
+        values = samples[name]
+        if not values:
+            continue
+        p95 = percentile(values, 0.95)
+        mark = "" if p95 <= target else "  NG"
+        if mark:
+            failed.append(name)
+        print(
+            f"{name:<20}{len(values):>7}{statistics.median(values) * 1000:>10.2f}{p95:>10.2f}"
+            f"{max(values) * 1000:>10.2f}{target:>9.0f}{mark}"
+        )
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
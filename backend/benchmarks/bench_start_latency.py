@@ -0,0 +1,56 @@
+"""診断開始（/consultation/start 相当）のレイテンシ計測
+
+rules.json を毎回読み込む従来の方式と、RuleRepository で
+コンパイル済み知識ベースを共有する方式を比較する。
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.bench_start_latency
+"""
+import statistics
+import time
+
+from app.services.consultation import Consultation
+from app.services.rule_repository import RuleRepository, build_knowledge_base, read_rules
+
+VISA_TYPES = ["E", "L", "B", "H-1B", "J-1"]
+ITERATIONS = 200
+
+
+def start_uncached(visa_type: str):
+    """従来の方式: リクエストごとに rules.json を読み込んで知識ベースを構築"""
+    kb = build_knowledge_base(read_rules(), visa_type)
+    consultation = Consultation(kb)
+    consultation.start()
+    return consultation.get_next_question()
+
+
+def start_cached(repository: RuleRepository, visa_type: str):
+    """新しい方式: コンパイル済み知識ベースを共有し、事実の状態のみ新規作成"""
+    consultation = Consultation(repository.get(visa_type))
+    consultation.start()
+    return consultation.get_next_question()
+
+
+def measure(func, *args) -> list:
+    """1回あたりの所要時間（マイクロ秒）を計測"""
+    samples = []
+    for _ in range(ITERATIONS):
+        started = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return samples
+
+
+def main():
+    repository = RuleRepository()
+    repository.preload()
+
+    print(f"{'visa':<6}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for visa_type in VISA_TYPES:
+        before = statistics.median(measure(start_uncached, visa_type))
+        after = statistics.median(measure(start_cached, repository, visa_type))
+        print(f"{visa_type:<6}{before:>14.1f}{after:>14.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
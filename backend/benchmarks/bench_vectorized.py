@@ -0,0 +1,62 @@
+"""NumPy による一括評価（VectorizedEvaluator）のスループット計測
+
+全ルールの知識ベースに対して、ランダムな回答（一部は未回答）を持つ
+1千 / 10万 / 100万行を評価し、1秒あたりの処理行数を計測する。
+InferenceEngine で1行ずつ前向き推論する場合と比較し、結果が一致することも確認する。
+
+実行方法（backend ディレクトリで実行、numpy が必要）:
+    python -m benchmarks.bench_vectorized
+"""
+import time
+
+import numpy as np
+
+from app.services.inference_engine import InferenceEngine
+from app.services.rule_repository import RuleRepository
+from app.services.vectorized_evaluator import VectorizedEvaluator
+
+ROW_COUNTS = [1_000, 100_000, 1_000_000]
+ENGINE_ROWS = 20_000  # InferenceEngine で計測する最大行数（それ以上は時間がかかりすぎる）
+
+
+def evaluate_with_engine(kb, evaluator: VectorizedEvaluator, values, known) -> list:
+    """1行ずつ InferenceEngine で前向き推論し、診断結果を返す"""
+    results = []
+    for row in range(values.shape[0]):
+        engine = InferenceEngine(kb)
+        for column in np.flatnonzero(known[row]):
+            engine.assert_fact(evaluator.basic_fact_names[column], bool(values[row, column]))
+        engine.forward_chain()
+        results.append(engine.get_conclusions())
+    return results
+
+
+def main():
+    kb = RuleRepository().get(None)
+    evaluator = VectorizedEvaluator(kb)
+    rng = np.random.default_rng(0)
+    columns = len(evaluator.basic_fact_names)
+    print(f"{len(kb.rules)} rules, {len(kb.fact_names)} facts, {len(evaluator.groups)} layers")
+    print(f"{'rows':>10}{'vectorized rows/s':>20}{'engine rows/s':>16}")
+
+    for rows in ROW_COUNTS:
+        values = rng.random((rows, columns)) < 0.5
+        known = rng.random((rows, columns)) < 0.8
+
+        started = time.perf_counter()
+        _, true = evaluator.evaluate(values, known)
+        vectorized = rows / (time.perf_counter() - started)
+
+        sample = min(rows, ENGINE_ROWS)
+        started = time.perf_counter()
+        expected = evaluate_with_engine(kb, evaluator, values[:sample], known[:sample])
+        engine = sample / (time.perf_counter() - started)
+
+        conclusions = evaluator.get_conclusions(true[:sample])
+        actual = [[kb.conclusion_facts[index] for index in np.flatnonzero(row)] for row in conclusions]
+        assert actual == expected, "VectorizedEvaluator の結果が InferenceEngine と一致しません"
+        print(f"{rows:>10}{vectorized:>20.0f}{engine:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
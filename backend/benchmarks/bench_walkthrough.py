@@ -0,0 +1,92 @@
+"""ビザタイプごとの診断の通し実行（開始から完了まで）の計測
+
+rules.json（または --scale で合成ルール）のすべてのビザタイプについて、
+固定の乱数で回答する診断を開始から完了まで繰り返し、1回あたりの時間と質問数を計測する。
+診断結果の求め方ごとに比較する。
+
+- engine: 推論エンジンのみ
+- decision_tree: コンパイル済みの決定木を使う（rules.json のみ。ない場合は省略）
+- outcome_cache: 推論結果キャッシュを使う（同じ回答の組み合わせを2周目から再利用）
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.bench_walkthrough [--scale 倍率] [--kind scaled|random] [--runs 回数]
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Optional
+
+from app.services.consultation import Consultation
+from app.services.decision_tree import DecisionTree
+from app.services.outcome_cache import OutcomeCache
+from app.services.rule_repository import RuleRepository, RuleSet, parse_rules
+from benchmarks.synthetic_rules import generate, to_content
+
+MAX_QUESTIONS = 200  # 1回の診断で回答する質問数の上限
+
+
+def walkthrough(consultation: Consultation, rnd: random.Random) -> int:
+    """API と同じ順序で診断を完了まで進め、回答した質問数を返す"""
+    consultation.start()
+    question = consultation.get_next_question()
+    answered = 0
+    while question and answered < MAX_QUESTIONS:
+        consultation.answer_question(question, rnd.random() < 0.6)
+        answered += 1
+        if consultation.is_finished():
+            break
+        question = consultation.get_next_question()
+    consultation.get_conclusions()
+    return answered
+
+
+def measure(rule_set: RuleSet, visa_type: str, runs: int, mode: str) -> Optional[tuple]:
+    """(1回あたりの時間の中央値 ms, 質問数の平均)。使えない方式の場合は None"""
+    kb = rule_set.get(visa_type)
+    tree: Optional[DecisionTree] = None
+    cache: Optional[OutcomeCache] = None
+    if mode == "decision_tree":
+        tree = rule_set.get_decision_tree(visa_type)
+        if tree is None:
+            return None
+    elif mode == "outcome_cache":
+        cache = OutcomeCache()
+
+    samples, questions = [], []
+    for run in range(runs):
+        # 2周目以降は1周目と同じ回答を繰り返す（キャッシュの効果を見る）
+        rnd = random.Random(run % max(1, runs // 2))
+        started = time.perf_counter()
+        questions.append(walkthrough(Consultation(kb, outcome_cache=cache, decision_tree=tree), rnd))
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000, statistics.mean(questions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=0, help="0 の場合は rules.json をそのまま使う")
+    parser.add_argument("--kind", choices=["scaled", "random"], default="scaled")
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.scale:
+        rules = parse_rules(to_content(generate(args.scale, args.kind)))
+        rule_set = RuleSet(rules, f"bench-{args.kind}-{args.scale}")
+    else:
+        rule_set = RuleRepository().current
+    modes = ["engine", "decision_tree", "outcome_cache"]
+
+    print(f"{len(rule_set.rules)} rules, {args.runs} runs per visa type (median ms per walkthrough)")
+    print(f"{'visa':<6}{'rules':>7}{'questions':>11}" + "".join(f"{mode:>16}" for mode in modes))
+    for visa_type in rule_set.visa_types():
+        results = [measure(rule_set, visa_type, args.runs, mode) for mode in modes]
+        questions = next(result[1] for result in results if result is not None)
+        print(
+            f"{visa_type:<6}{len(rule_set.get(visa_type).rules):>7}{questions:>11.1f}"
+            + "".join(f"{result[0]:>16.3f}" if result else f"{'-':>16}" for result in results)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""性能計測スイートの一括実行
+
+ネットワークを使わず、すべてプロセス内で次の計測を順に実行する。
+
+1. bench_engine: InferenceEngine のマイクロベンチマーク（rules.json の 1 / 10 / 100 / 1000 倍）
+2. bench_walkthrough: ビザタイプごとの診断の通し実行（rules.json と 10 倍の合成ルール）
+3. bench_asgi_load: FastAPI アプリへの同時リクエストのスループットとレイテンシ
+4. bench_scale: 50,000 ルールの知識ベースでの読み込みと1回答あたりのレイテンシ
+
+乱数はすべて固定のシードを使うため、同じマシンでは同じ負荷で比較できる。
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.run_all [--quick]
+
+--quick では 1000 倍の合成ルールを省略し、負荷試験の時間と大規模な知識ベースのルール数を小さくする。
+"""
+import argparse
+import platform
+import sys
+import time
+
+from benchmarks import bench_asgi_load, bench_engine, bench_scale, bench_walkthrough
+
+
+def section(title: str):
+    print(f"\n== {title} ==", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quick", action="store_true")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    print(f"Python {platform.python_version()} ({sys.implementation.name}) on {platform.platform()}")
+
+    section("InferenceEngine マイクロベンチマーク")
+    bench_engine.main(["--scales", "1,10,100" if args.quick else bench_engine.DEFAULT_SCALES])
+
+    section("診断の通し実行 (rules.json)")
+    bench_walkthrough.main([])
+    section("診断の通し実行 (10 倍の合成ルール)")
+    bench_walkthrough.main(["--scale", "10", "--runs", "50"])
+
+    section("API の同時利用 (ASGI プロセス内)")
+    bench_asgi_load.main(["--duration", "1" if args.quick else "3"])
+
+    section("大規模な知識ベース")
+    bench_scale.main(["--rules", "5000", "--walkthroughs", "5"] if args.quick else [])
+
+    print(f"\n合計 {time.perf_counter() - started:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
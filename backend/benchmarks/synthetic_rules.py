@@ -0,0 +1,118 @@
+"""性能計測用の合成ルールの生成
+
+rules.json の規模（ルール数）の倍率を指定して、次の2種類のルールを生成する。
+
+- scaled: 事実名とルールIDを変えて rules.json を複製したルール（構造は同じ）
+- random: ビザタイプごとに層状の依存関係を持つランダムなルール。下の層の事実を
+  1〜3個の条件（AND / OR、一部は False を要求）に持ち、最上位の層の結論が
+  「〜の申請ができます」になる。ビザタイプは申請の結論のキーワードから判定され、
+  その結論に至らないルールはどのビザタイプにも含まれない。
+
+実行方法（backend ディレクトリで実行）:
+    python -m benchmarks.synthetic_rules 倍率 出力先.json [--random] [--seed N]
+"""
+import argparse
+import json
+import random
+from typing import Dict, List
+
+from app.services.rule_repository import DEFAULT_RULES_FILE, parse_rules
+
+# 申請の結論からビザタイプが判定される（app.models.visa_index.VISA_TYPE_KEYWORDS）キーワード
+VISA_KEYWORDS = ["Eビザ", "Lビザ", "H-1Bビザ", "Bビザ", "J-1ビザ"]
+
+PRIORITIES = [40, 50, 60, 70, 80, 90, 100]
+LAYERS = 3  # 導出される事実の層の数（最上位が申請の可否）
+
+
+def load_base_rules() -> List[Dict]:
+    """rules.json のルール定義（JSON のまま）"""
+    with open(DEFAULT_RULES_FILE, encoding="utf-8") as f:
+        return json.load(f)["rules"]
+
+
+def scaled_rules(copies: int) -> List[Dict]:
+    """事実名とルールIDを変えて rules.json を copies 個複製したルール"""
+    rules = load_base_rules()
+    scaled = []
+    for copy in range(copies):
+        for rule in rules:
+            scaled.append({
+                **rule,
+                "id": f"{rule['id']}_{copy}",
+                "conditions": [
+                    {**cond, "fact_name": f"{cond['fact_name']} #{copy}"} for cond in rule["conditions"]
+                ],
+                "conclusion": f"{rule['conclusion']} #{copy}",
+            })
+    return scaled
+
+
+def random_rules(count: int, seed: int = 0) -> List[Dict]:
+    """ビザタイプごとに層状の依存関係を持つ count 件のランダムなルール"""
+    rnd = random.Random(seed)
+    rules = []
+    per_visa = max(LAYERS, count // len(VISA_KEYWORDS))
+    for keyword in VISA_KEYWORDS:
+        # 基本事実の数は rules.json と同程度の比率（ルール数の約 2/3）
+        basic = [f"{keyword}の質問 {n}" for n in range(max(2, per_visa * 2 // 3))]
+        lower = list(basic)  # 条件に使える事実（下の層）
+        layer_sizes = [per_visa // 2, per_visa // 3, per_visa - per_visa // 2 - per_visa // 3]
+        for layer, size in enumerate(layer_sizes):
+            final = layer == LAYERS - 1
+            # 同じ事実を複数のルールで導出する（OR の代替ルール）ため、事実の数はルール数より少なくする
+            facts = [
+                f"{keyword}での申請ができます {n}" if final else f"{keyword}の条件 {layer}-{n}"
+                for n in range(max(1, size * 2 // 3))
+            ]
+            for n in range(size):
+                conditions = [
+                    {"fact_name": fact_name, "required_value": rnd.random() < 0.9}
+                    for fact_name in rnd.sample(lower, min(len(lower), rnd.choice([1, 1, 2, 3])))
+                ]
+                rules.append({
+                    "id": f"{keyword}_{layer}_{n}",
+                    "conditions": conditions,
+                    "operator": "AND" if len(conditions) > 1 and rnd.random() < 0.6 else "OR",
+                    "conclusion": facts[n % len(facts)],
+                    "conclusion_value": True,
+                    "priority": rnd.choice(PRIORITIES),
+                })
+            lower = lower + facts
+    return rules[:count] if len(rules) > count else rules
+
+
+def generate(scale: int, kind: str = "scaled", seed: int = 0) -> List[Dict]:
+    """rules.json の scale 倍の規模のルール（kind は scaled / random）"""
+    if kind == "scaled":
+        return scaled_rules(scale)
+    return random_rules(len(load_base_rules()) * scale, seed)
+
+
+def to_content(rules: List[Dict]) -> bytes:
+    """rules.json と同じ形式の内容"""
+    return json.dumps({"rules": rules}, ensure_ascii=False).encode("utf-8")
+
+
+def write_rules(path: str, rules: List[Dict]):
+    """rules.json と同じ形式で保存"""
+    with open(path, "wb") as f:
+        f.write(to_content(rules))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scale", type=int)
+    parser.add_argument("output")
+    parser.add_argument("--random", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rules = generate(args.scale, "random" if args.random else "scaled", args.seed)
+    write_rules(args.output, rules)
+    parsed = parse_rules(to_content(rules))  # 読み込めることを確認
+    print(f"{len(parsed)} rules -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
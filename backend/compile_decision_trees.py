@@ -0,0 +1,23 @@
+"""ビザタイプごとの決定木をコンパイルして app/data/decision_trees.json に保存
+
+rules.json を変更したら再実行する。ルールのバージョンが一致しない決定木は
+サーバーで使われず、推論エンジンで診断が行われる。
+"""
+import time
+
+from app.services.decision_tree import compile_decision_tree, save_decision_trees
+from app.services.rule_repository import DEFAULT_DECISION_TREES_FILE, RuleRepository
+
+repository = RuleRepository(decision_trees_file=None)
+
+trees = []
+for visa_type in repository.visa_types():
+    started = time.perf_counter()
+    tree = compile_decision_tree(repository.get(visa_type))
+    trees.append(tree)
+    print(f'{visa_type}: {len(tree.nodes)} nodes ({time.perf_counter() - started:.2f}s)')
+
+save_decision_trees(trees, DEFAULT_DECISION_TREES_FILE)
+
+print(f'Saved decision trees to {DEFAULT_DECISION_TREES_FILE}')
+print(f'Rules version: {repository.rules_version}')
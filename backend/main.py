@@ -1,7 +1,11 @@
 """Main FastAPI application"""
-from fastapi import FastAPI
+import time
+import anyio
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.routes import router, load_knowledge_base
+from fastapi.responses import PlainTextResponse
+from app.api.routes import outcome_cache, router, rule_repository, rules_watcher, session_store
+from app.services import batch, metrics
 
 app = FastAPI(
     title="Visa Expert System API",
@@ -22,10 +26,46 @@ app.add_middleware(
 app.include_router(router, prefix="/api")
 
 
+if metrics.enabled:
+    @app.middleware("http")
+    async def instrument_request(request: Request, call_next):
+        """リクエストごとの推論の計測値を集計し、タイミングのヘッダーを付ける"""
+        stats, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            metrics.end_request(token)
+        duration = time.perf_counter() - started
+
+        handler = getattr(request.scope.get("route"), "name", "unmatched")  # エンドポイントの関数名
+        metrics.request_seconds.observe(duration, labels=(request.method, handler, str(response.status_code)))
+        metrics.request_rule_evaluations.observe(stats.rule_evaluations, labels=(handler,))
+        response.headers["Server-Timing"] = (
+            f"app;dur={duration * 1000:.3f}, select;dur={stats.select_seconds * 1000:.3f}"
+        )
+        response.headers["X-Inference-Stats"] = (
+            f"forward_chain={stats.forward_chain_calls}; rule_evaluations={stats.rule_evaluations}; "
+            f"rules_fired={stats.rules_fired}"
+        )
+        if stats.profiler is not None:
+            await anyio.to_thread.run_sync(metrics.save_profile, stats, duration, f"{request.method} {handler}")
+        return response
+
+
 @app.on_event("startup")
 async def startup_event():
-    """アプリケーション起動時に知識ベースを読み込み"""
-    load_knowledge_base()
+    """アプリケーション起動時にすべてのビザタイプの知識ベースを構築し、rules.json の監視を開始"""
+    await anyio.to_thread.run_sync(rule_repository.preload)
+    if rules_watcher.interval > 0:
+        rules_watcher.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """rules.json の監視と、一括診断のワーカープロセスを停止"""
+    rules_watcher.stop()
+    await anyio.to_thread.run_sync(batch.shutdown_pools)
 
 
 @app.get("/")
@@ -38,6 +78,23 @@ async def root():
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """推論の計測値を Prometheus のテキスト形式で取得（METRICS_ENABLED=1 で推論の計測を有効化）"""
+    sessions = await anyio.to_thread.run_sync(len, session_store)
+    cache_stats = outcome_cache.get_stats()
+    body = metrics.render({
+        "visa_sessions": ("gauge", "保持している診断セッション数", sessions),
+        "visa_outcome_cache_entries": ("gauge", "推論結果キャッシュの件数", cache_stats["size"]),
+        "visa_outcome_cache_hits_total": ("counter", "推論結果キャッシュのヒット数", cache_stats["hits"]),
+        "visa_outcome_cache_misses_total": ("counter", "推論結果キャッシュのミス数", cache_stats["misses"]),
+        "visa_outcome_cache_evictions_total": (
+            "counter", "推論結果キャッシュから追い出した件数", cache_stats["evictions"]
+        ),
+    })
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 async def health():
     """ヘルスチェック"""
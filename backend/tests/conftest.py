@@ -0,0 +1,5 @@
+"""テストの共通設定（backend ディレクトリから app をインポートできるようにする）"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,174 @@
+"""API の応答（ETag と条件付きリクエスト・圧縮・事実の ID・可視化の差分と分割）"""
+import asyncio
+import gzip
+import json
+from typing import Dict, Iterable, Optional, Tuple
+
+import pytest
+
+from main import app
+
+
+def call(
+    method: str, path: str, body=None, headers: Iterable[Tuple[str, str]] = ()
+) -> Tuple[int, Dict[str, str], bytes]:
+    """ASGI アプリを直接呼び出し、(ステータス, ヘッダー, 本文) を返す"""
+    path, _, query = path.partition("?")
+    payload = json.dumps(body, ensure_ascii=False).encode() if body is not None else b""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "",
+        "headers": [(b"content-type", b"application/json")]
+        + [(name.lower().encode(), value.encode()) for name, value in headers],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 80),
+    }
+    response = {"status": 0, "headers": {}, "body": b""}
+
+    async def receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {name.decode(): value.decode() for name, value in message["headers"]}
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    asyncio.run(app(scope, receive, send))
+    return response["status"], response["headers"], response["body"]
+
+
+class Client:
+    """セッションID をヘッダーで送るクライアント"""
+
+    def __init__(self):
+        self.session_id: Optional[str] = None
+
+    def request(self, method: str, path: str, body=None) -> Tuple[int, object]:
+        headers = [("X-Session-ID", self.session_id)] if self.session_id else []
+        status, _, data = call(method, path, body, headers)
+        return status, json.loads(data or b"null")
+
+    def start(self, visa_type: str, query: str = "") -> Dict:
+        status, data = self.request("POST", f"/api/consultation/start{query}", {"visa_type": visa_type})
+        assert status == 200, data
+        self.session_id = data["session_id"]
+        return data
+
+
+def test_rules_etag_and_not_modified():
+    status, headers, body = call("GET", "/api/rules")
+    assert status == 200
+    assert json.loads(body)["rules"]
+    assert headers["cache-control"] == "no-cache"
+    assert "Accept-Encoding" in headers["vary"]
+    etag = headers["etag"]
+
+    for condition in [("If-None-Match", etag), ("If-None-Match", f'"other", W/{etag}'),
+                      ("If-Modified-Since", headers["last-modified"])]:
+        status, not_modified, body = call("GET", "/api/rules", headers=[condition])
+        assert status == 304 and body == b""
+        assert not_modified["etag"] == etag
+
+    status, _, _ = call("GET", "/api/rules", headers=[("If-None-Match", '"other"')])
+    assert status == 200
+    # ビザタイプごとの応答は別の ETag
+    _, headers_e, _ = call("GET", "/api/rules?visa_type=E")
+    assert headers_e["etag"] != etag
+
+
+def test_rules_compressed():
+    _, headers, body = call("GET", "/api/rules")
+    status, gzip_headers, compressed = call("GET", "/api/rules", headers=[("Accept-Encoding", "gzip, deflate")])
+    assert status == 200
+    assert gzip_headers["content-encoding"] == "gzip"
+    assert gzip.decompress(compressed) == body
+    assert len(compressed) < len(body)
+    # 圧縮した本文は別の表現として別の ETag を持ち、どちらの ETag でも 304 になる
+    assert gzip_headers["etag"] != headers["etag"]
+    status, _, _ = call(
+        "GET", "/api/rules", headers=[("Accept-Encoding", "gzip"), ("If-None-Match", headers["etag"])]
+    )
+    assert status == 304
+
+    _, identity_headers, identity = call("GET", "/api/rules", headers=[("Accept-Encoding", "gzip;q=0")])
+    assert "content-encoding" not in identity_headers
+    assert identity == body
+
+
+def test_unknown_visa_type():
+    for path in ["/api/rules?visa_type=X", "/api/facts?visa_type=X"]:
+        status, _, _ = call("GET", path)
+        assert status == 400
+
+
+def test_fact_ids():
+    status, _, body = call("GET", "/api/facts?visa_type=E&fact_ids=true")
+    assert status == 200
+    facts = json.loads(body)
+    fact_ids = facts["fact_ids"]
+    names = {fact_id: fact_name for fact_name, fact_id in fact_ids.items()}
+    assert set(facts["basic_facts"]) <= set(fact_ids.values())
+
+    client = Client()
+    started = client.start("E", "?fact_ids=true")
+    assert started["rules_version"] == facts["rules_version"]
+    question = started["next_question"]
+    assert isinstance(question, int) and question in facts["basic_facts"]
+
+    # ID と事実名のどちらでも回答でき、応答は指定した形式で返る
+    status, answered = client.request(
+        "POST", "/api/consultation/answer?fact_ids=true", {"question": question, "answer": True}
+    )
+    assert status == 200 and isinstance(answered["next_question"], int)
+    status, answered = client.request(
+        "POST", "/api/consultation/answer", {"question": names[answered["next_question"]], "answer": True}
+    )
+    assert status == 200 and isinstance(answered["next_question"], str)
+
+    status, _ = client.request("POST", "/api/consultation/answer", {"question": 10 ** 9, "answer": True})
+    assert status == 400
+    status, _ = client.request("POST", "/api/consultation/answer", {"question": True, "answer": True})
+    assert status == 422
+
+    status, visualization = client.request("GET", "/api/consultation/visualization?fact_ids=true")
+    assert status == 200
+    assert len(visualization["answer_history"]) == 2
+    assert all(int(key) in names for key in visualization["answer_history"])
+    assert all(int(key) in names for key in visualization["facts"])
+
+
+def test_visualization_diff_and_pagination():
+    client = Client()
+    started = client.start("E")
+    status, full = client.request("GET", "/api/consultation/visualization")
+    assert status == 200 and full["full"]
+    assert full["total_rules"] == len(full["rules"])
+
+    status, page = client.request("GET", "/api/consultation/visualization?offset=2&limit=3")
+    assert page["total_rules"] == full["total_rules"]
+    assert [rule["rule_id"] for rule in page["rules"]] == [rule["rule_id"] for rule in full["rules"][2:5]]
+
+    client.request("POST", "/api/consultation/answer", {"question": started["next_question"], "answer": True})
+    status, diff = client.request("GET", f"/api/consultation/visualization?since={full['version']}")
+    assert status == 200 and not diff["full"]
+    assert diff["version"] != full["version"]
+    assert started["next_question"] in diff["facts"]
+    assert len(diff["rules"]) < len(full["rules"])
+
+    # 変化がなければ差分は空
+    status, unchanged = client.request("GET", f"/api/consultation/visualization?since={diff['version']}")
+    assert unchanged["rules"] == [] and unchanged["facts"] == {}
+
+
+@pytest.mark.parametrize("visa_type", ["E", "B"])
+def test_back_over_api(visa_type):
+    client = Client()
+    started = client.start(visa_type)
+    first = started["next_question"]
+    client.request("POST", "/api/consultation/answer", {"question": first, "answer": True})
+    status, back = client.request("POST", "/api/consultation/back")
+    assert status == 200 and back["current_question"] == first
+    status, visualization = client.request("GET", "/api/consultation/visualization")
+    assert first not in visualization["answer_history"]
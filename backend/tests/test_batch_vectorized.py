@@ -0,0 +1,57 @@
+"""一括診断で VectorizedEvaluator を使った結果と、InferenceEngine で1件ずつ推論した結果の比較"""
+import json
+import random
+
+import pytest
+
+from app.services import batch
+from app.services.rule_repository import RuleSet, read_rules
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture(scope="module")
+def rule_set() -> RuleSet:
+    return RuleSet(read_rules(), None)
+
+
+def random_records(rule_set: RuleSet, rnd: random.Random, count: int):
+    """基本事実のみの回答を中心に、導出可能な事実・ルールにない事実への回答や不正なレコードも含める"""
+    records = []
+    for i in range(count):
+        visa_type = rnd.choice(rule_set.visa_types())
+        kb = rule_set.get(visa_type)
+        basic_facts = sorted(kb.basic_facts)
+        answers = {
+            fact_name: rnd.random() < 0.6
+            for fact_name in rnd.sample(basic_facts, rnd.randint(0, len(basic_facts)))
+        }
+        choice = rnd.random()
+        if choice < 0.05:
+            answers[rnd.choice(sorted(kb.derivable_facts))] = rnd.random() < 0.5
+        elif choice < 0.1:
+            answers["ルールにない事実"] = True
+        elif choice < 0.12:
+            visa_type = "X"
+        records.append(json.dumps({"id": i, "visa_type": visa_type, "answers": answers}, ensure_ascii=False))
+    return records
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_vectorized_matches_engine(rule_set, seed, monkeypatch):
+    records = random_records(rule_set, random.Random(seed), 600)
+    vectorized = batch._evaluate_chunk(rule_set, records)
+
+    monkeypatch.setattr(batch, "VECTORIZE_MIN_RECORDS", len(records) + 1)
+    batch._evaluators.clear()
+    assert batch._evaluate_chunk(rule_set, records) == vectorized
+
+
+def test_vectorized_path_is_used(rule_set, monkeypatch):
+    calls = []
+    evaluate = batch._evaluate_vectorized
+    monkeypatch.setattr(
+        batch, "_evaluate_vectorized", lambda *args: calls.append(args[1]) or evaluate(*args)
+    )
+    batch._evaluate_chunk(rule_set, random_records(rule_set, random.Random(0), 600))
+    assert calls
@@ -0,0 +1,88 @@
+"""前の質問に戻る（go_back / jump_to_question）で、戻った質問とそれ以降の回答が取り消されることの確認"""
+import pytest
+
+from app.services.consultation import Consultation
+from app.services.rule_repository import RuleSet, read_rules
+
+
+@pytest.fixture(scope="module")
+def rule_set() -> RuleSet:
+    return RuleSet(read_rules(), None)
+
+
+def answer_all(consultation: Consultation, answer: bool):
+    """診断が完了するまで、すべての質問に同じ値で回答（回答した質問の一覧を返す）"""
+    consultation.start()
+    questions = []
+    question = consultation.get_next_question()
+    while question is not None:
+        questions.append(question)
+        consultation.answer_question(question, answer)
+        question = consultation.get_next_question()
+    return questions
+
+
+@pytest.mark.parametrize("visa_type", ["E", "L", "B"])
+@pytest.mark.parametrize("answer", [True, False])
+def test_go_back_withdraws_target_answer(rule_set, visa_type, answer):
+    consultation = Consultation(rule_set.get(visa_type))
+    questions = answer_all(consultation, answer)
+    assert len(questions) >= 3
+
+    # 3問に回答して4問目を表示している状態から1つ戻ると、3問目の回答が取り消され、3問目が再び次の質問になる
+    consultation.replay([(question, answer) for question in questions[:3]])
+    current = consultation.question_history[-1]
+    assert current not in consultation.answer_history
+    assert consultation.go_back() == questions[2]
+    assert questions[2] not in consultation.answer_history
+    assert consultation.engine.get_fact(questions[2]) is None
+    assert consultation.question_history == questions[:3]
+    assert consultation.get_next_question() == questions[2]
+
+    # さらに1つ戻ると、2問目の回答も取り消される
+    assert consultation.go_back() == questions[1]
+    assert consultation.get_answer_steps() == [(questions[0], answer)]
+    assert consultation.question_history == questions[:2]
+    assert consultation.get_next_question() == questions[1]
+
+
+def test_go_back_after_finished(rule_set):
+    """診断の完了後に戻ると、最後の質問の1つ前の質問に戻る（最後の質問が表示されている状態から戻る）"""
+    consultation = Consultation(rule_set.get("E"))
+    questions = answer_all(consultation, True)
+    assert consultation.question_history == questions
+    assert consultation.go_back() == questions[-2]
+    assert consultation.get_answer_steps() == [(question, True) for question in questions[:-2]]
+    assert consultation.get_next_question() == questions[-2]
+
+
+def test_go_back_several_steps(rule_set):
+    consultation = Consultation(rule_set.get("E"))
+    questions = answer_all(consultation, True)
+    conclusions = consultation.get_conclusions()
+    assert conclusions
+
+    steps = len(questions) - 1
+    assert consultation.go_back(steps) == questions[0]
+    assert consultation.answer_history == {}
+    assert consultation.engine.facts == {}
+    assert consultation.get_conclusions() == []
+    assert consultation.go_back() is None  # 最初の質問より前には戻れない
+
+    # 同じ回答をし直すと、同じ結論になる
+    for question in questions:
+        assert consultation.get_next_question() == question
+        consultation.answer_question(question, True)
+    assert consultation.get_conclusions() == conclusions
+
+
+def test_jump_to_question_withdraws_later_answers(rule_set):
+    consultation = Consultation(rule_set.get("L"))
+    questions = answer_all(consultation, True)
+    target = questions[len(questions) // 2]
+
+    assert consultation.jump_to_question(target) == target
+    assert consultation.get_answer_steps() == [(question, True) for question in questions[:questions.index(target)]]
+    assert all(consultation.engine.get_fact(question) is None for question in questions[questions.index(target):])
+    assert consultation.get_next_question() == target
+    assert consultation.jump_to_question("質問履歴にない質問") is None
@@ -0,0 +1,112 @@
+"""InferenceEngine の差分推論と、ルールを毎回走査する素朴な前向き推論の結果の比較"""
+import random
+from typing import Dict, List
+
+import pytest
+
+from app.models.rule import Condition, Rule
+from app.services.inference_engine import InferenceEngine
+from app.services.rule_repository import build_knowledge_base, read_rules
+
+VISA_TYPES = [None, "E", "L", "B", "H-1B", "J-1"]
+
+
+def naive_forward_chain(rules: List[Rule], facts: Dict[str, bool], fired_rules: List[str]):
+    """変更がなくなるまですべてのルールを走査する前向き推論（差分推論を導入する前の実装）"""
+    changed = True
+    iteration = 0
+    while changed and iteration < 100:
+        changed = False
+        iteration += 1
+        for rule in rules:
+            if facts.get(rule.conclusion) is not None:
+                continue
+            if rule.can_fire(facts):
+                facts[rule.conclusion] = rule.conclusion_value
+                fired_rules.append(rule.id)
+                changed = True
+
+
+def random_rules(rnd: random.Random, rule_count: int, fact_count: int) -> List[Rule]:
+    """AND / OR と否定の条件を含み、同じ事実を異なる値で結論とするルールもある合成ルール"""
+    rules = []
+    for i in range(rule_count):
+        conclusion = rnd.randrange(1, fact_count)
+        conditions = [
+            Condition(f"f{rnd.randrange(conclusion)}", rnd.random() < 0.7)
+            for _ in range(rnd.randint(0, 4))
+        ]
+        rules.append(Rule(
+            id=f"r{i}",
+            conditions=conditions,
+            operator=rnd.choice(["AND", "OR"]),
+            conclusion=f"f{conclusion}",
+            conclusion_value=rnd.random() < 0.8,
+            priority=rnd.randint(0, 100),
+        ))
+    return rules
+
+
+def check_random_answers(kb, rnd: random.Random, steps: int):
+    """ランダムな事実を順に確定させ、毎回素朴な推論と事実・発火したルールを比べる"""
+    engine = InferenceEngine(kb)
+    facts: Dict[str, bool] = {}
+    fired_rules: List[str] = []
+    engine.forward_chain()
+    naive_forward_chain(kb.rules, facts, fired_rules)
+    assert engine.facts == facts
+    assert engine.fired_rules == fired_rules
+
+    fact_names = sorted(kb.all_fact_names)
+    for _ in range(steps):
+        if not fact_names:
+            break
+        fact_name = rnd.choice(fact_names)
+        value = rnd.random() < 0.5
+        engine.assert_fact(fact_name, value)
+        engine.forward_chain()
+        facts[fact_name] = value
+        naive_forward_chain(kb.rules, facts, fired_rules)
+        assert engine.facts == facts
+        assert engine.fired_rules == fired_rules
+
+
+@pytest.mark.parametrize("visa_type", VISA_TYPES)
+def test_shipped_rules(visa_type):
+    kb = build_knowledge_base(read_rules(), visa_type)
+    rnd = random.Random(visa_type or "all")
+    for _ in range(50):
+        check_random_answers(kb, rnd, steps=20)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_rules(seed):
+    rnd = random.Random(seed)
+    for _ in range(10):
+        kb = build_knowledge_base(random_rules(rnd, rnd.randint(1, 40), rnd.randint(2, 30)))
+        assert kb.rules
+        for _ in range(5):
+            check_random_answers(kb, rnd, steps=15)
+
+
+def test_random_rules_have_conflicting_conclusions():
+    """合成ルールに、同じ事実を異なる値で結論とするルールが含まれることの確認"""
+    rnd = random.Random(0)
+    kbs = [build_knowledge_base(random_rules(rnd, 40, 10)) for _ in range(5)]
+    assert any(kb.has_conflicting_conclusions for kb in kbs)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_dependent_facts(seed):
+    """事前に求めた推移的に依存する導出事実と、条件 → 結論をたどって求めた事実の比較"""
+    rnd = random.Random(seed)
+    kb = build_knowledge_base(random_rules(rnd, 40, 20))
+    for fact_name in kb.fact_names:
+        found, stack = set(), [fact_name]
+        while stack:
+            for rule in kb.get_rules_with_condition(stack.pop()):
+                if rule.conclusion not in found:
+                    found.add(rule.conclusion)
+                    stack.append(rule.conclusion)
+        assert kb.get_dependent_facts(fact_name) == found
+    assert kb.get_dependent_facts("ルールにない事実") == frozenset()
@@ -0,0 +1,246 @@
+"""ビザタイプごとの質問の順序の回帰テスト（すべて「はい」・すべて「いいえ」・乱数で回答した場合）
+
+質問の選び方（同点の場合の順序を含む）を変えた場合は、意図した変更かを確認してから期待値を更新する。
+"""
+import random
+from typing import Callable, List, Tuple
+
+import pytest
+
+from app.services.consultation import Consultation
+from app.services.decision_tree import compile_decision_tree
+from app.services.rule_repository import DEFAULT_RULES_FILE, RuleSet, compute_rules_version, parse_rules
+
+# ビザタイプ → 回答の仕方 → (質問の順序, 結論)
+EXPECTED = {
+    'B': {
+        'yes': (
+            [
+                '1回の滞在期間は6か月を越えません',
+                '研修内容は商用の範囲です',
+                '研修期間は６か月以内です',
+            ],
+            ['Bビザの申請ができます', 'B-1 in lieu of H3ビザの申請ができます'],
+        ),
+        'no': (
+            [
+                '1回の滞在期間は6か月を越えません',
+                '研修内容は商用の範囲です',
+                '研修期間は６か月以内です',
+                'アメリカでの活動は商用の範囲です',
+                'アメリカの会社に販売した装置や設備のための作業をします',
+                '装置や設備の販売を示す契約書や発注書があります',
+                '1回の滞在期間は90日を越えます',
+            ],
+            [],
+        ),
+        'random': (
+            [
+                '1回の滞在期間は6か月を越えません',
+                '研修内容は商用の範囲です',
+                '研修期間は６か月以内です',
+                'アメリカでの活動は商用の範囲です',
+                'アメリカの会社に販売した装置や設備のための作業をします',
+                '装置や設備の販売を示す契約書や発注書があります',
+                '1回の滞在期間は90日を越えます',
+            ],
+            [],
+        ),
+    },
+    'E': {
+        'yes': (
+            [
+                '申請者と会社の国籍が同じです',
+                '減価償却前の設備や建物が30万ドル以上財務諸表の資産に計上されています',
+                '会社の行う貿易の50％が日米間です',
+                '会社の行う貿易は継続的です',
+                '貿易による利益が会社の経費の80％以上をカバーしています',
+                '理系の大学院卒で、米国拠点の技術系の業務に深く関連する3年以上の業務経験があります',
+            ],
+            ['Eビザでの申請ができます'],
+        ),
+        'no': (
+            [
+                '申請者と会社の国籍が同じです',
+                '減価償却前の設備や建物が30万ドル以上財務諸表の資産に計上されています',
+                '30万ドル以上で企業を買収した会社か、買収された会社です',
+                'まだ十分な売り上げがなく、これまでに人件費などのランニングコストを含め、30万ドル以上支出しています',
+                '会社設立のために、30万ドル以上支出しました（不動産を除く）',
+                '会社の行う貿易の50％が日米間です',
+                '会社の行う貿易は継続的です',
+                '貿易による利益が会社の経費の80％以上をカバーしています',
+                '理系の大学院卒で、米国拠点の技術系の業務に深く関連する3年以上の業務経験があります',
+                '理系の学部卒で、米国拠点の技術系の業務に深く関連する4年以上の業務経験があります',
+                '米国拠点の業務に深く関連する5年以上の業務経験があります',
+                '2年以内の期間で、目的を限定した派遣理由を説明できます',
+                '米国拠点の業務に深く関連する2年以上の業務経験があります',
+                'CEOなどのオフィサーのポジションに就きます',
+                '経営企画のマネージャーなど、米国拠点の経営に関わるポジションに就きます',
+                '評価・雇用に責任を持つ複数のフルタイムのスタッフを部下に持つマネージャー以上のポジションに就きます',
+                '米国拠点のポジションの業務に深く関連する業務の経験が2年以上あります',
+                '2年以上のマネージャー経験があります',
+                'マネジメントが求められるプロジェクトマネージャーなどの2年以上の経験があります',
+            ],
+            [],
+        ),
+        'random': (
+            [
+                '申請者と会社の国籍が同じです',
+                '減価償却前の設備や建物が30万ドル以上財務諸表の資産に計上されています',
+                '30万ドル以上で企業を買収した会社か、買収された会社です',
+                '会社の行う貿易の50％が日米間です',
+                '会社の行う貿易は継続的です',
+                '貿易による利益が会社の経費の80％以上をカバーしています',
+                '理系の大学院卒で、米国拠点の技術系の業務に深く関連する3年以上の業務経験があります',
+            ],
+            ['Eビザでの申請ができます'],
+        ),
+    },
+    'H-1B': {
+        'yes': (
+            [
+                '大卒以上で、専攻内容と業務内容が一致しています',
+            ],
+            ['H-1Bビザでの申請ができます'],
+        ),
+        'no': (
+            [
+                '大卒以上で、専攻内容と業務内容が一致しています',
+                '大卒以上で、専攻内容と業務内容が異なりますが、実務経験が3年以上あります',
+                '大卒以上ではありませんが、実務経験が(高卒は12年以上、高専卒は3年以上）あります',
+                'H-1Bビザが必要な専門性の高い作業をします',
+                '1回の滞在期間は6か月を越えません',
+            ],
+            [],
+        ),
+        'random': (
+            [
+                '大卒以上で、専攻内容と業務内容が一致しています',
+                '大卒以上で、専攻内容と業務内容が異なりますが、実務経験が3年以上あります',
+                '大卒以上ではありませんが、実務経験が(高卒は12年以上、高専卒は3年以上）あります',
+            ],
+            ['H-1Bビザでの申請ができます'],
+        ),
+    },
+    'J-1': {
+        'yes': (
+            [
+                '研修にOJTが含まれます',
+                '研修期間は18か月以内です',
+                '申請者に研修に必要な英語力はあります',
+            ],
+            ['J-1ビザの申請ができます'],
+        ),
+        'no': (
+            [
+                '研修にOJTが含まれます',
+                '研修期間は18か月以内です',
+                '申請者に研修に必要な英語力はあります',
+            ],
+            [],
+        ),
+        'random': (
+            [
+                '研修にOJTが含まれます',
+                '研修期間は18か月以内です',
+                '申請者に研修に必要な英語力はあります',
+            ],
+            [],
+        ),
+    },
+    'L': {
+        'yes': (
+            [
+                'アメリカ以外からアメリカへのグループ内での異動です',
+                '直近3年のうち1年以上、アメリカ以外のグループ会社に所属していました',
+                'アメリカにある子会社の売り上げの合計が25百万ドル以上です',
+                'Lビザ（Individual）のマネージャーまたはスタッフの条件を満たします',
+                'Lビザ 質問6',
+            ],
+            ['Lビザ（Individual）での申請ができます'],
+        ),
+        'no': (
+            [
+                'アメリカ以外からアメリカへのグループ内での異動です',
+                '直近3年のうち1年以上、アメリカ以外のグループ会社に所属していました',
+                'アメリカにある子会社の売り上げの合計が25百万ドル以上です',
+                'アメリカにある子会社が1,000人以上ローカル採用をしています',
+                '1年間に10人以上Lビザのペティション申請をしています',
+                'Lビザ（Individual）のマネージャーまたはスタッフの条件を満たします',
+                'Lビザ 質問6',
+                'マネージャーとしての経験があります',
+                'アメリカでの業務はマネージャーとみなされます',
+                'specialized knowledgeがあります',
+                'アメリカでの業務はspecialized knowledgeを必要とします',
+            ],
+            [],
+        ),
+        'random': (
+            [
+                'アメリカ以外からアメリカへのグループ内での異動です',
+                '直近3年のうち1年以上、アメリカ以外のグループ会社に所属していました',
+                'アメリカにある子会社の売り上げの合計が25百万ドル以上です',
+                'Lビザ（Individual）のマネージャーまたはスタッフの条件を満たします',
+                'Lビザ 質問6',
+                'マネージャーとしての経験があります',
+                'アメリカでの業務はマネージャーとみなされます',
+                'specialized knowledgeがあります',
+                'アメリカでの業務はspecialized knowledgeを必要とします',
+                'アメリカにある子会社が1,000人以上ローカル採用をしています',
+                '1年間に10人以上Lビザのペティション申請をしています',
+            ],
+            [],
+        ),
+    },
+}
+
+
+@pytest.fixture(scope="module")
+def rule_set() -> RuleSet:
+    with open(DEFAULT_RULES_FILE, "rb") as f:
+        content = f.read()
+    return RuleSet(parse_rules(content), compute_rules_version(content))
+
+
+def answer_function(visa_type: str, path: str) -> Callable[[str], bool]:
+    """回答の仕方（random は乱数の種をビザタイプごとに固定）"""
+    if path == "yes":
+        return lambda question: True
+    if path == "no":
+        return lambda question: False
+    rnd = random.Random(f"{visa_type}-0")
+    return lambda question: rnd.random() < 0.5
+
+
+def walk(consultation: Consultation, answer: Callable[[str], bool]) -> Tuple[List[str], List[str]]:
+    """API と同じ順序で診断を最後まで進め、質問の順序と結論を返す"""
+    consultation.start()
+    questions = []
+    question = consultation.get_next_question()
+    while question is not None and not consultation.is_finished():
+        questions.append(question)
+        consultation.answer_question(question, answer(question))
+        question = consultation.get_next_question()
+    return questions, consultation.get_conclusions()
+
+
+def test_all_visa_types_are_pinned(rule_set):
+    assert sorted(EXPECTED) == rule_set.visa_types()
+
+
+@pytest.mark.parametrize("path", ["yes", "no", "random"])
+@pytest.mark.parametrize("visa_type", sorted(EXPECTED))
+def test_question_sequence(rule_set, visa_type, path):
+    questions, conclusions = walk(Consultation(rule_set.get(visa_type)), answer_function(visa_type, path))
+    assert (questions, conclusions) == (list(EXPECTED[visa_type][path][0]), list(EXPECTED[visa_type][path][1]))
+
+
+@pytest.mark.parametrize("path", ["yes", "no", "random"])
+@pytest.mark.parametrize("visa_type", sorted(EXPECTED))
+def test_decision_tree_question_sequence(rule_set, visa_type, path):
+    """コンパイルした決定木でも同じ順序で質問する"""
+    kb = rule_set.get(visa_type)
+    consultation = Consultation(kb, decision_tree=compile_decision_tree(kb))
+    assert consultation.decision_tree is not None
+    questions, conclusions = walk(consultation, answer_function(visa_type, path))
+    assert (questions, conclusions) == (list(EXPECTED[visa_type][path][0]), list(EXPECTED[visa_type][path][1]))
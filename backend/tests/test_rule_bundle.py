@@ -0,0 +1,76 @@
+"""ルールバンドルの読み込みと、壊れたバンドルから rules.json への切り替え"""
+import marshal
+import shutil
+
+import pytest
+
+from app.services import rule_bundle
+from app.services.rule_repository import (
+    DEFAULT_RULES_FILE, RuleRepository, RuleSet, compute_rules_version, read_rules,
+)
+
+
+@pytest.fixture
+def rules_file(tmp_path) -> str:
+    path = str(tmp_path / "rules.json")
+    shutil.copyfile(DEFAULT_RULES_FILE, path)
+    return path
+
+
+def rules_version_of(path: str) -> str:
+    with open(path, "rb") as f:
+        return compute_rules_version(f.read())
+
+
+def save_bundle(rules_file: str, bundle_file: str) -> RuleSet:
+    """rules.json から読み込んだルール一式をバンドルに保存"""
+    rule_set = RuleSet(read_rules(rules_file), rules_version_of(rules_file), decision_trees_file=None)
+    rule_set.save_bundle(bundle_file)
+    return rule_set
+
+
+def write_bundle(path: str, rules_version: str, payload):
+    """ヘッダーは正しく、本体を任意の値にしたバンドルを書き込む"""
+    with open(path, "wb") as f:
+        f.write(rule_bundle._HEADER.pack(rule_bundle.MAGIC, rule_bundle.FORMAT_VERSION, rules_version.encode("ascii")))
+        marshal.dump(payload, f)
+
+
+def test_round_trip(rules_file, tmp_path):
+    bundle_file = str(tmp_path / "rules.bundle")
+    rule_set = save_bundle(rules_file, bundle_file)
+
+    rules, subsets = rule_bundle.load_rule_bundle(bundle_file, rule_set.rules_version)
+    assert [rule.to_dict() for rule in rules] == [rule.to_dict() for rule in rule_set.rules]
+    for visa_type in rule_set.visa_types():
+        assert [rule.id for rule in subsets[visa_type]] == [rule.id for rule in rule_set.get(visa_type).rules]
+    assert rule_bundle.load_rule_bundle(bundle_file, "0" * 16) is None
+
+
+@pytest.mark.parametrize("payload", [
+    None,
+    [],
+    {},
+    {"facts": ["a"], "rules": []},  # subsets がない
+    {"facts": ["a"], "rules": [("r1", (0,), (True,), "AND", 5, True, 100, None)], "subsets": {}},  # 事実の番号が範囲外
+    {"facts": ["a", "b"], "rules": [("r1", (0,), (True,), "AND", 1)], "subsets": {}},  # ルールの要素が足りない
+    {"facts": ["a", "b"], "rules": [("r1", (0,), (True,), "AND", 1, True, 100, None)], "subsets": {"E": [3]}},
+    {"facts": ["a", "b"], "rules": [], "subsets": []},
+])
+def test_malformed_bundle_falls_back_to_rules_json(rules_file, tmp_path, payload):
+    """構造が異なるバンドルは読み込まず、rules.json からルールを読み込む"""
+    version = rules_version_of(rules_file)
+    bundle_file = str(tmp_path / "rules.bundle")
+    write_bundle(bundle_file, version, payload)
+    assert rule_bundle.load_rule_bundle(bundle_file, version) is None
+
+    repository = RuleRepository(rules_file, decision_trees_file=None, bundle_file=bundle_file)
+    assert [rule.id for rule in repository.current.rules] == [rule.id for rule in read_rules(rules_file)]
+
+
+def test_truncated_bundle(rules_file, tmp_path):
+    bundle_file = str(tmp_path / "rules.bundle")
+    rule_set = save_bundle(rules_file, bundle_file)
+    with open(bundle_file, "r+b") as f:
+        f.truncate(rule_bundle._HEADER.size + 100)
+    assert rule_bundle.load_rule_bundle(bundle_file, rule_set.rules_version) is None
@@ -0,0 +1,142 @@
+"""共有の保存先（SQLite・Redis）を使う PersistentSessionStore の複数ワーカー間の動作（保存の競合・回答の再現・有効期限）"""
+from typing import Dict, List
+
+import pytest
+
+from app.services.consultation import Consultation
+from app.services.rule_repository import DEFAULT_RULES_FILE, RuleSet, compute_rules_version, parse_rules
+from app.services.session_backends import FakeRedis, RedisSessionBackend, SQLiteSessionBackend
+from app.services.session_store import PersistentSessionStore
+
+
+@pytest.fixture(scope="module")
+def rule_sets() -> List[RuleSet]:
+    """同じルールを、再読み込みの前後の2つのバージョンとして読み込んだルール一式"""
+    with open(DEFAULT_RULES_FILE, "rb") as f:
+        content = f.read()
+    return [RuleSet(parse_rules(data), compute_rules_version(data)) for data in (content, content + b"\n")]
+
+
+def make_restore(*rule_sets: RuleSet):
+    """保存された回答を再現する復元関数（ワーカーが読み込んでいるルール一式、先頭が現在のルール）
+
+    routes._restore_consultation と同じく、開始時のルールがなければ現在のルールで再現する。
+    """
+    def restore(state: Dict) -> Consultation:
+        rule_set = next((r for r in rule_sets if r.rules_version == state["rules_version"]), rule_sets[0])
+        consultation = Consultation(rule_set.get(state["visa_type"]))
+        fact_table = consultation.kb.fact_table
+        consultation.replay([(fact_table.intern(fact_name), answer) for fact_name, answer in state["answers"]])
+        return consultation
+    return restore
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backends(request, tmp_path):
+    """同じ保存先を参照する2つのワーカーの保存先"""
+    if request.param == "sqlite":
+        path = str(tmp_path / "sessions.db")
+        return SQLiteSessionBackend(path), SQLiteSessionBackend(path)
+    client = FakeRedis()
+    return RedisSessionBackend(client), RedisSessionBackend(client)
+
+
+def test_listeners_follow_reloaded_rules(rule_sets, backends):
+    """別のワーカーが新しいルールで保存した場合、リスナーは復元し直した診断に移り state を受け取る"""
+    old_rules, new_rules = rule_sets
+    # ワーカー A は古いルールで診断を開始した後にルールを再読み込みし、ワーカー B は新しいルールのみを持つ
+    worker_a = PersistentSessionStore(backends[0], make_restore(new_rules, old_rules))
+    worker_b = PersistentSessionStore(backends[1], make_restore(new_rules))
+
+    session_a = worker_a.create(Consultation(old_rules.get("E")))
+    events = []
+    listener = lambda event, data: events.append((event, data))  # noqa: E731
+    old_consultation = session_a.consultation
+    old_consultation.add_listener(listener)
+
+    # ルールを再読み込みしたワーカーが回答して保存する
+    session_b = worker_b.get(session_a.session_id)
+    assert worker_b.sync(session_b)
+    question = session_b.consultation.get_next_question()
+    session_b.consultation.answer_question(question, True)
+    assert worker_b.save(session_b)
+
+    assert worker_a.sync(session_a)
+    assert session_a.consultation is not old_consultation
+    assert session_a.consultation.kb.rules_version == new_rules.rules_version
+    assert not old_consultation._listeners
+    assert events[-1][0] == "state"
+    assert events[-1][1]["answer_history"] == {question: True}
+
+    # ストリームの終了時の登録解除は、置き換わった診断に対して行われる
+    session_a.consultation.remove_listener(listener)
+    assert not session_a.consultation._listeners
+
+
+def test_concurrent_saves(rule_sets, backends):
+    """別のワーカーが先に保存した場合は保存せず、sync() で保存先の回答を再現してからやり直す"""
+    rules = rule_sets[0]
+    worker_a = PersistentSessionStore(backends[0], make_restore(rules))
+    worker_b = PersistentSessionStore(backends[1], make_restore(rules))
+    session_a = worker_a.create(Consultation(rules.get("E")))
+    session_b = worker_b.get(session_a.session_id)
+    question = session_a.consultation.get_next_question()
+    assert worker_b.sync(session_b) and session_b.consultation.get_next_question() == question
+
+    session_a.consultation.answer_question(question, True)
+    session_b.consultation.answer_question(question, False)
+    assert worker_a.save(session_a)
+    assert not worker_b.save(session_b)
+
+    # 再現した回答は、保存したワーカーの回答と同じ
+    consultation_b = session_b.consultation
+    assert worker_b.sync(session_b)
+    assert session_b.consultation is consultation_b
+    assert session_b.consultation.get_answer_steps() == [(question, True)]
+    assert session_b.consultation.get_state()["facts"] == session_a.consultation.get_state()["facts"]
+    assert session_b.consultation.get_next_question() == session_a.consultation.get_next_question()
+
+    next_question = session_b.consultation.get_next_question()
+    session_b.consultation.answer_question(next_question, False)
+    assert worker_b.save(session_b)
+    assert worker_a.sync(session_a)
+    assert session_a.consultation.get_answer_steps() == [(question, True), (next_question, False)]
+
+
+def test_replay_keeps_listeners(rule_sets, backends):
+    """同じルールで別のワーカーが更新した場合は、リスナーを残したまま回答を再現して通知する"""
+    rules = rule_sets[0]
+    worker_a = PersistentSessionStore(backends[0], make_restore(rules))
+    worker_b = PersistentSessionStore(backends[1], make_restore(rules))
+    session_a = worker_a.create(Consultation(rules.get("B")))
+    events = []
+    session_a.consultation.add_listener(lambda event, data: events.append(event))
+
+    session_b = worker_b.get(session_a.session_id)
+    assert worker_b.sync(session_b)
+    question = session_b.consultation.get_next_question()
+    session_b.consultation.answer_question(question, True)
+    assert worker_b.save(session_b)
+
+    consultation = session_a.consultation
+    assert worker_a.sync(session_a)
+    assert session_a.consultation is consultation
+    assert consultation._listeners
+    assert events[0] == "state"
+    assert "question" in events and "fact" in events
+
+
+def test_ttl_extended_by_reads(rule_sets, tmp_path):
+    """読み込みだけのリクエストでも有効期限を延長し、操作がなければ期限切れになる"""
+    now = [1000.0]
+    clock = lambda: now[0]  # noqa: E731
+    backend = SQLiteSessionBackend(str(tmp_path / "sessions.db"), clock=clock)
+    store = PersistentSessionStore(backend, make_restore(rule_sets[0]), ttl_seconds=100, clock=clock)
+    session = store.create(Consultation(rule_sets[0].get("E")))
+
+    for _ in range(10):
+        now[0] += 60
+        assert store.sync(store.get(session.session_id))
+    now[0] += 150
+    assert not store.sync(store.get(session.session_id))
+    assert store.get(session.session_id) is None
@@ -0,0 +1,62 @@
+"""前の質問に戻る・回答を書き換えた後の状態と、残った回答を最初から再現した状態の比較"""
+import random
+
+import pytest
+
+from app.services.consultation import Consultation
+from app.services.rule_repository import build_knowledge_base, read_rules
+from tests.test_inference_equivalence import random_rules
+
+VISA_TYPES = [None, "E", "L", "B", "H-1B", "J-1"]
+
+
+def assert_same_as_replay(consultation: Consultation):
+    """ジャーナルで取り消した状態が、残った回答を最初から再現した状態と一致する"""
+    replayed = Consultation(consultation.kb)
+    replayed.replay(consultation.get_answer_steps())
+
+    state = consultation.get_state()
+    expected = replayed.get_state()
+    assert state["facts"] == expected["facts"]
+    assert consultation.engine.fired_rules == replayed.engine.fired_rules
+    assert consultation.evaluate() == replayed.evaluate()
+
+
+def random_operations(kb, rnd: random.Random, operations: int):
+    """回答・回答の書き換え・go_back(n)・jump_to_question をランダムに行い、毎回再現と比べる"""
+    consultation = Consultation(kb)
+    consultation.start()
+    for _ in range(operations):
+        question = consultation.get_next_question()
+        choice = rnd.random()
+        if choice < 0.15 and len(consultation.question_history) > 1:
+            consultation.go_back(rnd.randint(1, len(consultation.question_history) - 1))
+        elif choice < 0.3 and consultation.question_history:
+            consultation.jump_to_question(rnd.choice(consultation.question_history))
+        elif choice < 0.45 and consultation.answer_history:
+            # 回答済みの質問への回答の書き換え
+            fact_name = rnd.choice(sorted(consultation.answer_history))
+            consultation.answer_question(fact_name, not consultation.answer_history[fact_name])
+        elif question is not None:
+            consultation.answer_question(question, rnd.random() < 0.5)
+        if rnd.random() < 0.5:
+            # 推論エンジンへの反映を遅らせた回答と、反映済みの回答が混ざるようにする
+            consultation.get_state()
+        assert_same_as_replay(consultation)
+
+
+@pytest.mark.parametrize("visa_type", VISA_TYPES)
+def test_shipped_rules(visa_type):
+    kb = build_knowledge_base(read_rules(), visa_type)
+    rnd = random.Random(visa_type or "all")
+    for _ in range(30):
+        random_operations(kb, rnd, operations=25)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_rules(seed):
+    rnd = random.Random(seed)
+    for _ in range(5):
+        kb = build_knowledge_base(random_rules(rnd, rnd.randint(1, 40), rnd.randint(2, 30)))
+        for _ in range(5):
+            random_operations(kb, rnd, operations=15)
@@ -0,0 +1,74 @@
+"""VectorizedEvaluator の事実の行列と、InferenceEngine で1行ずつ前向き推論した事実の比較"""
+import random
+
+import pytest
+
+from app.services.inference_engine import InferenceEngine
+from app.services.rule_repository import build_knowledge_base, read_rules
+from tests.test_inference_equivalence import VISA_TYPES, random_rules
+
+np = pytest.importorskip("numpy")
+
+from app.services.vectorized_evaluator import VectorizedEvaluator  # noqa: E402
+
+
+def random_answer_sets(kb, rnd: random.Random, count: int):
+    """基本事実の一部に回答した回答の一覧（すべて未回答・すべて回答済みの行も含める）"""
+    basic_facts = sorted(kb.basic_facts)
+    answer_sets = [{}, {name: True for name in basic_facts}, {name: False for name in basic_facts}]
+    for _ in range(count):
+        answered = rnd.sample(basic_facts, rnd.randint(0, len(basic_facts)))
+        answer_sets.append({name: rnd.random() < 0.5 for name in answered})
+    return answer_sets
+
+
+def check_rows(kb, rnd: random.Random, count: int):
+    """すべての行の事実（判明している事実とその値）と診断結果が推論エンジンと一致することの確認"""
+    evaluator = VectorizedEvaluator(kb)
+    assert evaluator.sequential == kb.has_conflicting_conclusions
+    answer_sets = random_answer_sets(kb, rnd, count)
+    values, known = evaluator.encode_answers(answer_sets)
+    # 小さいまとまりに分けて評価しても結果は同じ
+    known_out, true_out = evaluator.evaluate(values, known, chunk_rows=7)
+    conclusions = evaluator.get_conclusions(true_out)
+
+    for row, answers in enumerate(answer_sets):
+        engine = InferenceEngine(kb)
+        for fact_name, value in answers.items():
+            engine.assert_fact(fact_name, value)
+        engine.forward_chain()
+        assert evaluator.to_facts(known_out, true_out, row) == engine.facts, answers
+        actual = [kb.conclusion_facts[index] for index in np.flatnonzero(conclusions[row])]
+        assert actual == engine.get_conclusions()
+
+
+@pytest.mark.parametrize("visa_type", VISA_TYPES)
+def test_shipped_rules(visa_type):
+    kb = build_knowledge_base(read_rules(), visa_type)
+    check_rows(kb, random.Random(visa_type or "all"), 200)
+
+
+def without_conflicts(rules):
+    """同じ事実を結論とするルールの結論の値を、最初のルールの値にそろえる"""
+    values = {}
+    for rule in rules:
+        rule.conclusion_value = values.setdefault(rule.conclusion, rule.conclusion_value)
+    return rules
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("conflicting", [False, True])
+def test_random_rules(seed, conflicting):
+    rnd = random.Random(seed)
+    for _ in range(10):
+        rules = random_rules(rnd, rnd.randint(1, 40), rnd.randint(2, 30))
+        kb = build_knowledge_base(rules if conflicting else without_conflicts(rules))
+        check_rows(kb, rnd, 50)
+
+
+def test_random_rules_cover_both_modes():
+    """合成ルールで、層ごとの評価とルールを1つずつ適用する評価の両方を確認していることの確認"""
+    rnd = random.Random(0)
+    rules = [random_rules(rnd, 40, 10) for _ in range(5)]
+    assert any(build_knowledge_base(r).has_conflicting_conclusions for r in rules)
+    assert not any(build_knowledge_base(without_conflicts(r)).has_conflicting_conclusions for r in rules)
@@ -1,10 +1,25 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import DiagnosisPanel from './components/DiagnosisPanel';
 import VisualizationPanel from './components/VisualizationPanel';
 import VisaTypeSelection from './components/VisaTypeSelection';
 
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000/api';
 
+// 前回の可視化データに差分（変更されたルールと事実）を反映
+const mergeVisualization = (previous, diff) => {
+  const changedRules = new Map(diff.rules.map(rule => [rule.rule_id, rule]));
+  const facts = { ...previous.facts, ...diff.facts };
+  diff.removed_facts.forEach(factName => {
+    delete facts[factName];
+  });
+  return {
+    ...diff,
+    full: true,
+    rules: previous.rules.map(rule => changedRules.get(rule.rule_id) || rule),
+    facts,
+  };
+};
+
 function App() {
   const [selectedVisaType, setSelectedVisaType] = useState(null);
   const [currentQuestion, setCurrentQuestion] = useState(null);
@@ -14,6 +29,15 @@ function App() {
   const [questionHistory, setQuestionHistory] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  // /consultation/start が返すセッションID（以降のリクエストで X-Session-ID として送信）
+  const sessionIdRef = useRef(null);
+  // 前回取得した可視化データ（次回は差分のみを取得する）
+  const visualizationRef = useRef(null);
+
+  const sessionHeaders = (headers = {}) => ({
+    ...headers,
+    'X-Session-ID': sessionIdRef.current,
+  });
 
   const startConsultation = async (visaType) => {
     setLoading(true);
@@ -30,6 +54,8 @@ function App() {
         }),
       });
       const data = await response.json();
+      sessionIdRef.current = data.session_id;
+      visualizationRef.current = null;
       setCurrentQuestion(data.next_question);
       setQuestionHistory(data.next_question ? [data.next_question] : []);
       setConclusions([]);
@@ -45,9 +71,15 @@ function App() {
 
   const fetchVisualization = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/consultation/visualization`);
+      const previous = visualizationRef.current;
+      const query = previous ? `?since=${encodeURIComponent(previous.version)}` : '';
+      const response = await fetch(`${API_BASE_URL}/consultation/visualization${query}`, {
+        headers: sessionHeaders(),
+      });
       const data = await response.json();
-      setVisualizationData(data);
+      const merged = previous && data.full === false ? mergeVisualization(previous, data) : data;
+      visualizationRef.current = merged.version ? merged : null;
+      setVisualizationData(merged);
     } catch (err) {
       console.error('Error fetching visualization:', err);
     }
@@ -59,9 +91,9 @@ function App() {
     try {
       const response = await fetch(`${API_BASE_URL}/consultation/answer`, {
         method: 'POST',
-        headers: {
+        headers: sessionHeaders({
           'Content-Type': 'application/json',
-        },
+        }),
         body: JSON.stringify({
           question: question,
           answer: answer,
@@ -92,6 +124,7 @@ function App() {
     try {
       const response = await fetch(`${API_BASE_URL}/consultation/back`, {
         method: 'POST',
+        headers: sessionHeaders(),
       });
       const data = await response.json();
 
@@ -114,6 +147,8 @@ function App() {
 
   const handleRestart = () => {
     // ビザタイプ選択画面に戻る
+    sessionIdRef.current = null;
+    visualizationRef.current = null;
     setSelectedVisaType(null);
     setCurrentQuestion(null);
     setQuestionHistory([]);